@@ -0,0 +1,215 @@
+"""Cálculos de readiness, líneas basales y eficiencia, sin dependencias de Streamlit.
+
+Las páginas y el servicio JSON (`api_server.py`) usan las mismas funciones: aquí no se leen
+secretos ni se pintan errores; los fallos de la API llegan como excepciones de `requests`.
+"""
+import pandas as pd
+
+import readiness_rules
+from data_cache import bounded_cache, compact_frame
+from instrumentation import http_get, timed
+
+RIDE_TYPES = ('Ride', 'VirtualRide')
+READINESS_WINDOW_DAYS = 84
+EFFICIENCY_PERIODS = (7, 30, 60)
+
+
+# --- DATOS ---
+@bounded_cache(ttl=3600, compact=compact_frame)
+def fetch_wellness(athlete_id, api_key, start_date, end_date):
+    """Bienestar del rango indexado por día (DataFrame compacto de solo lectura)."""
+    params = {'oldest': start_date.strftime('%Y-%m-%d'), 'newest': end_date.strftime('%Y-%m-%d')}
+    response = http_get(f"https://intervals.icu/api/v1/athlete/{athlete_id}/wellness", auth=('API_KEY', api_key), params=params)
+    response.raise_for_status()
+    df = pd.DataFrame(response.json() or [])
+    if df.empty:
+        return df
+    df['id'] = pd.to_datetime(df['id'])
+    return df.set_index('id').sort_index()
+
+
+@bounded_cache(ttl=3600)
+def fetch_activities(athlete_id, api_key, start_date, end_date):
+    """Actividades del rango como lista de dicts JSON."""
+    params = {'oldest': start_date.strftime('%Y-%m-%d'), 'newest': end_date.strftime('%Y-%m-%d')}
+    response = http_get(f"https://intervals.icu/api/v1/athlete/{athlete_id}/activities", auth=('API_KEY', api_key), params=params)
+    response.raise_for_status()
+    return response.json() or []
+
+
+# --- READINESS ---
+def score_readiness(df, selected_date, rules=None):
+    """Puntuación de readiness de `selected_date` con las reglas dadas (por defecto, las de `readiness_rules`).
+
+    `df` es el bienestar diario indexado por día, con los días anteriores que usan las líneas basales.
+    Devuelve (puntuación, nivel, desglose), con una entrada del desglose por señal que puntúa.
+    """
+    evaluator = readiness_rules.compile_rules(rules)
+    day = pd.Timestamp(selected_date).normalize()
+    scored = evaluator.score(df[df.index <= day])
+    score = scored.at[day, 'score']
+    return int(score) if float(score).is_integer() else float(score), scored.at[day, 'level'], evaluator.breakdown(scored, day)
+
+
+def breakdown_text(item):
+    """Línea en Markdown de una entrada del desglose de `score_readiness`."""
+    value = f"{item['value']:.{item['decimals']}f}{item['unit']}"
+    if item.get('normal_range'):
+        lower, upper = (f"{v:.{item['decimals']}f}{item['unit']}" for v in item['normal_range'])
+        return f"**{item['label']}:** `{value}`. Rango normal: `{lower} - {upper}` → **{item['points']} ptos**."
+    return f"**{item['label']}:** `{value}` → **{item['points']} ptos**."
+
+
+@timed()
+def calculate_baselines(daily_df):
+    """Calcula las 3 líneas basales (recuperación, crónica e histórica) a partir de datos diarios."""
+    baselines = {
+        'recovery': pd.Series(dtype='float64'),
+        'chronic': pd.Series(dtype='float64'),
+        'historic': pd.Series(dtype='float64')
+    }
+    if daily_df.empty or len(daily_df) < 7:
+        return baselines
+
+    weekly_df = daily_df[['atl', 'restingHR', 'hrv']].resample('W-SUN').mean().dropna()
+
+    if weekly_df.empty:
+        return baselines
+
+    avg_atl = weekly_df['atl'].mean()
+    low_load_weeks = weekly_df[weekly_df['atl'] <= avg_atl]
+    baselines['recovery'] = low_load_weeks[['restingHR', 'hrv']].mean()
+
+    if len(weekly_df) >= 4:
+        baselines['chronic'] = weekly_df[['restingHR', 'hrv']].tail(4).mean()
+
+    if len(weekly_df) >= 8:
+        baselines['historic'] = weekly_df[['restingHR', 'hrv']].tail(8).mean()
+
+    return baselines
+
+
+def day_summary(df, selected_date, rules=None):
+    """Puntuación, nivel y métricas de `selected_date` frente a los días anteriores de `df` (indexado por día).
+
+    Devuelve {"error": ...} si no hay datos de ese día.
+    """
+    day = pd.Timestamp(selected_date).normalize()
+    if df.empty or day not in df.index:
+        return {"error": f"No hay datos de bienestar para el día {day.strftime('%d-%m-%Y')}"}
+
+    today_data = df.loc[day]
+    past_df = df[df.index < day]
+    score, level, breakdown = score_readiness(df, day, rules)
+    return {
+        "level": level, "readiness_score": score, "score_breakdown": breakdown,
+        "hrv_7d_data": past_df['hrv'].tail(7), "rhr_7d_data": past_df['restingHR'].tail(7),
+        "metrics": {
+            "FC Reposo": {"value": today_data.get('restingHR'), "avg7": past_df['restingHR'].tail(7).mean()},
+            "VFC (HRV)": {"value": today_data.get('hrv'), "avg7": past_df['hrv'].tail(7).mean()},
+            "Puntuación Sueño": {"value": today_data.get('sleepScore')}
+        },
+    }
+
+
+def hrv_trend(df, selected_date):
+    """HRV media de la semana de `selected_date` y de la anterior, y HRV de los 3 últimos días."""
+    day = pd.Timestamp(selected_date).normalize()
+    if df.empty:
+        return {"hrv_current_week_avg": float('nan'), "hrv_last_week_avg": float('nan'), "hrv_last_3_days": pd.Series(dtype='float64')}
+    start_of_current_week = day - pd.Timedelta(days=day.weekday())
+    start_of_last_week = start_of_current_week - pd.Timedelta(days=7)
+    return {
+        "hrv_current_week_avg": df[(df.index >= start_of_current_week) & (df.index <= day)]['hrv'].mean(),
+        "hrv_last_week_avg": df[(df.index >= start_of_last_week) & (df.index < start_of_current_week)]['hrv'].mean(),
+        "hrv_last_3_days": df[df.index <= day]['hrv'].tail(3),
+    }
+
+
+def past_baselines(df, selected_date):
+    """Líneas basales con los días anteriores a `selected_date`."""
+    return calculate_baselines(df[df.index < pd.Timestamp(selected_date).normalize()] if not df.empty else df)
+
+
+@timed()
+def readiness_analysis(df, selected_date, rules=None):
+    """Análisis completo de readiness de `selected_date`: resumen del día, líneas basales y tendencia de HRV."""
+    summary = day_summary(df, selected_date, rules)
+    if "error" in summary:
+        return summary
+    return {**summary, "baselines": past_baselines(df, selected_date), **hrv_trend(df, selected_date)}
+
+
+# --- ACTIVIDADES ---
+ACTIVITY_FIELDS = ['start_date_local', 'type', 'name', 'moving_time', 'icu_training_load', 'icu_intensity',
+                   'icu_weighted_avg_watts', 'average_heartrate', 'max_heartrate', 'icu_ctl', 'icu_atl']
+
+
+def activity_table(activities_raw):
+    """Tabla de salidas en bici con una columna por métrica, construida por columnas (sin bucles por fila).
+
+    `Duración (s)` queda en segundos para poder ordenar; el texto se genera solo para las filas que se muestran.
+    """
+    raw = pd.DataFrame.from_records(activities_raw or [], columns=ACTIVITY_FIELDS)
+    raw = raw[raw['type'].isin(RIDE_TYPES)]
+
+    def numeric(column):
+        return pd.to_numeric(raw[column], errors='coerce')
+
+    ctl, atl = numeric('icu_ctl').fillna(0), numeric('icu_atl').fillna(0)
+    return pd.DataFrame({
+        'Fecha': pd.to_datetime(raw['start_date_local'].fillna('1900-01-01').str[:10], errors='coerce'),
+        'Actividad': raw['name'].fillna('Sin Nombre').astype(str),
+        'Duración (s)': numeric('moving_time').fillna(0),
+        'TSS': numeric('icu_training_load').fillna(0),
+        'IF': numeric('icu_intensity') / 100,
+        'Potencia Norm. (W)': numeric('icu_weighted_avg_watts').fillna(0),
+        'FC Media': numeric('average_heartrate').fillna(0).round(),
+        'FC Máx': numeric('max_heartrate').fillna(0).round(),
+        'CTL': ctl.round(), 'ATL': atl.round(), 'TSB': (ctl - atl).round(),
+    }).reset_index(drop=True)
+
+
+def format_durations(seconds):
+    """Duraciones en segundos como texto '1h 5m' o '45m' (vectorizado)."""
+    minutes = pd.Series(seconds).clip(lower=0).fillna(0).astype('int64') // 60
+    hours, rest = minutes // 60, (minutes % 60).astype(str) + 'm'
+    return (hours.astype(str) + 'h ' + rest).where(hours > 0, rest)
+
+
+# --- EFICIENCIA ---
+def efficiency_frame(activities_raw):
+    """Eficiencia de cada salida en bici (NP/FC, potencia media/FC y Pot/FC en Z2), indexada por fecha."""
+    processed_list = []
+    for activity in activities_raw:
+        if activity.get('type') not in RIDE_TYPES:
+            continue
+
+        power_norm = activity.get("icu_weighted_avg_watts")
+        hr_avg = activity.get("average_heartrate")
+        power_avg = activity.get("icu_average_watts")
+
+        efficiency = round(power_norm / hr_avg, 2) if hr_avg and power_norm and hr_avg > 0 and power_norm > 0 else 0
+        power_hr = round(power_avg / hr_avg, 2) if hr_avg and power_avg and hr_avg > 0 and power_avg > 0 else 0
+
+        processed_list.append({
+            "date": pd.to_datetime(activity.get("start_date_local")),
+            "Actividad": activity.get("name", "N/A"),
+            "Eficiencia (NP/FC)": efficiency,
+            "Potencia/FC": power_hr,
+            "Eficiencia Z2 (Pot/FC)": activity.get("icu_power_hr_z2", 0),
+        })
+
+    if not processed_list:
+        return pd.DataFrame()
+
+    return pd.DataFrame(processed_list).set_index('date').sort_index()
+
+
+def efficiency_averages(df_efficiency, selected_date, periods=EFFICIENCY_PERIODS):
+    """Medias de eficiencia de las últimas N salidas hasta `selected_date` (los ceros cuentan como sin dato)."""
+    averages = {}
+    for period in periods:
+        period_df = df_efficiency[df_efficiency.index.date <= selected_date].tail(period)
+        averages[period] = period_df.select_dtypes(include='number').replace(0, float('nan')).mean()
+    return averages
@@ -0,0 +1,179 @@
+"""Detector incremental de anomalías en bienestar (gráfico de control EWMA con estado persistente)."""
+import copy
+import json
+import math
+import os
+import threading
+from datetime import date
+
+import pandas as pd
+
+from settings import athlete_dir
+
+# Señales vigiladas y dirección "mala" de cada una (+1 = subir es malo, -1 = bajar es malo)
+SIGNALS = {'hrv': -1, 'restingHR': +1, 'sleepScore': -1, 'BodyBatteryMax': -1}
+SIGNAL_LABELS = {'hrv': 'HRV', 'restingHR': 'FC Reposo', 'sleepScore': 'P. Sueño', 'BodyBatteryMax': 'Body Battery'}
+
+ALPHA = 2 / (28 + 1)   # memoria de la línea basal (~28 días)
+LAMBDA = 0.3           # suavizado del estadístico de control
+L = 2.7                # anchura de los límites de control del EWMA
+Z_DAY = 3.0            # umbral de un único día muy fuera de rango
+WINSOR = 3.0           # recorte de valores extremos antes de actualizar la basal
+MIN_DAYS = 14          # días necesarios antes de empezar a alertar
+MAX_FLAGS = 2000       # días anómalos conservados en el historial
+SNAPSHOT_DAYS = 7      # cada cuántos días se guarda una copia del estado para repetir el cálculo
+STATE_VERSION = 2
+
+
+def new_state():
+    """Estado vacío del detector.
+
+    Además del estado actual de cada señal guarda los valores de entrada de cada día procesado y
+    copias del estado de las señales cada `SNAPSHOT_DAYS` días, para poder repetir el cálculo
+    desde un día que llega tarde o se corrige sin empezar de cero.
+    """
+    return {
+        "version": STATE_VERSION,
+        "first_date": None,
+        "last_date": None,
+        "final_through": None,  # Último día con los datos ya completos (anterior a hoy)
+        "signals": _new_signals(),
+        "inputs": {},
+        "snapshots": {},
+        "flags": {},
+    }
+
+
+def _new_signals():
+    return {name: {"n": 0, "mean": None, "var": None, "ewma_z": 0.0} for name in SIGNALS}
+
+
+def _update_signal(sig, value, direction):
+    """Actualiza una señal en O(1) y devuelve su z-score adverso y si está fuera de control."""
+    if sig["n"] == 0:
+        sig.update(n=1, mean=value, var=0.0)
+        return None, False
+
+    std = math.sqrt(sig["var"]) if sig["var"] > 0 else None
+    z = (value - sig["mean"]) / std * direction if std else 0.0
+
+    # Estadístico EWMA sobre z: detecta desviaciones sostenidas aunque ningún día sea extremo
+    sig["ewma_z"] = LAMBDA * z + (1 - LAMBDA) * sig["ewma_z"]
+    limit = L * math.sqrt(LAMBDA / (2 - LAMBDA))
+    out_of_control = sig["n"] >= MIN_DAYS and (z >= Z_DAY or (sig["ewma_z"] >= limit and z > 0))
+
+    # Actualización robusta de la basal: los valores extremos se recortan antes de entrar
+    clipped = min(max(value, sig["mean"] - WINSOR * std), sig["mean"] + WINSOR * std) if std else value
+    diff = clipped - sig["mean"]
+    sig["mean"] += ALPHA * diff
+    sig["var"] = (1 - ALPHA) * (sig["var"] + ALPHA * diff * diff)
+    sig["n"] += 1
+    return z, out_of_control
+
+
+def _process_day(state, day, values):
+    """Incorpora un día al estado de las señales y guarda su marca si alguna está fuera de control."""
+    result = {}
+    for name, direction in SIGNALS.items():
+        value = values.get(name)
+        if value is None:
+            continue
+        z, out_of_control = _update_signal(state["signals"][name], float(value), direction)
+        if out_of_control:
+            result[name] = round(z, 2)
+    if result:
+        state["flags"][day] = {"signals": result, "multi": len(result) >= 2}
+
+
+def _row_values(row):
+    return {name: None if row.get(name) is None or pd.isna(row.get(name)) else float(row[name]) for name in SIGNALS}
+
+
+def update_from_frame(state, df, today=None):
+    """Incorpora los días del DataFrame (índice de fechas) que son nuevos o cuyos valores han cambiado.
+
+    Si llega un día anterior o igual al último procesado (una carga histórica posterior o un valor
+    corregido), se repite el cálculo desde la última copia del estado anterior a ese día. Los días
+    desde `today` (por defecto, hoy) se procesan pero no se dan por cerrados: se vuelven a calcular
+    en cuanto cambian sus datos. Devuelve el número de días procesados.
+    """
+    if df.empty:
+        return 0
+    today = pd.to_datetime(today or date.today()).strftime('%Y-%m-%d')
+    columns = [c for c in SIGNALS if c in df.columns]
+    rows = {day.strftime('%Y-%m-%d'): _row_values(row) for day, row in zip(pd.to_datetime(df.index), df[columns].to_dict('records'))}
+    changed = [day for day, values in rows.items() if state["inputs"].get(day) != values]
+    if not changed:
+        return 0
+    state["inputs"].update(rows)
+
+    start = min(changed)
+    base = max((d for d in state["snapshots"] if d < start), default=None)
+    if base is None:
+        state["signals"], state["flags"], state["snapshots"] = _new_signals(), {}, {}
+    else:
+        state["signals"] = copy.deepcopy(state["snapshots"][base])
+        state["flags"] = {d: f for d, f in state["flags"].items() if d <= base}
+        state["snapshots"] = {d: s for d, s in state["snapshots"].items() if d <= base}
+
+    days = sorted(d for d in state["inputs"] if base is None or d > base)
+    final = [d for d in days if d < today]
+    for day in days:
+        _process_day(state, day, state["inputs"][day])
+        # Copias semanales y la del último día cerrado, desde donde se repetirá el cálculo la próxima vez
+        if day < today and (pd.Timestamp(day).toordinal() % SNAPSHOT_DAYS == 0 or day == final[-1]):
+            state["snapshots"][day] = copy.deepcopy(state["signals"])
+    last_final = max(final, default=state["final_through"])
+    state["snapshots"] = {d: s for d, s in state["snapshots"].items()
+                          if pd.Timestamp(d).toordinal() % SNAPSHOT_DAYS == 0 or d == last_final}
+
+    if len(state["flags"]) > MAX_FLAGS:
+        for old in sorted(state["flags"])[:len(state["flags"]) - MAX_FLAGS]:
+            del state["flags"][old]
+    state["first_date"], state["last_date"] = min(state["inputs"]), max(state["inputs"])
+    state["final_through"] = last_final
+    return len(days)
+
+
+def covers(state, day):
+    """Si el detector tiene datos de `day` (entre el primer y el último día procesados)."""
+    day = pd.to_datetime(day).strftime('%Y-%m-%d')
+    return bool(state["first_date"]) and state["first_date"] <= day <= state["last_date"]
+
+
+def recent_flags(state, until=None, days=None, multi_only=False):
+    """Días anómalos del historial, del más reciente al más antiguo."""
+    items = sorted(state["flags"].items(), reverse=True)
+    if until is not None:
+        until = pd.to_datetime(until).strftime('%Y-%m-%d')
+        items = [(d, f) for d, f in items if d <= until]
+    if days is not None and until is not None:
+        since = (pd.to_datetime(until) - pd.Timedelta(days=days)).strftime('%Y-%m-%d')
+        items = [(d, f) for d, f in items if d > since]
+    if multi_only:
+        items = [(d, f) for d, f in items if f["multi"]]
+    return items
+
+
+def _state_path(athlete_id):
+    return os.path.join(athlete_dir(athlete_id), "anomaly_state.json")
+
+
+def load_state(athlete_id):
+    """Carga el estado persistido del atleta (o uno nuevo si no existe)."""
+    try:
+        with open(_state_path(athlete_id)) as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return new_state()
+    # Los estados de versiones anteriores no guardan las entradas: se recalculan desde los datos
+    return state if state.get("version") == STATE_VERSION else new_state()
+
+
+def save_state(state, athlete_id):
+    """Guarda el estado de forma atómica."""
+    path = _state_path(athlete_id)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
@@ -0,0 +1,227 @@
+"""Servicio HTTP JSON con los análisis de las páginas, para otras herramientas (bot de Slack, esfera del reloj...).
+
+Uso:
+    python api_server.py [--host 127.0.0.1] [--port 8766]
+
+Endpoints (GET; todas las fechas en formato AAAA-MM-DD, por defecto hoy):
+    /readiness?date=               Puntuación, nivel y desglose del día con las reglas del atleta
+    /baselines?date=               Líneas basales de recuperación, crónica (4 semanas) e histórica (8 semanas)
+    /weekly?end=&weeks=4           Resúmenes por semana ISO del almacén local
+    /efficiency?date=&days=60      Eficiencia de cada salida y medias de las últimas 7/30/60
+    /health                        Estado y estadísticas de las cachés
+
+Los cálculos son los de `analytics`, los mismos que usan las páginas. Las respuestas se guardan ya
+serializadas en cachés en memoria (`bounded_cache`) compartidas por todos los hilos, encima de la
+de los datos de la API, así que una petición repetida solo copia bytes. Las notificaciones de
+`ingest` invalidan únicamente las respuestas cuyo rango de fechas incluye los días cambiados.
+"""
+import argparse
+import json
+import math
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import requests
+
+import analytics
+import backfill
+import data_cache
+import ingest
+import readiness_rules
+from data_cache import bounded_cache
+from settings import load_credentials
+
+DEFAULT_WEEKS, MAX_WEEKS = 4, 260
+DEFAULT_EFFICIENCY_DAYS, MAX_EFFICIENCY_DAYS = 60, 730
+
+
+def _plain(value):
+    """Valor serializable en JSON: NaN pasa a null, las Series a dicts y las fechas a texto."""
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    if isinstance(value, pd.Series):
+        return {(k.strftime('%Y-%m-%d') if isinstance(k, pd.Timestamp) else str(k)): _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, (pd.Timestamp, date)):
+        return value.strftime('%Y-%m-%d')
+    if hasattr(value, 'item'):  # escalares de numpy
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def _encode(payload):
+    return json.dumps(_plain(payload), ensure_ascii=False).encode()
+
+
+# --- RESPUESTAS (cacheadas ya serializadas) ---
+@bounded_cache(ttl=3600)
+def readiness_payload(athlete_id, api_key, start, day, rules_version):
+    # `rules_version` solo forma parte de la clave: al cambiar las reglas no se sirven puntuaciones viejas
+    df = analytics.fetch_wellness(athlete_id, api_key, start, day)
+    analysis = analytics.readiness_analysis(df, day, readiness_rules.load_rules(athlete_id))
+    if "error" in analysis:
+        raise LookupError(analysis["error"])
+    m = analysis["metrics"]
+    return _encode({
+        "date": day,
+        "score": analysis["readiness_score"],
+        "level": analysis["level"],
+        "breakdown": analysis["score_breakdown"],
+        "metrics": {
+            "hrv": {"value": m["VFC (HRV)"]["value"], "avg7": m["VFC (HRV)"]["avg7"]},
+            "restingHR": {"value": m["FC Reposo"]["value"], "avg7": m["FC Reposo"]["avg7"]},
+            "sleepScore": {"value": m["Puntuación Sueño"]["value"]},
+        },
+        "hrv_week": {"current": analysis["hrv_current_week_avg"], "previous": analysis["hrv_last_week_avg"]},
+    })
+
+
+@bounded_cache(ttl=3600)
+def baselines_payload(athlete_id, api_key, start, day):
+    df = analytics.fetch_wellness(athlete_id, api_key, start, day)
+    if df.empty:
+        raise LookupError(f"No hay datos de bienestar hasta el día {day.strftime('%d-%m-%Y')}")
+    baselines = analytics.past_baselines(df, day)
+    return _encode({"date": day, **{name: {"restingHR": b.get('restingHR'), "hrv": b.get('hrv')} for name, b in baselines.items()}})
+
+
+@bounded_cache(ttl=3600)
+def weekly_payload(athlete_id, api_key, start, end):
+    try:
+        weekly = backfill.weekly_rollups(athlete_id, api_key, start, end)
+    except requests.exceptions.RequestException:
+        # Sin conexión se sirve lo que haya en el almacén local
+        weekly = backfill.weekly_rollups(athlete_id, api_key, start, end, sync=False)
+    weeks = [{"week": period, **row} for period, row in weekly.iloc[::-1].to_dict(orient='index').items()]
+    return _encode({"end": end, "weeks": weeks})
+
+
+@bounded_cache(ttl=3600)
+def efficiency_payload(athlete_id, api_key, start, day):
+    df = analytics.efficiency_frame(analytics.fetch_activities(athlete_id, api_key, start, day))
+    if df.empty:
+        raise LookupError("No se encontraron salidas en bici en el periodo.")
+    rides = [{"date": ts.strftime('%Y-%m-%d'), "name": row["Actividad"], "efficiency": row["Eficiencia (NP/FC)"],
+              "power_hr": row["Potencia/FC"], "power_hr_z2": row["Eficiencia Z2 (Pot/FC)"]}
+             for ts, row in df.iloc[::-1].iterrows()]
+    averages = {str(period): {"efficiency": avg.get('Eficiencia (NP/FC)'), "power_hr": avg.get('Potencia/FC'),
+                              "power_hr_z2": avg.get('Eficiencia Z2 (Pot/FC)')}
+                for period, avg in analytics.efficiency_averages(df, day).items()}
+    return _encode({"date": day, "averages": averages, "rides": rides})
+
+
+# --- ENDPOINTS ---
+def _date(query, name):
+    value = (query.get(name) or [None])[0]
+    try:
+        return date.fromisoformat(value) if value else date.today()
+    except ValueError:
+        raise ValueError(f"Fecha no válida en `{name}`: {value}")
+
+
+def _int(query, name, default, maximum):
+    value = (query.get(name) or [None])[0]
+    try:
+        number = int(value) if value else default
+    except ValueError:
+        raise ValueError(f"Número no válido en `{name}`: {value}")
+    if not 1 <= number <= maximum:
+        raise ValueError(f"`{name}` debe estar entre 1 y {maximum}.")
+    return number
+
+
+def readiness(athlete_id, api_key, query):
+    day = _date(query, 'date')
+    rules_version = readiness_rules.version(readiness_rules.load_rules(athlete_id))
+    return readiness_payload(athlete_id, api_key, day - timedelta(days=analytics.READINESS_WINDOW_DAYS), day, rules_version)
+
+
+def baselines(athlete_id, api_key, query):
+    day = _date(query, 'date')
+    return baselines_payload(athlete_id, api_key, day - timedelta(days=analytics.READINESS_WINDOW_DAYS), day)
+
+
+def weekly(athlete_id, api_key, query):
+    end, weeks = _date(query, 'end'), _int(query, 'weeks', DEFAULT_WEEKS, MAX_WEEKS)
+    last_monday = end - timedelta(days=end.weekday())
+    return weekly_payload(athlete_id, api_key, last_monday - timedelta(weeks=weeks - 1), end)
+
+
+def efficiency(athlete_id, api_key, query):
+    day, days = _date(query, 'date'), _int(query, 'days', DEFAULT_EFFICIENCY_DAYS, MAX_EFFICIENCY_DAYS)
+    return efficiency_payload(athlete_id, api_key, day - timedelta(days=days - 1), day)
+
+
+def health(athlete_id, api_key, query):
+    return _encode({"status": "ok", "caches": data_cache.cache_stats()})
+
+
+ROUTES = {'/readiness': readiness, '/baselines': baselines, '/weekly': weekly, '/efficiency': efficiency, '/health': health}
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """GET sobre los endpoints de `ROUTES`; los errores se devuelven como {"error": ...}."""
+
+    athlete_id = api_key = None
+    protocol_version = 'HTTP/1.1'  # Conexiones persistentes: los clientes no abren una por petición
+    disable_nagle_algorithm = True  # Sin él, cabeceras y cuerpo en escrituras separadas esperan ~40 ms al ACK
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        route = ROUTES.get(url.path.rstrip('/'))
+        if route is None:
+            return self._reply(404, _encode({"error": "Ruta desconocida."}))
+        ingest.apply_changes(self.athlete_id)
+        try:
+            body = route(self.athlete_id, self.api_key, parse_qs(url.query))
+        except ValueError as e:
+            return self._reply(400, _encode({"error": str(e)}))
+        except LookupError as e:
+            return self._reply(404, _encode({"error": str(e)}))
+        except requests.exceptions.RequestException as e:
+            return self._reply(502, _encode({"error": f"Error al consultar Intervals.icu: {e}"}))
+        self._reply(200, body)
+
+    def _reply(self, status, data):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Una línea por petición en stderr cuesta más que servir la respuesta desde la caché
+
+
+def serve(host, port, athlete_id, api_key):
+    handler = type('Handler', (ApiHandler,), {'athlete_id': athlete_id, 'api_key': api_key})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Sirviendo la API de análisis en http://{host}:{port} (Ctrl+C para salir)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Servicio HTTP JSON con los análisis de readiness, basales, semanas y eficiencia.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    athlete_id, api_key = load_credentials()
+    serve(args.host, args.port, athlete_id, api_key)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Carga histórica reanudable desde Intervals.icu al almacén local.
+
+Uso:
+    python backfill.py --start 2021-01-01 [--end 2026-01-01] [--streams] [--workers 4] [--rate 5]
+    python backfill.py --rebuild-rollups
+
+El rango se divide en bloques de fechas que se descargan en paralelo bajo un
+limitador de ritmo común. Cada bloque se escribe en una sola transacción junto
+con su marca de progreso, así que si la ejecución se interrumpe basta con
+lanzarla de nuevo para continuar donde se quedó. Los resúmenes semanales y
+mensuales (`rollups`) de los días escritos se actualizan en la misma transacción.
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+
+import intervals_client as api
+import local_store
+import rollups
+from anomaly_detector import load_state, save_state, update_from_frame
+from concurrent_fetch import fetch_all
+from settings import load_credentials
+
+KINDS = ('wellness', 'activities', 'events')
+RIDE_TYPES = ('Ride', 'VirtualRide')
+
+
+def date_chunks(start, end, chunk_days):
+    """Divide [start, end] en bloques consecutivos de como mucho `chunk_days` días."""
+    chunks = []
+    current = start
+    while current <= end:
+        chunk_end = min(current + timedelta(days=chunk_days - 1), end)
+        chunks.append((current.isoformat(), chunk_end.isoformat()))
+        current = chunk_end + timedelta(days=1)
+    return chunks
+
+
+def fetch_chunk(kind, chunk, athlete_id, api_key, limiter, with_streams):
+    """Descarga un bloque (en un hilo del pool). Devuelve los registros y, si procede, los streams."""
+    oldest, newest = chunk
+    fetcher = {'wellness': api.fetch_wellness, 'activities': api.fetch_activities, 'events': api.fetch_events}[kind]
+    records = fetcher(athlete_id, api_key, oldest, newest, limiter)
+    streams = []
+    if kind == 'activities' and with_streams:
+        for activity in records:
+            if activity.get('type') in RIDE_TYPES and activity.get('id'):
+                streams.append((activity['id'], api.fetch_streams(activity['id'], api_key, limiter)))
+    return records, streams
+
+
+def checkpoint_kind(kind, with_streams):
+    """Los bloques de actividades descargados con streams llevan su propia marca de progreso."""
+    return f"{kind}+streams" if kind == 'activities' and with_streams else kind
+
+
+def write_chunk(conn, kind, chunk, records, streams, progress_kind):
+    """Escribe un bloque, sus resúmenes y su marca de progreso (si la hay) en una única transacción."""
+    upsert = {'wellness': local_store.upsert_wellness, 'activities': local_store.upsert_activities, 'events': local_store.upsert_events}[kind]
+    with conn:
+        upsert(conn, records)
+        if streams:
+            local_store.put_streams(conn, streams)
+        if kind in ('wellness', 'activities'):
+            rollups.refresh(conn, *chunk)
+        if progress_kind:
+            local_store.mark_done(conn, progress_kind, *chunk)
+
+
+def sync_range(conn, athlete_id, api_key, start, end, kinds=('wellness', 'activities')):
+    """Descarga [start, end] de la API y lo escribe en el almacén sin marcar progreso de carga histórica."""
+    chunk = (start.isoformat(), end.isoformat())
+    # Los tipos se piden a la vez; se escribe lo que haya llegado y después se relanza el primer error
+    fetched = fetch_all({kind: (fetch_chunk, kind, chunk, athlete_id, api_key, None, False) for kind in kinds})
+    errors = [fetched[kind] for kind in kinds if isinstance(fetched[kind], BaseException)]
+    for kind in kinds:
+        if not isinstance(fetched[kind], BaseException):
+            records, _ = fetched[kind]
+            write_chunk(conn, kind, chunk, records, [], None)
+    if errors:
+        raise errors[0]
+
+
+def weekly_rollups(athlete_id, api_key, start, end, sync=True, max_age=3600):
+    """Resúmenes de las semanas ISO de [start, end], sincronizando antes solo las que faltan o aún pueden cambiar."""
+    conn = local_store.connect(athlete_id)
+    try:
+        pending = rollups.stale_range(conn, start, end, max_age) if sync else None
+        if pending:
+            sync_range(conn, athlete_id, api_key, *pending)
+        return rollups.load_weekly(conn, start, end)
+    finally:
+        conn.close()
+
+
+def run_backfill(athlete_id, api_key, start, end, kinds=KINDS, with_streams=False, chunk_days=30, workers=4, rate=5.0, refresh=False, log=print):
+    conn = local_store.connect(athlete_id)
+    limiter = api.TokenBucket(rate, burst=max(rate, workers))
+    chunks = date_chunks(start, end, chunk_days)
+    # Los bloques que tocan los últimos días se vuelven a pedir siempre: sus datos aún pueden cambiar
+    recent_limit = (date.today() - timedelta(days=2)).isoformat()
+
+    pending = []
+    for kind in kinds:
+        done = set() if refresh else local_store.done_chunks(conn, checkpoint_kind(kind, with_streams))
+        pending += [(kind, c) for c in chunks if c not in done or c[1] >= recent_limit]
+    log(f"{len(pending)} bloques pendientes ({len(chunks) * len(kinds) - len(pending)} ya completados).")
+
+    started, failures = time.monotonic(), 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch_chunk, kind, chunk, athlete_id, api_key, limiter, with_streams): (kind, chunk) for kind, chunk in pending}
+        for i, future in enumerate(as_completed(futures), 1):
+            kind, chunk = futures[future]
+            try:
+                records, streams = future.result()
+            except Exception as e:
+                failures += 1
+                log(f"  ❌ {kind} {chunk[0]}..{chunk[1]}: {e}")
+                continue
+            write_chunk(conn, kind, chunk, records, streams, checkpoint_kind(kind, with_streams))
+            log(f"  [{i}/{len(pending)}] {kind} {chunk[0]}..{chunk[1]}: {len(records)} registros" + (f", {len(streams)} streams" if streams else ""))
+
+    if 'wellness' in kinds:
+        state = load_state(athlete_id)
+        if update_from_frame(state, local_store.load_wellness(conn)):
+            save_state(state, athlete_id)
+
+    conn.close()
+    log(f"Terminado en {time.monotonic() - started:.1f}s ({failures} bloques fallidos; vuelve a lanzar el comando para reintentarlos).")
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Carga histórica reanudable de Intervals.icu al almacén local.")
+    parser.add_argument("--start", type=date.fromisoformat, help="Primer día (AAAA-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, default=datetime.now().date(), help="Último día (por defecto, hoy)")
+    parser.add_argument("--kinds", default=",".join(KINDS), help="Tipos de datos separados por comas")
+    parser.add_argument("--streams", action="store_true", help="Descargar también los streams de cada salida en bici")
+    parser.add_argument("--chunk-days", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=5.0, help="Peticiones por segundo como máximo")
+    parser.add_argument("--refresh", action="store_true", help="Ignorar el progreso guardado y descargarlo todo otra vez")
+    parser.add_argument("--rebuild-rollups", action="store_true", help="Solo recalcular los resúmenes semanales y mensuales")
+    args = parser.parse_args(argv)
+    if not args.start and not args.rebuild_rollups:
+        parser.error("se necesita --start (o --rebuild-rollups)")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    kinds = tuple(k.strip() for k in args.kinds.split(",") if k.strip())
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        sys.exit(f"Tipos desconocidos: {', '.join(sorted(unknown))}")
+    athlete_id, api_key = load_credentials()
+    if args.rebuild_rollups:
+        conn = local_store.connect(athlete_id)
+        first, last = rollups.rebuild(conn)
+        conn.close()
+        print(f"Resúmenes recalculados ({first}..{last})." if first else "El almacén está vacío.")
+        return
+    failures = run_backfill(athlete_id, api_key, args.start, args.end, kinds, args.streams, args.chunk_days, args.workers, args.rate, args.refresh)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Gráficas de líneas con las series reducidas en el servidor a un presupuesto fijo de puntos.
+
+Una serie de varios años o un stream segundo a segundo (una salida de 4 h son ~14.000 puntos por
+canal) se reduce antes de enviarla al navegador, conservando la forma:
+
+- `lttb` (Largest-Triangle-Three-Buckets): en cada tramo se queda con el punto que forma el
+  triángulo de mayor área con el anterior elegido y la media del tramo siguiente. Va bien en
+  series diarias y tendencias.
+- `minmax`: en cada tramo se queda con el mínimo y el máximo. Conserva todos los picos, que es
+  lo que importa en potencia y FC.
+
+Con varias series el presupuesto se reparte entre ellas: se reduce cada una y se representan todas
+en la unión de los instantes elegidos, así que comparten eje sin huecos y cada una conserva sus
+extremos. `zoomable_line_chart` añade un control de rango: al acercarse solo se recorta y vuelve a
+reducir la ventana visible (se ejecuta como fragmento, sin repetir el resto de la página).
+"""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from instrumentation import timed
+
+MAX_POINTS = 2000  # Puntos por gráfica: del orden del ancho en píxeles de una gráfica a todo el ancho
+METHODS = ('lttb', 'minmax')
+
+
+def _x_values(index):
+    """Eje x como float (las fechas, en nanosegundos)."""
+    if isinstance(index, pd.DatetimeIndex):
+        return index.asi8.astype(float)
+    return np.asarray(index, dtype=float)
+
+
+def lttb(x, y, n_out):
+    """Posiciones de los `n_out` puntos que elige Largest-Triangle-Three-Buckets (incluye el primero y el último)."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # n_out - 2 tramos entre el primer y el último punto; medias de cada tramo con sumas acumuladas
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    cx, cy = np.concatenate([[0.0], np.cumsum(x)]), np.concatenate([[0.0], np.cumsum(y)])
+    counts = np.diff(edges)
+    mean_x = np.append((cx[edges[1:]] - cx[edges[:-1]]) / counts, x[-1])
+    mean_y = np.append((cy[edges[1:]] - cy[edges[:-1]]) / counts, y[-1])
+
+    picked = np.empty(n_out, dtype=int)
+    picked[0], picked[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Área (doble) del triángulo entre el punto elegido, cada candidato y la media del tramo siguiente
+        area = np.abs((x[a] - mean_x[i + 1]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (mean_y[i + 1] - y[a]))
+        a = lo + int(np.argmax(area))
+        picked[i + 1] = a
+    return picked
+
+
+def minmax(y, n_buckets):
+    """Posiciones del mínimo y el máximo de cada uno de `n_buckets` tramos iguales (más el primer y el último punto)."""
+    n = len(y)
+    if 2 * n_buckets + 2 >= n:
+        return np.arange(n)
+    bucket = np.arange(n) * n_buckets // n
+    order = np.lexsort((y, bucket))  # Por tramo y, dentro de cada tramo, por valor
+    starts = np.searchsorted(bucket[order], np.arange(n_buckets))
+    ends = np.append(starts[1:], n) - 1
+    return np.unique(np.concatenate([[0, n - 1], order[starts], order[ends]]))
+
+
+@timed()
+def downsample(data, max_points=MAX_POINTS, method='lttb'):
+    """Reduce un DataFrame o Series (índice ordenado) a lo sumo a `max_points` filas.
+
+    Cada serie elige `max_points / nº de series` puntos con sus valores presentes (los NaN no cuentan).
+    Devuelve las filas elegidas por alguna de las series, con todos sus valores.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Método desconocido: {method}. Disponibles: {', '.join(METHODS)}")
+    frame = data.to_frame() if isinstance(data, pd.Series) else data
+    if len(frame) <= max_points:
+        return data
+    x = _x_values(frame.index)
+    budget = max(max_points // max(len(frame.columns), 1), 3)
+    positions = []
+    for column in frame.columns:
+        y = pd.to_numeric(frame[column], errors='coerce').to_numpy(dtype=float)
+        valid = np.flatnonzero(~np.isnan(y))
+        if len(valid) == 0:
+            continue
+        picked = lttb(x[valid], y[valid], budget) if method == 'lttb' else minmax(y[valid], budget // 2 - 1)
+        positions.append(valid[picked])
+    if not positions:
+        return data.iloc[:0]
+    return data.iloc[np.unique(np.concatenate(positions))]
+
+
+def line_chart(data, max_points=MAX_POINTS, method='lttb', **kwargs):
+    """`st.line_chart` con los datos reducidos a `max_points` filas (el resto de argumentos pasan tal cual)."""
+    st.line_chart(downsample(data, max_points, method), **kwargs)
+
+
+def _bounds(index):
+    if isinstance(index, pd.DatetimeIndex):
+        return index[0].date(), index[-1].date()
+    return float(index[0]), float(index[-1])
+
+
+@st.fragment
+def zoomable_line_chart(data, key, max_points=MAX_POINTS, method='lttb', label="Rango visible"):
+    """Gráfica reducida con un control de rango: cada acercamiento recorta y vuelve a reducir solo la ventana visible."""
+    if data.empty:
+        return
+    low, high = _bounds(data.index)
+    state_key, bounds_key = f"{key}_rango", f"{key}_limites"
+    # Si los datos cambian (otra métrica, otro periodo) el rango guardado se ajusta a los nuevos límites;
+    # si se veía todo, se sigue viendo todo
+    start, end = st.session_state.get(state_key, (low, high))
+    if (start, end) == st.session_state.get(bounds_key):
+        start, end = low, high
+    start, end = min(max(start, low), high), min(max(end, low), high)
+    st.session_state[state_key] = (start, end) if start < end else (low, high)
+    st.session_state[bounds_key] = (low, high)
+    if low < high:
+        start, end = st.slider(label, low, high, key=state_key)
+    else:
+        start, end = low, high
+
+    if isinstance(data.index, pd.DatetimeIndex):
+        first = data.index.searchsorted(pd.Timestamp(start), 'left')
+        last = data.index.searchsorted(pd.Timestamp(end + timedelta(days=1)), 'left')
+    else:
+        first, last = data.index.searchsorted(start, 'left'), data.index.searchsorted(end, 'right')
+    visible = data.iloc[first:last]
+    shown = downsample(visible, max_points, method)
+    st.line_chart(shown)
+    if len(shown) < len(visible):
+        st.caption(f"{len(shown):,} de {len(visible):,} puntos representados. Acerca el rango para ver más detalle.".replace(",", "."))
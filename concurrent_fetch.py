@@ -0,0 +1,71 @@
+"""Peticiones independientes de una página lanzadas a la vez en un pool de hilos compartido.
+
+    fetched = fetch_all({"activities": (get_activity_table, start, end),
+                         "wellness": (fetch_wellness, start, end)}, timeout=20)
+    table = unwrap(fetched["activities"])  # relanza aquí el error de esa petición, si lo hubo
+
+Cada petición tiene su propio plazo contado desde el lanzamiento y sus errores no afectan a las
+demás: el resultado de una que falla o no llega a tiempo es la excepción, que `unwrap` relanza
+donde la página ya sabe tratarla. Una petición que vence no se cancela; si termina después, su
+resultado queda en la `bounded_cache` de la función para la siguiente ejecución.
+
+Las funciones no deben usar `st.*`: corren fuera del hilo del script de Streamlit.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+
+import instrumentation
+
+MAX_WORKERS = 8
+DEFAULT_TIMEOUT = 30  # Segundos
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="fetch")
+
+
+class FetchTimeout(requests.exceptions.Timeout):
+    """La petición no terminó en su plazo (es un RequestException, como los demás fallos de red)."""
+
+
+def _run(func, args):
+    totals = instrumentation.begin_worker()
+    try:
+        return func(*args), totals
+    except Exception as e:  # El error se devuelve como resultado de esa petición
+        return e, totals
+    finally:
+        instrumentation.end_worker()
+
+
+def fetch_all(calls, timeout=DEFAULT_TIMEOUT):
+    """Ejecuta a la vez `calls` ({nombre: (función, *args)}) y devuelve {nombre: resultado o excepción}.
+
+    `timeout` es un número para todas o un dict {nombre: segundos}.
+    """
+    started = time.perf_counter()
+    futures = {name: _executor.submit(_run, spec[0], spec[1:]) for name, spec in calls.items()}
+    limits = {name: timeout.get(name, DEFAULT_TIMEOUT) if isinstance(timeout, dict) else timeout for name in calls}
+
+    # Se espera por orden de plazo: cada `wait` solo cubre lo que le queda a la siguiente en vencer
+    for name in sorted(futures, key=limits.get):
+        remaining = limits[name] - (time.perf_counter() - started)
+        if remaining > 0:
+            wait([futures[name]], timeout=remaining)
+
+    results, workers = {}, []
+    for name, future in futures.items():
+        if not future.done():
+            results[name] = FetchTimeout(f"`{name}` no respondió en {limits[name]:g} s")
+            continue
+        results[name], totals = future.result()
+        workers.append(totals)
+    instrumentation.add_concurrent_wait((time.perf_counter() - started) * 1000, workers)
+    return results
+
+
+def unwrap(result):
+    """El resultado de una petición de `fetch_all`, relanzando su excepción si falló."""
+    if isinstance(result, BaseException):
+        raise result
+    return result
@@ -0,0 +1,281 @@
+"""Caché en memoria acotada por tamaño (LRU) para los datos de la API, guardados en formato columnar compacto."""
+import functools
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from settings import CACHE_MAX_MB
+
+# Con copy-on-write (por defecto desde pandas 3) las vistas que se sirven desde la caché no se copian
+# al leerlas y cualquier modificación de una página crea su propia copia sin tocar la versión cacheada.
+# Con pandas 2 los DataFrames se sirven como copia completa, sin cambiar opciones globales de pandas.
+_SHARED_VIEWS = int(pd.__version__.split('.')[0]) >= 3
+
+_registry = {}
+_registry_lock = threading.Lock()
+_DATE_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})|datetime\.date\((\d+), (\d+), (\d+)\)")
+
+
+def compact_frame(records):
+    """Convierte una lista de dicts JSON (o un DataFrame) en un DataFrame columnar compacto.
+
+    Las columnas totalmente vacías pasan a ser numéricas (NaN), los enteros se reducen al
+    tipo más pequeño posible y los textos repetidos se guardan como categorías.
+    """
+    df = records if isinstance(records, pd.DataFrame) else pd.DataFrame(records)
+    if df.empty:
+        return df
+    for col in df.columns:
+        series = df[col]
+        if series.isna().all():
+            df[col] = series.astype('float64')
+        elif pd.api.types.is_integer_dtype(series):
+            df[col] = pd.to_numeric(series, downcast='integer')
+        elif series.dtype == object and len(series) > 1:
+            values = series.dropna()
+            if not values.empty and values.map(type).eq(str).all() and values.nunique() <= len(series) // 2:
+                df[col] = series.astype('category')
+    return df
+
+
+def frame_nbytes(value):
+    """Memoria aproximada que ocupa un valor cacheado."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True, index=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True, index=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value) + 64
+    if isinstance(value, (tuple, list)):
+        return sum(frame_nbytes(v) for v in value) + 64
+    if isinstance(value, dict):
+        return sum(frame_nbytes(v) for v in value.values()) + 64
+    return 64
+
+
+def _freeze(value):
+    """Marca como solo lectura los arrays numéricos de un valor antes de guardarlo."""
+    if isinstance(value, pd.DataFrame):
+        for col in value.columns:
+            arr = value[col].to_numpy(copy=False)
+            if isinstance(arr, np.ndarray) and arr.dtype != object:
+                arr.flags.writeable = False
+    elif isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            _freeze(v)
+    return value
+
+
+def _view(value):
+    """Vista sin copia de un valor cacheado.
+
+    Los DataFrames se devuelven como copia superficial (completa con pandas 2) y los dicts y listas JSON
+    como copia de primer nivel: el contenido se comparte entre sesiones y las páginas deben tratarlo
+    como de solo lectura.
+    """
+    if isinstance(value, pd.DataFrame):
+        return value.copy(deep=not _SHARED_VIEWS)
+    if isinstance(value, tuple):
+        return tuple(_view(v) for v in value)
+    if isinstance(value, (dict, list)):
+        return value.copy()
+    return value
+
+
+class _Flight:
+    """Cálculo en curso de una clave: los hilos que piden la misma clave esperan a su resultado."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class BoundedCache:
+    """Caché LRU con límite de memoria y caducidad por entrada, segura entre hilos.
+
+    El candado solo protege las operaciones sobre el diccionario; los cálculos se hacen fuera de él,
+    y las peticiones simultáneas de una misma clave se agrupan en un único cálculo (`get_or_compute`).
+    """
+
+    def __init__(self, name, max_bytes, ttl):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # clave -> (caduca_en, valor, bytes)
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.coalesced = 0
+        self.inflight = {}  # clave -> _Flight
+        self.lock = threading.Lock()
+        _registry[name] = self
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, _view(entry[1])
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        value = _freeze(value)
+        self._store(key, value)
+        return _view(value)
+
+    def _store(self, key, value):
+        size = frame_nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + self.ttl, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and self.entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """Valor cacheado de `key` o, si falta, el de `compute()` calculado una sola vez.
+
+        Si otro hilo ya está calculando la misma clave se espera a su resultado (o a su error)
+        en lugar de repetir la petición.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return _view(entry[1])
+            if entry is not None:
+                self._remove(key)
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return _view(flight.wait())
+
+        try:
+            flight.value = _freeze(compute())
+            self._store(key, flight.value)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+            flight.done.set()
+        return _view(flight.value)
+
+    def invalidate(self, predicate=None):
+        """Elimina las entradas cuya clave cumple `predicate` (o todas)."""
+        with self.lock:
+            for key in [k for k in self.entries if predicate is None or predicate(k)]:
+                self._remove(key)
+
+    def _remove(self, key):
+        self.bytes -= self.entries.pop(key)[2]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name, "entries": len(self.entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "coalesced": self.coalesced,
+                "hit_ratio": self.hits / lookups if lookups else None,
+            }
+
+
+def bounded_cache(ttl=3600, max_mb=CACHE_MAX_MB, compact=None):
+    """Decorador que sustituye a `st.cache_data` con una caché acotada por tamaño y compartida entre sesiones.
+
+    `compact` (opcional) transforma el resultado antes de guardarlo, p. ej. `compact_frame`. Las
+    excepciones no se cachean: llegan a todos los que esperaban esa clave y la siguiente llamada reintenta.
+    """
+    def decorator(func):
+        # Streamlit vuelve a ejecutar el script de la página en cada interacción: la caché se
+        # registra por fichero y nombre de función para reutilizar la misma entre ejecuciones.
+        name = f"{func.__code__.co_filename}:{func.__qualname__}"
+        with _registry_lock:
+            cache = _registry.get(name) or BoundedCache(name, int(max_mb * 1024 * 1024), ttl)
+
+        def compute(args, kwargs):
+            value = func(*args, **kwargs)
+            return compact(value) if compact is not None else value
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (repr(args), repr(sorted(kwargs.items())))
+            return cache.get_or_compute(key, lambda: compute(args, kwargs))
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+def cache_stats():
+    """Estadísticas (aciertos, fallos, memoria) de todas las cachés registradas."""
+    return [cache.stats() for cache in _registry.values()]
+
+
+def invalidate_all():
+    """Vacía todas las cachés registradas."""
+    for cache in list(_registry.values()):
+        cache.invalidate()
+
+
+def _key_days(key):
+    """Fechas (AAAA-MM-DD) que aparecen en los argumentos de una clave de `bounded_cache`."""
+    days = []
+    for match in _DATE_RE.finditer(" ".join(key)):
+        y, m, d = match.groups()[:3] if match.group(1) else match.groups()[3:]
+        days.append(f"{int(y):04d}-{int(m):02d}-{int(d):02d}")
+    return days
+
+
+def invalidate_days(days):
+    """Elimina de todas las cachés las entradas cuyo rango de fechas incluye alguno de `days`.
+
+    Una clave con una sola fecha se invalida si coincide; con varias, si algún día cae entre la
+    primera y la última. Las claves sin fechas no se tocan.
+    """
+    days = sorted(str(d)[:10] for d in days)
+    if not days:
+        return
+
+    def affected(key):
+        found = _key_days(key)
+        return bool(found) and any(min(found) <= day <= max(found) for day in days)
+
+    for cache in list(_registry.values()):
+        cache.invalidate(affected)
+
+
+def invalidate_ids(ids):
+    """Elimina de todas las cachés las entradas cuyos argumentos incluyen alguno de los identificadores."""
+    patterns = [re.compile(rf"(?<![\w-]){re.escape(str(i))}(?![\w-])") for i in ids]
+    if not patterns:
+        return
+    for cache in list(_registry.values()):
+        cache.invalidate(lambda key: any(p.search(key[0]) for p in patterns))
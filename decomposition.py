@@ -0,0 +1,206 @@
+"""Descomposición de series diarias largas (HRV, FC en reposo, sueño y eficiencia NP/FC) en tendencia,
+patrón semanal, estacionalidad anual y residuo.
+
+Es una descomposición aditiva al estilo de STL, robusta y con operaciones sobre arrays:
+
+- tendencia: media móvil centrada de `TREND_DAYS` días de la serie sin los dos patrones;
+- patrón semanal: media por día de la semana de lo que queda sin tendencia ni estacionalidad;
+- estacionalidad: media por día del año, suavizada de forma circular (solo con al menos
+  `MIN_SEASON_YEARS` años de datos);
+- residuo: el resto, que es donde queda la respuesta al entrenamiento de días y semanas.
+
+Tras cada pasada los días con un residuo anómalo pierden peso (bisquare), así que unas pocas
+lecturas raras no desplazan la tendencia ni los patrones.
+
+Los componentes se guardan por día en la tabla `decomposition` y los perfiles semanal y anual en
+`decomposition_fits`. Cuando llegan días nuevos solo se recalcula la cola que pueden mover (la
+mitad de la ventana de tendencia) con los perfiles guardados; el ajuste completo se repite cuando
+cambian días antiguos o se acumulan `REFIT_DAYS` días desde el último.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+import local_store
+
+SIGNALS = {'hrv': "VFC (HRV)", 'restingHR': "FC Reposo", 'sleepScore': "P. Sueño", 'efficiency': "Eficiencia (NP/FC)"}
+RIDE_TYPES = ('Ride', 'VirtualRide')
+COMPONENTS = ['trend', 'weekly', 'seasonal', 'residual']
+
+TREND_DAYS = 183  # Ventana (días) de la tendencia
+SEASON_SMOOTH_DAYS = 31  # Suavizado del perfil anual
+SEASON_DAYS = 365  # El 29 de febrero cuenta como el 31 de diciembre
+MIN_SEASON_YEARS = 2
+ROBUST_ITERATIONS = 2  # Pasadas que reponderan los días anómalos
+INNER_ITERATIONS = 2  # Pasadas tendencia/patrones en cada una
+REFIT_DAYS = 28
+PARAMS = json.dumps({"trend": TREND_DAYS, "season_smooth": SEASON_SMOOTH_DAYS, "min_years": MIN_SEASON_YEARS,
+                     "robust": ROBUST_ITERATIONS, "inner": INNER_ITERATIONS}, sort_keys=True)
+
+
+def daily_series(conn, signal):
+    """Serie diaria de una señal del almacén, de su primer a su último dato (NaN los días sin dato)."""
+    if signal not in SIGNALS:
+        raise ValueError(f"Señal desconocida: {signal}")
+    if signal == 'efficiency':
+        df = pd.read_sql_query(
+            "SELECT date, icu_weighted_avg_watts / average_heartrate AS value FROM activities "
+            "WHERE type IN (?, ?) AND average_heartrate > 0 AND icu_weighted_avg_watts > 0 AND date != ''",
+            conn, params=RIDE_TYPES)
+        series = df.groupby('date')['value'].mean()
+        series.index = pd.to_datetime(series.index)
+    else:
+        series = local_store.load_wellness(conn)[signal]
+    # Un 0 en el bienestar es un día sin dato
+    series = series[series > 0].astype(float)
+    if series.empty:
+        return series
+    return series.reindex(pd.date_range(series.index.min(), series.index.max(), freq='D'))
+
+
+def _moving_average(values, weights, window):
+    """Media móvil centrada y ponderada; la ventana se recorta en los extremos."""
+    n = len(values)
+    cw = np.concatenate([[0.0], np.cumsum(weights)])
+    cv = np.concatenate([[0.0], np.cumsum(weights * np.nan_to_num(values))])
+    position = np.arange(n)
+    lo, hi = np.clip(position - window // 2, 0, n), np.clip(position + window // 2 + 1, 0, n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average = (cv[hi] - cv[lo]) / (cw[hi] - cw[lo])
+    # Tramos sin ningún dato en toda la ventana: se interpola entre los vecinos
+    return pd.Series(average).interpolate(limit_direction='both').to_numpy()
+
+
+def _profile(values, weights, bins, n_bins, smooth=0):
+    """Media ponderada por grupo (día de la semana o del año), centrada en 0. Con `smooth` se suaviza de forma circular."""
+    sw = np.bincount(bins, weights=weights, minlength=n_bins)
+    sv = np.bincount(bins, weights=weights * np.nan_to_num(values), minlength=n_bins)
+    if smooth:
+        kernel, pad = np.ones(smooth), smooth // 2
+        sw = np.convolve(np.concatenate([sw[-pad:], sw, sw[:pad]]), kernel, mode='valid')
+        sv = np.convolve(np.concatenate([sv[-pad:], sv, sv[:pad]]), kernel, mode='valid')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        profile = sv / sw
+    profile = np.where(sw > 0, profile, np.nan)
+    return np.nan_to_num(profile - np.nanmean(profile)) if np.isfinite(profile).any() else np.zeros(n_bins)
+
+
+def _bins(dates):
+    return dates.dayofweek.to_numpy(), np.minimum(dates.dayofyear.to_numpy(), SEASON_DAYS) - 1
+
+
+def _robust_weights(residual, valid):
+    """Pesos bisquare: 1 para residuos normales y 0 a partir de 6 desviaciones absolutas medianas."""
+    scale = 6 * np.nanmedian(np.abs(residual[valid])) if valid.any() else 0
+    if not scale:
+        return valid.astype(float)
+    u = np.clip(np.abs(np.nan_to_num(residual)) / scale, 0, 1)
+    return np.where(valid, (1 - u ** 2) ** 2, 0.0)
+
+
+def fit(series):
+    """Descomposición completa de una serie diaria. Devuelve (DataFrame de componentes, perfil semanal, perfil anual)."""
+    values = series.to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    dow, doy = _bins(series.index)
+    seasonal_enabled = len(series) >= MIN_SEASON_YEARS * SEASON_DAYS
+    weekly_profile, seasonal_profile = np.zeros(7), np.zeros(SEASON_DAYS)
+    weights = valid.astype(float)
+    for _ in range(ROBUST_ITERATIONS):
+        for _ in range(INNER_ITERATIONS):
+            trend = _moving_average(values - weekly_profile[dow] - seasonal_profile[doy], weights, TREND_DAYS)
+            if seasonal_enabled:
+                seasonal_profile = _profile(values - trend - weekly_profile[dow], weights, doy, SEASON_DAYS, SEASON_SMOOTH_DAYS)
+            weekly_profile = _profile(values - trend - seasonal_profile[doy], weights, dow, 7)
+        residual = values - trend - weekly_profile[dow] - seasonal_profile[doy]
+        weights = _robust_weights(residual, valid)
+    trend = _moving_average(values - weekly_profile[dow] - seasonal_profile[doy], weights, TREND_DAYS)
+    return _frame(series, trend, weekly_profile[dow], seasonal_profile[doy]), weekly_profile, seasonal_profile
+
+
+def refit_tail(series, weekly_profile, seasonal_profile, start):
+    """Recalcula la tendencia desde `start` con los perfiles ya ajustados, usando como contexto la ventana anterior."""
+    context = series[series.index >= start - pd.Timedelta(days=TREND_DAYS)]
+    values = context.to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    dow, doy = _bins(context.index)
+    deseasoned = values - weekly_profile[dow] - seasonal_profile[doy]
+    weights = valid.astype(float)
+    for _ in range(ROBUST_ITERATIONS):
+        weights = _robust_weights(deseasoned - _moving_average(deseasoned, weights, TREND_DAYS), valid)
+    trend = _moving_average(deseasoned, weights, TREND_DAYS)
+    frame = _frame(context, trend, weekly_profile[dow], seasonal_profile[doy])
+    return frame[frame.index >= start]
+
+
+def _frame(series, trend, weekly, seasonal):
+    return pd.DataFrame({'value': series.to_numpy(dtype=float), 'trend': trend, 'weekly': weekly,
+                         'seasonal': seasonal, 'residual': series.to_numpy(dtype=float) - trend - weekly - seasonal},
+                        index=series.index)
+
+
+def _first_change(series, stored):
+    """Primer día cuyo valor no coincide con el guardado (o que no estaba guardado); None si no hay cambios."""
+    previous = stored.reindex(series.index)
+    same = (previous == series) | (previous.isna() & series.isna())
+    same &= series.index.isin(stored.index)
+    changed = series.index[~same.to_numpy()]
+    return changed[0] if len(changed) else None
+
+
+def update(conn, signal):
+    """Pone al día la descomposición guardada de una señal. Devuelve 'full', 'tail' o None si ya estaba al día."""
+    series = daily_series(conn, signal)
+    fit_row = conn.execute("SELECT fitted_through, params, weekly, seasonal FROM decomposition_fits WHERE signal = ?", (signal,)).fetchone()
+    stored = pd.read_sql_query("SELECT date, value FROM decomposition WHERE signal = ? ORDER BY date", conn, params=(signal,))
+    stored = pd.Series(stored['value'].to_numpy(dtype=float), index=pd.to_datetime(stored['date']))
+
+    if series.empty:
+        if fit_row or not stored.empty:
+            with conn:
+                conn.execute("DELETE FROM decomposition WHERE signal = ?", (signal,))
+                conn.execute("DELETE FROM decomposition_fits WHERE signal = ?", (signal,))
+        return None
+
+    first = _first_change(series, stored)
+    if first is None and stored.index[-1] == series.index[-1] and fit_row and fit_row[1] == PARAMS:
+        return None
+
+    tail_start = None if first is None else first - pd.Timedelta(days=TREND_DAYS // 2)
+    incremental = (fit_row is not None and fit_row[1] == PARAMS and not stored.empty and stored.index[0] == series.index[0]
+                   and stored.index[-1] <= series.index[-1] and tail_start is not None
+                   and tail_start >= stored.index[-1] - pd.Timedelta(days=TREND_DAYS // 2)
+                   and (series.index[-1] - pd.Timestamp(fit_row[0])).days < REFIT_DAYS)
+    if incremental:
+        frame = refit_tail(series, np.array(json.loads(fit_row[2])), np.array(json.loads(fit_row[3])), tail_start)
+    else:
+        frame, weekly_profile, seasonal_profile = fit(series)
+
+    rows = [(signal, day.strftime('%Y-%m-%d'), *(None if np.isnan(v) else float(v) for v in values))
+            for day, values in zip(frame.index, frame[['value', *COMPONENTS]].to_numpy())]
+    with conn:
+        if not incremental:
+            conn.execute("DELETE FROM decomposition WHERE signal = ?", (signal,))
+            conn.execute("INSERT OR REPLACE INTO decomposition_fits (signal, fitted_through, params, weekly, seasonal) VALUES (?, ?, ?, ?, ?)",
+                         (signal, series.index[-1].strftime('%Y-%m-%d'), PARAMS,
+                          json.dumps([round(float(v), 4) for v in weekly_profile]), json.dumps([round(float(v), 4) for v in seasonal_profile])))
+        conn.executemany("INSERT OR REPLACE INTO decomposition (signal, date, value, trend, weekly, seasonal, residual) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    return 'tail' if incremental else 'full'
+
+
+def components(conn, signal, start=None, end=None):
+    """Valor y componentes diarios de una señal (poniendo antes al día la descomposición), indexados por fecha."""
+    update(conn, signal)
+    df = pd.read_sql_query(
+        "SELECT date, value, trend, weekly, seasonal, residual FROM decomposition WHERE signal = ? AND date BETWEEN ? AND ? ORDER BY date",
+        conn, params=(signal, str(start or '0000-00-00'), str(end or '9999-99-99')))
+    df['date'] = pd.to_datetime(df['date'])
+    return df.set_index('date').astype(float)
+
+
+def profiles(conn, signal):
+    """Perfiles guardados de una señal: (patrón semanal de lunes a domingo, estacionalidad por día del año) o None."""
+    row = conn.execute("SELECT weekly, seasonal FROM decomposition_fits WHERE signal = ?", (signal,)).fetchone()
+    return (np.array(json.loads(row[0])), np.array(json.loads(row[1]))) if row else None
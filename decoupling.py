@@ -0,0 +1,176 @@
+"""Desacoplamiento aeróbico (Pa:HR) calculado en local a partir de los streams de potencia y FC.
+
+Para cada salida de resistencia se descarta el calentamiento y la vuelta a la calma, se quedan solo
+las muestras estables (sin pedalear en vacío y con la potencia media de 30 s cerca de la mediana
+de la salida) y se compara la eficiencia (potencia media / FC media) de la primera y la segunda
+mitad: Pa:HR = (EF1 − EF2) / EF1 · 100. Un valor por debajo del 5 % indica buena resistencia aeróbica.
+
+Todas las salidas de un rango se calculan a la vez: sus streams se concatenan y las medias de cada
+(salida, mitad) salen de un único `np.bincount`. Los resultados se guardan en la tabla `decoupling`
+por actividad y configuración, así que la tendencia de varias temporadas se lee directamente. De las
+configuraciones distintas de la por defecto solo se conservan las `MAX_PARAM_SETS` usadas más
+recientemente.
+"""
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+import local_store
+import stream_archive
+
+RIDE_TYPES = ('Ride', 'VirtualRide')
+DEFAULTS = {
+    "warmup_secs": 600,  # Se descartan los primeros minutos
+    "cooldown_secs": 300,  # y los últimos
+    "steady_tolerance": 0.3,  # Media de 30 s dentro de ±30 % de la mediana de la salida
+    "min_watts": 40,  # Por debajo se considera que no se pedalea
+    "max_intensity": 0.85,  # Solo salidas de resistencia (IF máximo)
+    "min_secs": 3600,  # Duración mínima en movimiento
+}
+ROLLING_SECS = 30
+MIN_KEPT_SHARE = 0.5  # Si quedan menos muestras estables, la salida no es válida
+MAX_PARAM_SETS = 5  # Configuraciones no por defecto con resultados guardados
+
+
+def params_key(params=None):
+    """Configuración completa (con valores por defecto) y su clave de almacenamiento."""
+    full = {**DEFAULTS, **(params or {})}
+    return full, json.dumps(full, sort_keys=True)
+
+
+def compute_batch(streams, params=None):
+    """Pa:HR de varias salidas a la vez. `streams` es una lista de dicts con 'watts', 'heartrate' y opcionalmente 'time'.
+
+    Devuelve un array (salidas, 4) con Pa:HR (%), EF de la primera mitad, EF de la segunda mitad y
+    fracción de muestras usadas; NaN en las salidas sin datos suficientes.
+    """
+    params, _ = params_key(params)
+    n = len(streams)
+    out = np.full((n, 4), np.nan)
+    lengths = np.array([min(len(s.get('watts') if s.get('watts') is not None else []),
+                            len(s.get('heartrate') if s.get('heartrate') is not None else [])) for s in streams], dtype=int)
+    if n == 0 or lengths.sum() == 0:
+        return out
+
+    ride = np.repeat(np.arange(n), lengths)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    watts = np.concatenate([np.nan_to_num(np.asarray(s['watts'], dtype=float)[:k]) for s, k in zip(streams, lengths) if k])
+    hr = np.concatenate([np.nan_to_num(np.asarray(s['heartrate'], dtype=float)[:k]) for s, k in zip(streams, lengths) if k])
+    elapsed = np.concatenate([
+        (np.asarray(s['time'], dtype=float)[:k] - s['time'][0]) if s.get('time') is not None and len(s['time']) >= k else np.arange(k, dtype=float)
+        for s, k in zip(streams, lengths) if k])
+
+    # Media de 30 s sin cruzar de una salida a otra
+    position = np.arange(len(watts))
+    cumulative = np.concatenate([[0.0], np.cumsum(watts)])
+    window_start = np.maximum(position - ROLLING_SECS + 1, starts[ride])
+    rolling = (cumulative[position + 1] - cumulative[window_start]) / (position + 1 - window_start)
+
+    total = np.zeros(n)
+    total[lengths > 0] = elapsed[starts[lengths > 0] + lengths[lengths > 0] - 1]
+    trimmed = (elapsed >= params["warmup_secs"]) & (elapsed <= total[ride] - params["cooldown_secs"])
+    keep = trimmed & (watts >= params["min_watts"]) & (hr > 0)
+
+    # Mediana por salida de la potencia de 30 s en el tramo útil
+    median = np.full(n, np.nan)
+    order = np.lexsort((rolling, ride))
+    kept_sorted = order[keep[order]]
+    counts = np.bincount(ride[kept_sorted], minlength=n)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    has = counts > 0
+    median[has] = rolling[kept_sorted][offsets[has] + (counts[has] - 1) // 2]
+    keep &= np.abs(rolling - median[ride]) <= params["steady_tolerance"] * median[ride]
+
+    middle = (params["warmup_secs"] + total - params["cooldown_secs"]) / 2
+    group = ride * 2 + (elapsed >= middle[ride])
+    sums_w = np.bincount(group[keep], weights=watts[keep], minlength=2 * n).reshape(n, 2)
+    sums_hr = np.bincount(group[keep], weights=hr[keep], minlength=2 * n).reshape(n, 2)
+    samples = np.bincount(group[keep], minlength=2 * n).reshape(n, 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ef = sums_w / sums_hr
+        share = samples.sum(axis=1) / np.bincount(ride[trimmed], minlength=n)
+        value = (ef[:, 0] - ef[:, 1]) / ef[:, 0] * 100
+    valid = (samples.min(axis=1) > 0) & (share >= MIN_KEPT_SHARE)
+    out[valid] = np.column_stack([value, ef[:, 0], ef[:, 1], share])[valid]
+    return out
+
+
+def _candidates(conn, params, start=None, end=None):
+    """Salidas de resistencia con streams cuyo resultado falta o es de una versión anterior de los streams."""
+    _, key = params_key(params)
+    where, args = ["a.type IN (?, ?)", "a.moving_time >= ?", "(a.icu_intensity IS NULL OR a.icu_intensity <= ?)",
+                   "(d.activity_id IS NULL OR d.stream_rowid != s.rowid)"], [*RIDE_TYPES, params["min_secs"], params["max_intensity"] * 100]
+    if start:
+        where.append("a.date >= ?")
+        args.append(str(start))
+    if end:
+        where.append("a.date <= ?")
+        args.append(str(end))
+    return conn.execute(
+        "SELECT s.activity_id, a.date FROM streams s JOIN activities a ON a.id = s.activity_id "
+        "LEFT JOIN decoupling d ON d.activity_id = s.activity_id AND d.params = ? "
+        f"WHERE {' AND '.join(where)} ORDER BY a.date", [key, *args]).fetchall()
+
+
+def update(conn, start=None, end=None, params=None, batch_size=200):
+    """Calcula y guarda el Pa:HR de las salidas del rango que aún no lo tienen. Devuelve cuántas se calcularon."""
+    params, key = params_key(params)
+    _, default_key = params_key()
+    with conn:
+        # Resultados de streams que ya no existen
+        conn.execute("DELETE FROM decoupling WHERE activity_id NOT IN (SELECT activity_id FROM streams)")
+        # Se anota el uso de la configuración y se olvidan las que llevan más tiempo sin usarse
+        conn.execute("INSERT OR REPLACE INTO decoupling_params VALUES (?, ?)", (key, time.time()))
+        conn.execute("DELETE FROM decoupling_params WHERE params IN (SELECT params FROM decoupling_params WHERE params != ? "
+                     "ORDER BY used_at DESC LIMIT -1 OFFSET ?)", (default_key, MAX_PARAM_SETS))
+        conn.execute("DELETE FROM decoupling WHERE params != ? AND params NOT IN (SELECT params FROM decoupling_params)", (default_key,))
+    pending = _candidates(conn, params, start, end)
+    for i in range(0, len(pending), batch_size):
+        batch = pending[i:i + batch_size]
+        streams = []
+        for activity_id, _ in batch:
+            blob = local_store.get_stream_blob(conn, activity_id)
+            streams.append(stream_archive.decode_streams(blob, ['time', 'watts', 'heartrate']) if blob else {})
+        # Los rowid se leen después de get_stream_blob, que puede reescribir los streams antiguos en JSON
+        rowids = dict(conn.execute(f"SELECT activity_id, rowid FROM streams WHERE activity_id IN ({', '.join('?' * len(batch))})",
+                                   [a for a, _ in batch]))
+        results = compute_batch(streams, params)
+        rows = [(activity_id, key, day, rowids[activity_id], *(None if np.isnan(v) else float(v) for v in result))
+                for (activity_id, day), result in zip(batch, results)]
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO decoupling (activity_id, params, date, stream_rowid, pa_hr, ef_first, ef_second, kept_share) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    return len(pending)
+
+
+def activity_value(conn, activity_id, params=None):
+    """Pa:HR (%) de una salida: el guardado si corresponde a sus streams actuales y, si no, calculado al vuelo.
+
+    El cálculo al vuelo no se guarda, porque la tabla solo recoge las salidas de resistencia que
+    entran en la tendencia. Devuelve None si la actividad no tiene streams y NaN si no da un valor válido.
+    """
+    _, key = params_key(params)
+    activity_id = str(activity_id)
+    row = conn.execute("SELECT d.pa_hr FROM decoupling d JOIN streams s ON s.activity_id = d.activity_id AND s.rowid = d.stream_rowid "
+                       "WHERE d.activity_id = ? AND d.params = ?", (activity_id, key)).fetchone()
+    if row:
+        return np.nan if row[0] is None else row[0]
+    blob = local_store.get_stream_blob(conn, activity_id)
+    if not blob:
+        return None
+    return float(compute_batch([stream_archive.decode_streams(blob, ['time', 'watts', 'heartrate'])], params)[0, 0])
+
+
+def history(conn, start=None, end=None, params=None):
+    """Pa:HR por salida del rango (calculando antes las que falten), indexado por fecha."""
+    params, key = params_key(params)
+    update(conn, start, end, params)
+    df = pd.read_sql_query(
+        "SELECT d.date, d.activity_id, a.name, d.pa_hr, d.ef_first, d.ef_second, d.kept_share FROM decoupling d "
+        "JOIN activities a ON a.id = d.activity_id WHERE d.params = ? AND d.pa_hr IS NOT NULL "
+        "AND d.date BETWEEN ? AND ? ORDER BY d.date",
+        conn, params=(key, str(start or '0000-00-00'), str(end or '9999-12-31')))
+    df['date'] = pd.to_datetime(df['date'])
+    return df.set_index('date')
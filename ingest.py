@@ -0,0 +1,274 @@
+"""Receptor de notificaciones (webhooks) de Intervals.icu y emisor de prueba para desarrollo local.
+
+Uso:
+    python ingest.py serve [--host 127.0.0.1] [--port 8765]
+    python ingest.py emit --type ACTIVITY_UPLOADED --date 2026-10-14 [--activity-id i123] [--url http://127.0.0.1:8765/webhook]
+
+Cada notificación se traduce en los días que cambian: solo esos días se vuelven a descargar y se
+escriben en el almacén local (con sus resúmenes semanales y mensuales), y se anotan en la tabla
+`changes`. Las páginas abiertas consultan esa tabla al empezar cada ejecución (`apply_changes`) e
+invalidan únicamente las entradas de caché cuyos argumentos incluyen esos días o actividades.
+"""
+import argparse
+import ipaddress
+import json
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import backfill
+import data_cache
+import local_store
+import rollups
+from anomaly_detector import load_state, save_state, update_from_frame
+from settings import WEBHOOK_SECRET, load_credentials
+
+ACTIVITY_EVENTS = ('ACTIVITY_UPLOADED', 'ACTIVITY_ANALYZED', 'ACTIVITY_UPDATED', 'ACTIVITY_DELETED')
+WELLNESS_EVENTS = ('WELLNESS_UPDATED',)
+CALENDAR_EVENTS = ('CALENDAR_UPDATED',)
+MAX_RANGE_DAYS = 366  # Rango máximo que se acepta en una notificación con `oldest`/`newest`
+POLL_SECONDS = 5
+
+_write_lock = threading.Lock()
+_poll_lock = threading.Lock()
+_seen = {}  # atleta -> último seq de `changes` aplicado en este proceso
+_polled = {}  # atleta -> instante de la última consulta
+
+
+def _day_range(first, last, max_days=MAX_RANGE_DAYS):
+    first, last = date.fromisoformat(first[:10]), date.fromisoformat(last[:10])
+    if max_days is not None and (last - first).days > max_days:
+        raise ValueError(f"Rango demasiado largo ({first}..{last}); usa backfill.py.")
+    return {(first + timedelta(days=i)).isoformat() for i in range((last - first).days + 1)}
+
+
+def affected(event):
+    """(días, ids de actividad) a los que se refiere una notificación."""
+    days, ids = set(), set()
+    activities = [event.get('activity')] + list(event.get('activities') or [])
+    for activity in filter(None, activities):
+        if activity.get('id'):
+            ids.add(str(activity['id']))
+        if activity.get('start_date_local'):
+            days.add(activity['start_date_local'][:10])
+    for record in event.get('records') or []:
+        if record.get('id'):
+            days.add(str(record['id'])[:10])
+    if event.get('activity_id'):
+        ids.add(str(event['activity_id']))
+    if event.get('date'):
+        days.add(str(event['date'])[:10])
+    if event.get('oldest') and event.get('newest'):
+        days |= _day_range(event['oldest'], event['newest'])
+    return days, ids
+
+
+def day_runs(days):
+    """Agrupa días sueltos en rangos consecutivos [(primero, último)] para pedirlos en bloque."""
+    runs = []
+    for day in sorted(date.fromisoformat(d) for d in days):
+        if runs and day - runs[-1][1] == timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return [tuple(run) for run in runs]
+
+
+def handle(payload, athlete_id, api_key):
+    """Aplica una notificación al almacén local. Devuelve los días y actividades afectados.
+
+    Una actividad nueva o modificada también cambia la CTL/ATL de los días siguientes, así que
+    además de sus días se vuelve a pedir el bienestar desde el primero de ellos hasta hoy.
+    """
+    if WEBHOOK_SECRET and payload.get('secret') != WEBHOOK_SECRET:
+        raise PermissionError("Secreto incorrecto.")
+    events = payload.get('events') if 'events' in payload else [payload]
+
+    changed_days, changed_ids, wellness_days, load_from = set(), set(), set(), None
+    with _write_lock:
+        conn = local_store.connect(athlete_id)
+        try:
+            for event in events:
+                if event.get('athlete_id') and str(event['athlete_id']) != str(athlete_id):
+                    continue
+                kind = event.get('type', '')
+                days, ids = affected(event)
+                # Los días en que estaban guardadas las actividades también cambian (p. ej., si se ha movido la fecha)
+                days |= set(local_store.activity_days(conn, ids))
+
+                if kind == 'ACTIVITY_DELETED':
+                    with conn:
+                        days |= set(local_store.delete_activities(conn, ids))
+                        for first, last in day_runs(days):
+                            rollups.refresh(conn, first, last)
+                elif kind in ACTIVITY_EVENTS:
+                    with conn:
+                        local_store.delete_streams(conn, ids)
+                    for first, last in day_runs(days):
+                        backfill.sync_range(conn, athlete_id, api_key, first, last, kinds=('activities',))
+                elif kind in WELLNESS_EVENTS:
+                    for first, last in day_runs(days):
+                        backfill.sync_range(conn, athlete_id, api_key, first, last, kinds=('wellness',))
+                    wellness_days |= days
+                elif kind in CALENDAR_EVENTS:
+                    for first, last in day_runs(days):
+                        backfill.sync_range(conn, athlete_id, api_key, first, last, kinds=('events',))
+                else:
+                    continue
+
+                if kind in ACTIVITY_EVENTS and days:
+                    load_from = min(filter(None, [load_from, min(days)]))
+                changed_days |= days
+                changed_ids |= ids
+
+            if load_from:
+                # La carga de una actividad cambia la CTL/ATL de ese día y de todos los siguientes
+                today = max(date.today().isoformat(), load_from)
+                backfill.sync_range(conn, athlete_id, api_key, date.fromisoformat(load_from), date.fromisoformat(today), kinds=('wellness',))
+                wellness_days |= _day_range(load_from, today, max_days=None)
+                changed_days |= wellness_days
+            if wellness_days:
+                state = load_state(athlete_id)
+                if update_from_frame(state, local_store.load_wellness(conn, min(wellness_days))):
+                    save_state(state, athlete_id)
+
+            with conn:
+                local_store.log_changes(conn, changed_days, changed_ids)
+        finally:
+            conn.close()
+
+    # Si el receptor corre dentro del mismo proceso que las páginas, sus cachés quedan al día ya
+    data_cache.invalidate_days(changed_days)
+    data_cache.invalidate_ids(changed_ids)
+    return {"days": sorted(changed_days), "activities": sorted(changed_ids)}
+
+
+def apply_changes(athlete_id):
+    """Invalida en este proceso las entradas de caché de los días cambiados desde la última consulta.
+
+    Se llama al empezar cada ejecución de página; consulta el almacén como mucho cada `POLL_SECONDS`.
+    """
+    if not athlete_id:
+        return 0
+    now = time.monotonic()
+    with _poll_lock:
+        if now - _polled.get(athlete_id, float('-inf')) < POLL_SECONDS:
+            return 0
+        _polled[athlete_id] = now
+        last = _seen.get(athlete_id)
+
+    conn = local_store.connect(athlete_id)
+    try:
+        seq, days, ids = local_store.changes_since(conn, last)
+    finally:
+        conn.close()
+    with _poll_lock:
+        _seen[athlete_id] = max(seq, _seen.get(athlete_id) or 0)
+    data_cache.invalidate_days(days)
+    data_cache.invalidate_ids(ids)
+    return len(days) + len(ids)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """POST /webhook con el JSON de la notificación; responde con los días actualizados."""
+
+    athlete_id = api_key = None
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/webhook':
+            return self._reply(404, {"error": "Ruta desconocida."})
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+            if not isinstance(payload, dict):
+                raise ValueError("Se esperaba un objeto JSON.")
+            summary = handle(payload, self.athlete_id, self.api_key)
+        except PermissionError as e:
+            return self._reply(403, {"error": str(e)})
+        except ValueError as e:
+            return self._reply(400, {"error": str(e)})
+        except requests.exceptions.RequestException as e:
+            # Un 5xx hace que el emisor reintente la notificación más tarde
+            return self._reply(502, {"error": f"Error al consultar Intervals.icu: {e}"})
+        self._reply(200, {"days": len(summary["days"]), "activities": len(summary["activities"]), **summary})
+
+    def _reply(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def is_loopback(host):
+    """Si `host` solo es accesible desde la propia máquina."""
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == 'localhost'
+
+
+def serve(host, port, athlete_id, api_key):
+    handler = type('Handler', (WebhookHandler,), {'athlete_id': athlete_id, 'api_key': api_key})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Escuchando notificaciones en http://{host}:{port}/webhook (Ctrl+C para salir)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def sample_payload(kind, athlete_id, day=None, activity_id=None, secret=WEBHOOK_SECRET):
+    """Notificación con la forma de las de Intervals.icu, para probar el receptor en local."""
+    day = (day or date.today()).isoformat()
+    event = {"athlete_id": athlete_id, "type": kind, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+    if kind in ACTIVITY_EVENTS:
+        event["activity"] = {"id": activity_id, "start_date_local": f"{day}T08:00:00"} if activity_id else {"start_date_local": f"{day}T08:00:00"}
+    elif kind in WELLNESS_EVENTS:
+        event["records"] = [{"id": day}]
+    else:
+        event["date"] = day
+    return {"secret": secret, "events": [event]}
+
+
+def emit(url, kind, athlete_id, day=None, activity_id=None):
+    """Emisor de prueba: envía una notificación al receptor como lo haría Intervals.icu."""
+    response = requests.post(url, json=sample_payload(kind, athlete_id, day, activity_id), timeout=60)
+    print(response.status_code, response.text)
+    return response.status_code == 200
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Receptor de notificaciones de Intervals.icu y emisor de prueba.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    server = commands.add_parser("serve", help="Recibir notificaciones y actualizar el almacén local")
+    server.add_argument("--host", default="127.0.0.1", help="Fuera de 127.0.0.1 exige COACH_WEBHOOK_SECRET")
+    server.add_argument("--port", type=int, default=8765)
+    emitter = commands.add_parser("emit", help="Enviar una notificación de prueba al receptor")
+    emitter.add_argument("--url", default="http://127.0.0.1:8765/webhook")
+    emitter.add_argument("--type", default="ACTIVITY_UPLOADED", choices=ACTIVITY_EVENTS + WELLNESS_EVENTS + CALENDAR_EVENTS)
+    emitter.add_argument("--date", type=date.fromisoformat, help="Día afectado (por defecto, hoy)")
+    emitter.add_argument("--activity-id")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    athlete_id, api_key = load_credentials()
+    if args.command == "serve":
+        # Sin secreto cualquiera que alcance el puerto podría forzar descargas y escrituras en el almacén
+        if not WEBHOOK_SECRET and not is_loopback(args.host):
+            sys.exit(f"No se escucha en {args.host} sin secreto: define COACH_WEBHOOK_SECRET o usa --host 127.0.0.1.")
+        serve(args.host, args.port, athlete_id, api_key)
+    else:
+        sys.exit(0 if emit(args.url, args.type, athlete_id, args.date, args.activity_id) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""Instrumentación de rendimiento: latencias de la API, tiempo de cálculo y tiempo por ejecución de página."""
+import bisect
+import functools
+import json
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from data_cache import cache_stats
+
+# Límites (ms) de los histogramas de latencia
+BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf')]
+
+_lock = threading.Lock()
+_histograms = {}  # (tipo, nombre) -> {"buckets": [...], "count": n, "sum": ms}
+_counters = {}    # (métrica, nombre) -> valor
+_local = threading.local()
+
+
+def _observe(kind, name, ms):
+    with _lock:
+        h = _histograms.setdefault((kind, name), {"buckets": [0] * len(BUCKETS_MS), "count": 0, "sum": 0.0})
+        h["buckets"][bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        h["count"] += 1
+        h["sum"] += ms
+
+
+def _increment(metric, name, value=1):
+    with _lock:
+        _counters[(metric, name)] = _counters.get((metric, name), 0) + value
+
+
+def _rerun():
+    return getattr(_local, "rerun", None)
+
+
+# --- PETICIONES HTTP ---
+def _endpoint(url):
+    """Nombre corto del endpoint (wellness, activities, events, streams...) para agrupar métricas."""
+    parts = [p for p in urlparse(url).path.split('/') if p]
+    return parts[-1] if parts else url
+
+
+def http_get(url, **kwargs):
+    """`requests.get` instrumentado: latencia, bytes recibidos y errores por endpoint."""
+    name = _endpoint(url)
+    started = time.perf_counter()
+    try:
+        response = requests.get(url, **kwargs)
+    except requests.exceptions.RequestException:
+        _increment("http_errors", name)
+        raise
+    finally:
+        ms = (time.perf_counter() - started) * 1000
+        _observe("http", name, ms)
+        rerun = _rerun()
+        if rerun is not None:
+            rerun["http_ms"] += ms
+            rerun["http_calls"] += 1
+            for frame in getattr(_local, "stack", []):
+                frame["http_ms"] += ms
+    size = len(response.content or b'')
+    _increment("http_bytes", name, size)
+    if rerun is not None:
+        rerun["http_bytes"] += size
+    if response.status_code >= 400:
+        _increment("http_errors", name)
+    return response
+
+
+# --- FUNCIONES DE ANÁLISIS ---
+def timed(name=None):
+    """Decorador que mide el tiempo de cálculo de una función (sin contar las llamadas HTTP internas)."""
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = _local.__dict__.setdefault("stack", [])
+            frame = {"http_ms": 0.0}
+            stack.append(frame)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stack.pop()
+                ms = (time.perf_counter() - started) * 1000
+                _observe("compute", label, ms - frame["http_ms"])
+                rerun = _rerun()
+                if rerun is not None and not stack:
+                    rerun["compute_ms"] += ms - frame["http_ms"]
+        return wrapper
+    return decorator
+
+
+# --- EJECUCIONES DE PÁGINA ---
+def begin_rerun(page):
+    """Marca el inicio de una ejecución del script de la página (llamar al principio)."""
+    _local.rerun = {"page": page, "started": time.perf_counter(), "http_ms": 0.0, "http_calls": 0, "http_bytes": 0, "compute_ms": 0.0}
+    _local.stack = []
+    return _local.rerun
+
+
+def end_rerun(rerun):
+    """Cierra la ejecución, registra su duración y devuelve el desglose."""
+    wall_ms = (time.perf_counter() - rerun["started"]) * 1000
+    _observe("rerun", rerun["page"], wall_ms)
+    summary = {
+        "page": rerun["page"], "wall_ms": wall_ms, "http_ms": rerun["http_ms"], "http_calls": rerun["http_calls"],
+        "http_bytes": rerun["http_bytes"], "compute_ms": rerun["compute_ms"],
+        "render_ms": max(wall_ms - rerun["http_ms"] - rerun["compute_ms"], 0.0),
+    }
+    _local.rerun = None
+    return summary
+
+
+# --- HILOS AUXILIARES ---
+def begin_worker():
+    """Acumulador propio para las peticiones que un hilo auxiliar hace en nombre de una página."""
+    _local.rerun = {"http_ms": 0.0, "http_calls": 0, "http_bytes": 0, "compute_ms": 0.0}
+    _local.stack = []
+    return _local.rerun
+
+
+def end_worker():
+    _local.rerun = None
+
+
+def add_concurrent_wait(wait_ms, workers):
+    """Suma a la ejecución de la página las peticiones de varios hilos que se esperaron a la vez.
+
+    Las llamadas y los bytes se suman; el tiempo de red es el que realmente se esperó (`wait_ms`),
+    no la suma de las latencias.
+    """
+    rerun = _rerun()
+    if rerun is not None:
+        rerun["http_ms"] += wait_ms
+        rerun["http_calls"] += sum(w["http_calls"] for w in workers)
+        rerun["http_bytes"] += sum(w["http_bytes"] for w in workers)
+    for frame in getattr(_local, "stack", []):
+        frame["http_ms"] += wait_ms
+
+
+# --- EXPORTACIÓN ---
+def _quantile(h, q):
+    """Cuantil aproximado a partir de los cubos del histograma (límite superior del cubo)."""
+    if not h["count"]:
+        return None
+    target, seen = q * h["count"], 0
+    for bound, n in zip(BUCKETS_MS, h["buckets"]):
+        seen += n
+        if seen >= target:
+            return bound
+    return BUCKETS_MS[-1]
+
+
+def snapshot():
+    """Todas las métricas del proceso como dict serializable."""
+    with _lock:
+        histograms = [
+            {"type": kind, "name": name, "count": h["count"], "sum_ms": h["sum"], "mean_ms": h["sum"] / h["count"] if h["count"] else None,
+             "p50_ms": _quantile(h, 0.5), "p95_ms": _quantile(h, 0.95), "buckets": dict(zip(map(str, BUCKETS_MS), h["buckets"]))}
+            for (kind, name), h in sorted(_histograms.items())
+        ]
+        counters = [{"metric": metric, "name": name, "value": value} for (metric, name), value in sorted(_counters.items())]
+    return {"timestamp": time.time(), "histograms": histograms, "counters": counters, "caches": cache_stats()}
+
+
+def to_json():
+    return json.dumps(snapshot(), indent=2, default=str)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def to_prometheus():
+    """Métricas en formato de texto de Prometheus."""
+    snap = snapshot()
+    lines = ["# TYPE coach_latency_ms histogram"]
+    for h in snap["histograms"]:
+        labels = f'type="{h["type"]}",name="{_escape(h["name"])}"'
+        cumulative = 0
+        for bound, n in h["buckets"].items():
+            cumulative += n
+            le = "+Inf" if bound == "inf" else bound
+            lines.append(f'coach_latency_ms_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f'coach_latency_ms_sum{{{labels}}} {h["sum_ms"]:.3f}')
+        lines.append(f'coach_latency_ms_count{{{labels}}} {h["count"]}')
+    for metric in sorted({c["metric"] for c in snap["counters"]}):
+        lines.append(f"# TYPE coach_{metric}_total counter")
+        lines += [f'coach_{metric}_total{{name="{_escape(c["name"])}"}} {c["value"]}' for c in snap["counters"] if c["metric"] == metric]
+    for metric, kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("coalesced", "counter"), ("bytes", "gauge"), ("entries", "gauge")):
+        suffix = "_total" if kind == "counter" else ""
+        lines.append(f"# TYPE coach_cache_{metric}{suffix} {kind}")
+        lines += [f'coach_cache_{metric}{suffix}{{cache="{_escape(c["name"])}"}} {c[metric]}' for c in snap["caches"]]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,69 @@
+"""Cliente mínimo de la API de Intervals.icu para las herramientas fuera de las páginas."""
+import threading
+import time
+
+import requests
+
+from instrumentation import http_get
+
+BASE_URL = "https://intervals.icu/api/v1"
+STREAM_TYPES = "time,watts,heartrate,cadence,velocity_smooth"
+
+
+class TokenBucket:
+    """Limitador de peticiones por segundo compartido entre hilos."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def get_json(path, api_key, params=None, limiter=None, retries=4, timeout=30):
+    """GET sobre la API con reintentos (429/5xx) y, opcionalmente, un limitador de ritmo."""
+    for attempt in range(retries + 1):
+        if limiter:
+            limiter.acquire()
+        try:
+            response = http_get(f"{BASE_URL}{path}", auth=('API_KEY', api_key), params=params, timeout=timeout)
+        except requests.exceptions.RequestException:
+            if attempt == retries:
+                raise
+        else:
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code not in (429, 500, 502, 503, 504) or attempt == retries:
+                response.raise_for_status()
+        time.sleep(min(2 ** attempt, 30))
+
+
+def fetch_wellness(athlete_id, api_key, oldest, newest, limiter=None):
+    return get_json(f"/athlete/{athlete_id}/wellness", api_key, {'oldest': oldest, 'newest': newest}, limiter) or []
+
+
+def fetch_activities(athlete_id, api_key, oldest, newest, limiter=None):
+    return get_json(f"/athlete/{athlete_id}/activities", api_key, {'oldest': oldest, 'newest': newest}, limiter) or []
+
+
+def fetch_events(athlete_id, api_key, oldest, newest, limiter=None):
+    return get_json(f"/athlete/{athlete_id}/events", api_key, {'oldest': oldest, 'newest': newest}, limiter) or []
+
+
+def fetch_streams(activity_id, api_key, limiter=None):
+    """Streams segundo a segundo de una actividad como {tipo: lista de valores}."""
+    data = get_json(f"/activity/{activity_id}/streams", api_key, {'types': STREAM_TYPES}, limiter) or []
+    return {s['type']: s.get('data') or [] for s in data if s.get('type')}
@@ -0,0 +1,229 @@
+"""Almacén local (SQLite) con el historial del atleta: bienestar, actividades, eventos y streams."""
+import json
+import os
+import sqlite3
+
+import pandas as pd
+
+import search_index
+import stream_archive
+from settings import athlete_dir
+
+WELLNESS_COLUMNS = ['ctl', 'atl', 'hrv', 'restingHR', 'sleepScore', 'BodyBatteryMax', 'BodyBatteryMin']
+ACTIVITY_COLUMNS = ['type', 'name', 'moving_time', 'icu_training_load', 'icu_intensity', 'icu_weighted_avg_watts',
+                    'icu_average_watts', 'average_heartrate', 'max_heartrate']
+EVENT_COLUMNS = ['category', 'name', 'description', 'moving_time', 'icu_training_load', 'icu_intensity']
+# Columnas de los resúmenes por semana ISO y por mes (ver `rollups`)
+ROLLUP_COLUMNS = ['wellness_days', 'activities', 'tss', 'moving_time', 'rhr', 'hrv', 'sleep_score', 'body_battery_max',
+                  'body_battery_min', 'ctl', 'atl', 'ctl_end', 'atl_end', 'tsb_end', 'efficiency', 'power_hr', 'power_hr_z2',
+                  'hr_zone_times', 'power_zone_times']
+_ROLLUP_TABLE = f"""(
+    period TEXT PRIMARY KEY, period_start TEXT, period_end TEXT,
+    {', '.join(f"{c} {'TEXT' if c.endswith('zone_times') else 'REAL'}" for c in ROLLUP_COLUMNS)},
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+)"""
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS wellness (
+    date TEXT PRIMARY KEY, {', '.join(f'{c} REAL' for c in WELLNESS_COLUMNS)}, raw TEXT
+);
+CREATE TABLE IF NOT EXISTS activities (
+    id TEXT PRIMARY KEY, date TEXT, type TEXT, name TEXT, moving_time REAL, icu_training_load REAL, icu_intensity REAL,
+    icu_weighted_avg_watts REAL, icu_average_watts REAL, average_heartrate REAL, max_heartrate REAL, raw TEXT
+);
+CREATE INDEX IF NOT EXISTS activities_date ON activities(date);
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY, date TEXT, category TEXT, name TEXT, description TEXT, moving_time REAL,
+    icu_training_load REAL, icu_intensity REAL, raw TEXT
+);
+CREATE INDEX IF NOT EXISTS events_date ON events(date);
+CREATE TABLE IF NOT EXISTS streams (
+    activity_id TEXT PRIMARY KEY, data BLOB
+);
+CREATE TABLE IF NOT EXISTS weekly_rollups {_ROLLUP_TABLE};
+CREATE TABLE IF NOT EXISTS monthly_rollups {_ROLLUP_TABLE};
+CREATE TABLE IF NOT EXISTS best_efforts (
+    activity_id TEXT PRIMARY KEY, date TEXT, stream_rowid INTEGER, watts TEXT
+);
+CREATE TABLE IF NOT EXISTS cp_fits (
+    model TEXT, window_days INTEGER, window_end TEXT, cp REAL, w_prime REAL, p_max REAL, rmse REAL, n_rides INTEGER,
+    fitted_at TEXT DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (model, window_days, window_end)
+);
+CREATE TABLE IF NOT EXISTS decoupling (
+    activity_id TEXT, params TEXT, date TEXT, stream_rowid INTEGER, pa_hr REAL, ef_first REAL, ef_second REAL, kept_share REAL,
+    PRIMARY KEY (activity_id, params)
+);
+CREATE INDEX IF NOT EXISTS decoupling_params_date ON decoupling(params, date);
+CREATE TABLE IF NOT EXISTS decoupling_params (
+    params TEXT PRIMARY KEY, used_at REAL
+);
+CREATE TABLE IF NOT EXISTS zone_times (
+    activity_id TEXT PRIMARY KEY, date TEXT, stream_rowid INTEGER, zones_version TEXT, power_secs TEXT, hr_secs TEXT
+);
+CREATE INDEX IF NOT EXISTS zone_times_date ON zone_times(date);
+CREATE TABLE IF NOT EXISTS decomposition (
+    signal TEXT, date TEXT, value REAL, trend REAL, weekly REAL, seasonal REAL, residual REAL, PRIMARY KEY (signal, date)
+);
+CREATE TABLE IF NOT EXISTS decomposition_fits (
+    signal TEXT PRIMARY KEY, fitted_through TEXT, params TEXT, weekly TEXT, seasonal TEXT, fitted_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT, day TEXT, activity_id TEXT, changed_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    kind TEXT, chunk_start TEXT, chunk_end TEXT, done_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (kind, chunk_start, chunk_end)
+);
+"""
+
+
+def db_path(athlete_id):
+    return os.path.join(athlete_dir(athlete_id), "history.sqlite")
+
+
+def connect(athlete_id):
+    """Abre (y crea si hace falta) el almacén del atleta."""
+    conn = sqlite3.connect(db_path(athlete_id), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _wellness_row(w):
+    return (w['id'][:10], *(w.get(c) for c in WELLNESS_COLUMNS), json.dumps(w))
+
+
+def _activity_row(a):
+    return (str(a['id']), (a.get('start_date_local') or '')[:10], *(a.get(c) for c in ACTIVITY_COLUMNS), json.dumps(a))
+
+
+def _event_row(e):
+    return (str(e['id']), (e.get('start_date_local') or '')[:10], *(e.get(c) for c in EVENT_COLUMNS), json.dumps(e))
+
+
+def upsert_wellness(conn, records):
+    conn.executemany(f"INSERT OR REPLACE INTO wellness VALUES ({', '.join('?' * (len(WELLNESS_COLUMNS) + 2))})",
+                     [_wellness_row(w) for w in records if w.get('id')])
+
+
+def upsert_activities(conn, records):
+    conn.executemany(f"INSERT OR REPLACE INTO activities VALUES ({', '.join('?' * (len(ACTIVITY_COLUMNS) + 3))})",
+                     [_activity_row(a) for a in records if a.get('id')])
+    search_index.index_activities(conn, records)
+
+
+def upsert_events(conn, records):
+    conn.executemany(f"INSERT OR REPLACE INTO events VALUES ({', '.join('?' * (len(EVENT_COLUMNS) + 3))})",
+                     [_event_row(e) for e in records if e.get('id')])
+    search_index.index_events(conn, records)
+
+
+def put_streams(conn, items):
+    """Guarda streams [(activity_id, {tipo: valores})] en el formato comprimido de `stream_archive`.
+
+    Una actividad sin streams se guarda con un blob vacío, para no volver a pedirlos a la API.
+    """
+    conn.executemany("INSERT OR REPLACE INTO streams VALUES (?, ?)",
+                     [(str(activity_id), stream_archive.encode_streams(streams) if streams else b"") for activity_id, streams in items])
+
+
+def get_stream_blob(conn, activity_id):
+    """Archivo de streams de una actividad (convierte al vuelo los guardados como JSON por versiones anteriores).
+
+    Devuelve None si la actividad no está en el almacén y b"" si está guardada sin streams.
+    """
+    row = conn.execute("SELECT data FROM streams WHERE activity_id = ?", (str(activity_id),)).fetchone()
+    if not row:
+        return None
+    data = row[0]
+    if isinstance(data, str) or bytes(data[:1]) == b"{":
+        data = stream_archive.encode_streams(json.loads(data))
+        conn.execute("UPDATE streams SET data = ? WHERE activity_id = ?", (data, str(activity_id)))
+        conn.commit()
+    return bytes(data)
+
+
+def get_streams(conn, activity_id, channels=None):
+    """Streams completos de una actividad como {tipo: np.ndarray}."""
+    blob = get_stream_blob(conn, activity_id)
+    return stream_archive.decode_streams(blob, channels) if blob else None
+
+
+def get_streams_slice(conn, activity_id, start_time, end_time, channels=None):
+    """Solo la ventana [start_time, end_time) en segundos, sin decodificar el resto del archivo."""
+    blob = get_stream_blob(conn, activity_id)
+    return stream_archive.decode_slice(blob, start_time, end_time, channels) if blob else None
+
+
+def delete_activities(conn, activity_ids):
+    """Borra actividades (y sus streams); devuelve los días en que estaban."""
+    ids = [str(i) for i in activity_ids]
+    days = activity_days(conn, ids)
+    conn.executemany("DELETE FROM activities WHERE id = ?", [(i,) for i in ids])
+    search_index.remove_activities(conn, ids)
+    delete_streams(conn, ids)
+    return days
+
+
+def delete_streams(conn, activity_ids):
+    conn.executemany("DELETE FROM streams WHERE activity_id = ?", [(str(i),) for i in activity_ids])
+
+
+def activity_days(conn, activity_ids):
+    """Días guardados de las actividades indicadas."""
+    ids = [str(i) for i in activity_ids]
+    if not ids:
+        return []
+    return [r[0] for r in conn.execute(f"SELECT DISTINCT date FROM activities WHERE id IN ({', '.join('?' * len(ids))})", ids)]
+
+
+def log_changes(conn, days, activity_ids=(), keep_days=7):
+    """Anota los días y actividades modificados para que otros procesos invaliden sus cachés."""
+    conn.executemany("INSERT INTO changes (day, activity_id) VALUES (?, ?)",
+                     [(day, None) for day in sorted(days)] + [(None, str(i)) for i in sorted(activity_ids)])
+    conn.execute("DELETE FROM changes WHERE changed_at < datetime('now', ?)", (f"-{int(keep_days)} days",))
+
+
+def changes_since(conn, seq):
+    """(último seq, días, actividades) cambiados después de `seq` (con `seq=None` solo el último seq)."""
+    last = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+    if seq is None or seq >= last:
+        return last, set(), set()
+    rows = conn.execute("SELECT day, activity_id FROM changes WHERE seq > ? AND seq <= ?", (seq, last)).fetchall()
+    return last, {d for d, _ in rows if d}, {a for _, a in rows if a}
+
+
+def mark_done(conn, kind, chunk_start, chunk_end):
+    conn.execute("INSERT OR REPLACE INTO checkpoints (kind, chunk_start, chunk_end) VALUES (?, ?, ?)", (kind, chunk_start, chunk_end))
+
+
+def done_chunks(conn, kind):
+    return set(conn.execute("SELECT chunk_start, chunk_end FROM checkpoints WHERE kind = ?", (kind,)).fetchall())
+
+
+def load_wellness(conn, start=None, end=None):
+    """Bienestar del almacén como DataFrame indexado por fecha (mismo formato que las páginas)."""
+    df = pd.read_sql_query(
+        f"SELECT date AS id, {', '.join(WELLNESS_COLUMNS)} FROM wellness WHERE date BETWEEN ? AND ? ORDER BY date",
+        conn, params=(str(start or '0000-00-00'), str(end or '9999-99-99')))
+    df['id'] = pd.to_datetime(df['id'])
+    return df.set_index('id')
+
+
+def load_activities(conn, start=None, end=None, raw=False):
+    """Actividades del almacén; con `raw=True` devuelve la lista de JSON originales."""
+    params = (str(start or '0000-00-00'), str(end or '9999-99-99'))
+    if raw:
+        rows = conn.execute("SELECT raw FROM activities WHERE date BETWEEN ? AND ? ORDER BY date", params).fetchall()
+        return [json.loads(r[0]) for r in rows]
+    df = pd.read_sql_query(f"SELECT id, date, {', '.join(ACTIVITY_COLUMNS)} FROM activities WHERE date BETWEEN ? AND ? ORDER BY date",
+                           conn, params=params)
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def load_events(conn, start=None, end=None):
+    params = (str(start or '0000-00-00'), str(end or '9999-99-99'))
+    rows = conn.execute("SELECT raw FROM events WHERE date BETWEEN ? AND ? ORDER BY date", params).fetchall()
+    return [json.loads(r[0]) for r in rows]
@@ -3,6 +3,18 @@ import requests
 from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
+import copy
+import time
+import analytics
+import charts
+import local_store
+import readiness_rules
+from data_cache import bounded_cache
+from anomaly_detector import load_state, save_state, update_from_frame, recent_flags, covers, SIGNAL_LABELS
+from instrumentation import timed
+from perf_panel import start_page, finish_page
+
+rerun = start_page("Salud")
 
 # --- CONFIGURACIÓN ---
 try:
@@ -13,133 +25,42 @@ except FileNotFoundError:
     st.stop()
 
 # --- LÓGICA DE ANÁLISIS UNIFICADA ---
+# Cada sección de la página es un fragmento que solo depende de la ventana de fechas que recibe y
+# lee sus cálculos de una caché propia: al abrir un desplegable solo se vuelve a ejecutar su sección,
+# y al cambiar de fecha cada sección recalcula únicamente lo que le falta para esa ventana.
+VERDICTS = {
+    'green': "✅ **LUZ VERDE:** Estado óptimo.",
+    'yellow': "⚠️ **LUZ AMARILLA:** Estado aceptable.",
+    'red': "🚫 **LUZ ROJA:** Señales de fatiga significativa.",
+}
+
+def wellness_window(selected_date):
+    """Rango de bienestar que usan todas las secciones: las 12 semanas anteriores y el propio día."""
+    return selected_date - timedelta(days=analytics.READINESS_WINDOW_DAYS), selected_date
 
-@st.cache_data(ttl=3600)
 def get_wellness_data(start_date, end_date):
     """Función central para obtener datos de bienestar."""
-    params = {'oldest': start_date.strftime('%Y-%m-%d'), 'newest': end_date.strftime('%Y-%m-%d')}
-    wellness_url = f"https://intervals.icu/api/v1/athlete/{ATHLETE_ID}/wellness"
-    try:
-        response = requests.get(wellness_url, auth=('API_KEY', API_KEY), params=params)
-        if response.status_code == 200 and response.json():
-            df = pd.DataFrame(response.json())
-            df['id'] = pd.to_datetime(df['id'])
-            df.set_index('id', inplace=True)
-            return df.sort_index()
-        return pd.DataFrame()
-    except requests.exceptions.RequestException:
-        return pd.DataFrame()
-
-def calculate_baselines(daily_df):
-    """Calcula las 3 líneas basales a partir de datos diarios."""
-    baselines = {
-        'recovery': pd.Series(dtype='float64'),
-        'chronic': pd.Series(dtype='float64'),
-        'historic': pd.Series(dtype='float64')
-    }
-    if daily_df.empty or len(daily_df) < 7:
-        return baselines
-
-    weekly_df = daily_df[['atl', 'restingHR', 'hrv']].resample('W-SUN').mean().dropna()
-
-    if weekly_df.empty:
-        return baselines
-
-    avg_atl = weekly_df['atl'].mean()
-    low_load_weeks = weekly_df[weekly_df['atl'] <= avg_atl]
-    baselines['recovery'] = low_load_weeks[['restingHR', 'hrv']].mean()
-    
-    if len(weekly_df) >= 4:
-        baselines['chronic'] = weekly_df[['restingHR', 'hrv']].tail(4).mean()
-    
-    if len(weekly_df) >= 8:
-        baselines['historic'] = weekly_df[['restingHR', 'hrv']].tail(8).mean()
-    
-    return baselines
-
-def get_readiness_analysis_v3(selected_date):
-    """Función principal que ahora incluye toda la lógica de análisis."""
-    start_date = selected_date - timedelta(days=84)
-    end_date = selected_date
-    
-    df = get_wellness_data(start_date, end_date)
-
-    if df.empty or pd.to_datetime(selected_date).strftime('%Y-%m-%d') not in df.index.strftime('%Y-%m-%d'):
-        return {"error": f"No hay datos de bienestar para el día {selected_date.strftime('%d-%m-%Y')}"}
-
-    today_data = df.loc[selected_date.strftime('%Y-%m-%d')]
-    past_df = df[df.index < pd.to_datetime(selected_date)]
-    
-    # Datos del día
-    hrv_hoy = today_data.get('hrv')
-    rhr_hoy = today_data.get('restingHR')
-    sleep_score_hoy = today_data.get('sleepScore')
-
-    # --- Cálculos para las nuevas funcionalidades ---
-    
-    # 1. Comparación semanal
-    today_weekday = selected_date.weekday()
-    start_of_current_week = selected_date - timedelta(days=today_weekday)
-    start_of_last_week = start_of_current_week - timedelta(days=7)
-    
-    # --- CORRECCIÓN DEL ERROR DE FECHAS ---
-    # Convertimos las fechas de Python a Timestamps de Pandas para poder comparar
-    pd_selected_date = pd.to_datetime(selected_date)
-    pd_start_of_current_week = pd.to_datetime(start_of_current_week)
-    pd_start_of_last_week = pd.to_datetime(start_of_last_week)
-
-    hrv_current_week = df[(df.index >= pd_start_of_current_week) & (df.index <= pd_selected_date)]['hrv'].mean()
-    hrv_last_week = df[(df.index >= pd_start_of_last_week) & (df.index < pd_start_of_current_week)]['hrv'].mean()
-
-    # 2. Alerta silenciosa de HRV
-    hrv_last_3_days = df[df.index <= pd_selected_date]['hrv'].tail(3)
-    
-    # --- Puntuación de Readiness (Lógica existente) ---
-    score, breakdown = 0, []
-    hrv_baseline_28d = past_df['hrv'].tail(28).mean()
-    hrv_std_28d = past_df['hrv'].tail(28).std()
-
-    if pd.notna(hrv_hoy) and pd.notna(hrv_baseline_28d) and pd.notna(hrv_std_28d):
-        hrv_normal_range_lower = hrv_baseline_28d - (0.75 * hrv_std_28d)
-        if hrv_hoy >= hrv_baseline_28d + (0.5 * hrv_std_28d): hrv_points = 45
-        elif hrv_hoy >= hrv_normal_range_lower: hrv_points = 30
-        elif hrv_hoy >= hrv_baseline_28d - hrv_std_28d: hrv_points = 15
-        else: hrv_points = 0
-        score += hrv_points
-        breakdown.append(f"**VFC (HRV):** `{hrv_hoy:.1f}ms`. Rango normal: `{hrv_normal_range_lower:.1f}ms - {hrv_baseline_28d + (0.5 * hrv_std_28d):.1f}ms` → **{hrv_points} ptos**.")
-
-    if pd.notna(rhr_hoy):
-        rhr_points = 0
-        if rhr_hoy <= 45: rhr_points = 35
-        elif rhr_hoy <= 48: rhr_points = 25
-        elif rhr_hoy <= 52: rhr_points = 10
-        score += rhr_points
-        breakdown.append(f"**FC Reposo:** `{rhr_hoy:.0f}bpm` → **{rhr_points} ptos**.")
-
-    if pd.notna(sleep_score_hoy):
-        sleep_points = 20 if sleep_score_hoy >= 80 else 10 if sleep_score_hoy >= 70 else 0
-        score += sleep_points
-        breakdown.append(f"**P. Sueño:** `{sleep_score_hoy:.0f}` → **{sleep_points} ptos**.")
-    
-    verdict_text = "✅ **LUZ VERDE:** Estado óptimo."
-    if score < 60: verdict_text = "🚫 **LUZ ROJA:** Señales de fatiga significativa."
-    elif score < 80: verdict_text = "⚠️ **LUZ AMARILLA:** Estado aceptable."
-
-    baselines = calculate_baselines(past_df)
-
-    return {
-        "verdict": verdict_text, "readiness_score": score, "score_breakdown": breakdown,
-        "hrv_7d_data": past_df['hrv'].tail(7), "rhr_7d_data": past_df['restingHR'].tail(7),
-        "metrics": {
-            "FC Reposo": {"value": rhr_hoy, "avg7": past_df['restingHR'].tail(7).mean()},
-            "VFC (HRV)": {"value": hrv_hoy, "avg7": past_df['hrv'].tail(7).mean()},
-            "Puntuación Sueño": {"value": sleep_score_hoy}
-        },
-        "baselines": baselines,
-        "hrv_current_week_avg": hrv_current_week,
-        "hrv_last_week_avg": hrv_last_week,
-        "hrv_last_3_days": hrv_last_3_days
-    }
+    return analytics.fetch_wellness(ATHLETE_ID, API_KEY, start_date, end_date)
+
+def current_rules():
+    """Reglas de readiness del atleta (las de por defecto si no ha guardado otras)."""
+    return readiness_rules.load_rules(ATHLETE_ID)
+
+@bounded_cache(ttl=3600)
+def get_day_summary(start_date, end_date, rules_version):
+    """Puntuación, veredicto y métricas del último día de la ventana (`rules_version` forma parte de la clave)."""
+    summary = analytics.day_summary(get_wellness_data(start_date, end_date), end_date, current_rules())
+    if "error" not in summary:
+        summary["verdict"] = VERDICTS.get(summary["level"], summary["level"])
+    return summary
+
+@bounded_cache(ttl=3600)
+def get_baselines(start_date, end_date):
+    return analytics.past_baselines(get_wellness_data(start_date, end_date), end_date)
+
+@bounded_cache(ttl=3600)
+def get_hrv_trend(start_date, end_date):
+    return analytics.hrv_trend(get_wellness_data(start_date, end_date), end_date)
 
 # --- FUNCIONES DE LA INTERFAZ ---
 def display_gauge(score):
@@ -153,141 +74,164 @@ def display_gauge(score):
     """
     st.markdown(gauge_html, unsafe_allow_html=True)
 
-# --- INTERFAZ PRINCIPAL ---
-st.set_page_config(layout="wide", page_title="Coach IA de Readiness")
-st.title("💗 Estado de Salud y Coaching Diario")
+@st.fragment
+def coaching_section(start_date, end_date):
+    m, b = get_day_summary(start_date, end_date, readiness_rules.version(current_rules()))["metrics"], get_baselines(start_date, end_date)
+    hrv_hoy, rhr_hoy, sleep_hoy = m['VFC (HRV)']['value'], m['FC Reposo']['value'], m['Puntuación Sueño']['value']
 
-selected_date = st.date_input("Selecciona la fecha de análisis:", datetime.now().date())
+    st.markdown("---")
+    st.subheader("💡 Coaching del Día")
 
-if selected_date:
-    analysis = get_readiness_analysis_v3(selected_date)
-    
-    if "error" in analysis:
-        st.error(analysis["error"])
-    else:
-        # Extraer datos para facilitar el acceso
-        m = analysis["metrics"]
-        b = analysis["baselines"]
-        hrv_hoy = m['VFC (HRV)']['value']
-        rhr_hoy = m['FC Reposo']['value']
-        sleep_hoy = m['Puntuación Sueño']['value']
-        
-        # --- SECCIÓN DE COACHING (NUEVA) ---
-        st.markdown("---")
-        st.subheader("💡 Coaching del Día")
-        
-        # 3. Frase Clave del Día tipo WHOOP
-        frase = "Analizando tus datos para darte una recomendación..."
-        if pd.notna(hrv_hoy) and pd.notna(rhr_hoy) and not b.get('historic', pd.Series()).empty:
-            hrv_vs_hist = hrv_hoy - b['historic'].get('hrv', hrv_hoy)
-            rhr_vs_hist = rhr_hoy - b['historic'].get('restingHR', rhr_hoy)
-            if hrv_vs_hist >= 0 and rhr_vs_hist <= 0:
-                frase = "✅ **Tu cuerpo está listo para rendir.** Sistema nervioso recuperado y sin signos de fatiga. Buen día para un entrenamiento de calidad."
-            elif hrv_vs_hist < -3 and rhr_vs_hist > 1:
-                frase = "🚫 **Señales claras de fatiga.** Tu sistema nervioso está estresado. Prioriza la recuperación; un entrenamiento de alta intensidad no es recomendable."
-            elif hrv_vs_hist < 0 and rhr_vs_hist > 0:
-                frase = "⚠️ **Fatiga presente, pero controlada.** Considera un entrenamiento de menor intensidad o duración. Escucha a tu cuerpo."
-            else:
-                frase = "🔄 **Estado general estable.** Puedes seguir con el plan, prestando atención a las sensaciones durante el esfuerzo."
-        st.info(frase)
-
-        # 2. Resumen Semáforo con Íconos
-        st.markdown("##### Vistazo Rápido del Día")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            hrv_rec_baseline = b.get('recovery', pd.Series()).get('hrv', hrv_hoy)
-            if pd.notna(hrv_hoy) and pd.notna(hrv_rec_baseline):
-                if hrv_hoy >= hrv_rec_baseline: st.markdown("🧬 **HRV:** ✅ Óptimo")
-                elif hrv_hoy >= hrv_rec_baseline * 0.95: st.markdown("🧬 **HRV:** ⚠️ Estable")
-                else: st.markdown("🧬 **HRV:** 🚫 Bajo")
-        with col2:
-            rhr_rec_baseline = b.get('recovery', pd.Series()).get('restingHR', rhr_hoy)
-            if pd.notna(rhr_hoy) and pd.notna(rhr_rec_baseline):
-                if rhr_hoy <= rhr_rec_baseline: st.markdown("❤️ **RHR:** ✅ Óptimo")
-                elif rhr_hoy <= rhr_rec_baseline + 2: st.markdown("❤️ **RHR:** ⚠️ Ligeramente elevado")
-                else: st.markdown("❤️ **RHR:** 🚫 Elevado")
-        with col3:
-            if pd.notna(sleep_hoy):
-                if sleep_hoy >= 80: st.markdown("🛌 **Sueño:** ✅ Bueno")
-                elif sleep_hoy >= 70: st.markdown("🛌 **Sueño:** ⚠️ Regular")
-                else: st.markdown("🛌 **Sueño:** 🚫 Pobre")
-
-        # --- SECCIÓN DE AUTOEVALUACIÓN (NUEVA) ---
-        with st.expander("🔍 Autoevaluación: ¿Mejorando o Empeorando?"):
-            
-            # 1. Autoevaluación vs Basales
-            st.markdown("**Comparativa vs. Líneas Basales:**")
-            if pd.notna(hrv_hoy) and not b.get('historic', pd.Series()).empty:
-                diff = hrv_hoy - b['historic']['hrv']
-                sign = "+" if diff >= 0 else ""
-                st.write(f"- **HRV hoy ({hrv_hoy:.1f} ms)** está `{sign}{diff:.1f} ms` respecto a tu media histórica ({b['historic']['hrv']:.1f} ms).")
-            
-            if pd.notna(rhr_hoy) and not b.get('chronic', pd.Series()).empty:
-                diff = rhr_hoy - b['chronic']['restingHR']
-                sign = "+" if diff >= 0 else ""
-                st.write(f"- **RHR hoy ({rhr_hoy:.0f} bpm)** está `{sign}{diff:.1f} bpm` sobre tu crónica de 28 días ({b['chronic']['restingHR']:.1f} bpm).")
-
-            # 4. Comparación Semana Actual vs. Anterior
-            st.markdown("**Tendencia Semanal de HRV:**")
-            hrv_curr = analysis.get("hrv_current_week_avg")
-            hrv_last = analysis.get("hrv_last_week_avg")
-            if pd.notna(hrv_curr) and pd.notna(hrv_last):
-                diff_week = hrv_curr - hrv_last
-                sign_week = "⬆️" if diff_week >= 0 else "⬇️"
-                st.metric(
-                    label=f"Media HRV Semana Actual vs. Pasada",
-                    value=f"{hrv_curr:.1f} ms",
-                    delta=f"{diff_week:.1f} ms {sign_week}"
-                )
+    # Frase Clave del Día tipo WHOOP
+    frase = "Analizando tus datos para darte una recomendación..."
+    if pd.notna(hrv_hoy) and pd.notna(rhr_hoy) and not b.get('historic', pd.Series()).empty:
+        hrv_vs_hist = hrv_hoy - b['historic'].get('hrv', hrv_hoy)
+        rhr_vs_hist = rhr_hoy - b['historic'].get('restingHR', rhr_hoy)
+        if hrv_vs_hist >= 0 and rhr_vs_hist <= 0:
+            frase = "✅ **Tu cuerpo está listo para rendir.** Sistema nervioso recuperado y sin signos de fatiga. Buen día para un entrenamiento de calidad."
+        elif hrv_vs_hist < -3 and rhr_vs_hist > 1:
+            frase = "🚫 **Señales claras de fatiga.** Tu sistema nervioso está estresado. Prioriza la recuperación; un entrenamiento de alta intensidad no es recomendable."
+        elif hrv_vs_hist < 0 and rhr_vs_hist > 0:
+            frase = "⚠️ **Fatiga presente, pero controlada.** Considera un entrenamiento de menor intensidad o duración. Escucha a tu cuerpo."
+        else:
+            frase = "🔄 **Estado general estable.** Puedes seguir con el plan, prestando atención a las sensaciones durante el esfuerzo."
+    st.info(frase)
+
+    # Resumen Semáforo con Íconos
+    st.markdown("##### Vistazo Rápido del Día")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        hrv_rec_baseline = b.get('recovery', pd.Series()).get('hrv', hrv_hoy)
+        if pd.notna(hrv_hoy) and pd.notna(hrv_rec_baseline):
+            if hrv_hoy >= hrv_rec_baseline: st.markdown("🧬 **HRV:** ✅ Óptimo")
+            elif hrv_hoy >= hrv_rec_baseline * 0.95: st.markdown("🧬 **HRV:** ⚠️ Estable")
+            else: st.markdown("🧬 **HRV:** 🚫 Bajo")
+    with col2:
+        rhr_rec_baseline = b.get('recovery', pd.Series()).get('restingHR', rhr_hoy)
+        if pd.notna(rhr_hoy) and pd.notna(rhr_rec_baseline):
+            if rhr_hoy <= rhr_rec_baseline: st.markdown("❤️ **RHR:** ✅ Óptimo")
+            elif rhr_hoy <= rhr_rec_baseline + 2: st.markdown("❤️ **RHR:** ⚠️ Ligeramente elevado")
+            else: st.markdown("❤️ **RHR:** 🚫 Elevado")
+    with col3:
+        if pd.notna(sleep_hoy):
+            if sleep_hoy >= 80: st.markdown("🛌 **Sueño:** ✅ Bueno")
+            elif sleep_hoy >= 70: st.markdown("🛌 **Sueño:** ⚠️ Regular")
+            else: st.markdown("🛌 **Sueño:** 🚫 Pobre")
+
+@st.fragment
+def self_assessment_section(start_date, end_date):
+    # Su contenido solo se calcula mientras está abierto
+    expander = st.expander("🔍 Autoevaluación: ¿Mejorando o Empeorando?", key="salud_autoevaluacion", on_change="rerun")
+    with expander:
+        if not expander.open:
+            return
+        m, b = get_day_summary(start_date, end_date, readiness_rules.version(current_rules()))["metrics"], get_baselines(start_date, end_date)
+        trend = get_hrv_trend(start_date, end_date)
+        hrv_hoy, rhr_hoy = m['VFC (HRV)']['value'], m['FC Reposo']['value']
+
+        # 1. Autoevaluación vs Basales
+        st.markdown("**Comparativa vs. Líneas Basales:**")
+        if pd.notna(hrv_hoy) and not b.get('historic', pd.Series()).empty:
+            diff = hrv_hoy - b['historic']['hrv']
+            sign = "+" if diff >= 0 else ""
+            st.write(f"- **HRV hoy ({hrv_hoy:.1f} ms)** está `{sign}{diff:.1f} ms` respecto a tu media histórica ({b['historic']['hrv']:.1f} ms).")
+
+        if pd.notna(rhr_hoy) and not b.get('chronic', pd.Series()).empty:
+            diff = rhr_hoy - b['chronic']['restingHR']
+            sign = "+" if diff >= 0 else ""
+            st.write(f"- **RHR hoy ({rhr_hoy:.0f} bpm)** está `{sign}{diff:.1f} bpm` sobre tu crónica de 28 días ({b['chronic']['restingHR']:.1f} bpm).")
+
+        # 2. Comparación Semana Actual vs. Anterior
+        st.markdown("**Tendencia Semanal de HRV:**")
+        hrv_curr, hrv_last = trend["hrv_current_week_avg"], trend["hrv_last_week_avg"]
+        if pd.notna(hrv_curr) and pd.notna(hrv_last):
+            diff_week = hrv_curr - hrv_last
+            sign_week = "⬆️" if diff_week >= 0 else "⬇️"
+            st.metric(
+                label=f"Media HRV Semana Actual vs. Pasada",
+                value=f"{hrv_curr:.1f} ms",
+                delta=f"{diff_week:.1f} ms {sign_week}"
+            )
+        else:
+            st.caption("No hay suficientes datos para la comparación semanal.")
+
+        # 3. Alertas Silenciosas
+        st.markdown("**Alertas Fisiológicas:**")
+        hrv_rec_baseline = b.get('recovery', pd.Series()).get('hrv')
+        if pd.notna(hrv_rec_baseline) and len(trend['hrv_last_3_days']) == 3:
+            if all(trend['hrv_last_3_days'] < (hrv_rec_baseline - 5)):
+                st.warning("🚨 **HRV en caída durante 3 días consecutivos** vs. tu basal de recuperación. Considera ajustar la carga o priorizar el descanso.")
             else:
-                st.caption("No hay suficientes datos para la comparación semanal.")
-
-            # 5. Alertas Silenciosas
-            st.markdown("**Alertas Fisiológicas:**")
-            hrv_rec_baseline = b.get('recovery', pd.Series()).get('hrv')
-            if pd.notna(hrv_rec_baseline) and len(analysis['hrv_last_3_days']) == 3:
-                if all(analysis['hrv_last_3_days'] < (hrv_rec_baseline - 5)):
-                    st.warning("🚨 **HRV en caída durante 3 días consecutivos** vs. tu basal de recuperación. Considera ajustar la carga o priorizar el descanso.")
-                else:
-                    st.success("✅ No hay alertas de HRV significativas en los últimos 3 días.")
+                st.success("✅ No hay alertas de HRV significativas en los últimos 3 días.")
+        else:
+            st.caption("No hay suficientes datos para detectar tendencias de HRV.")
+
+        # 4. Detector incremental de anomalías sobre todo el historial
+        st.markdown("**Anomalías Multiseñal (historial completo):**")
+        anomaly_state = load_state(ATHLETE_ID)
+        if update_from_frame(anomaly_state, get_wellness_data(start_date, end_date)):
+            save_state(anomaly_state, ATHLETE_ID)
+        today_flag = anomaly_state["flags"].get(end_date.strftime('%Y-%m-%d'))
+        if not covers(anomaly_state, end_date):
+            st.info("ℹ️ Sin datos del detector para esta fecha: queda fuera del historial procesado.")
+        elif today_flag:
+            detail = ", ".join(f"{SIGNAL_LABELS[name]} (z={z:+.1f})" for name, z in today_flag["signals"].items())
+            if today_flag["multi"]:
+                st.error(f"🚨 **Anomalía en varias señales a la vez:** {detail}. Es un patrón típico de fatiga, enfermedad o estrés acumulado.")
             else:
-                st.caption("No hay suficientes datos para detectar tendencias de HRV.")
-
-        # --- SECCIONES ORIGINALES (Ligeramente Reordenadas) ---
-        st.markdown("---")
-        st.subheader("📈 Puntuación y Métricas Detalladas del Día")
-        
-        col1, col2 = st.columns(2)
-        with col1:
-            st.markdown(f"**Veredicto General: {analysis['verdict']}**")
-            display_gauge(analysis['readiness_score'])
-        with col2:
-            st.metric("VFC (HRV)", f"{hrv_hoy:.1f} ms" if pd.notna(hrv_hoy) else "N/A", f"{hrv_hoy - m['VFC (HRV)'].get('avg7', 0):.1f} vs 7d avg" if pd.notna(hrv_hoy) and pd.notna(m['VFC (HRV)'].get('avg7')) else None)
-            st.metric("FC Reposo", f"{rhr_hoy:.0f} bpm" if pd.notna(rhr_hoy) else "N/A", f"{rhr_hoy - m['FC Reposo'].get('avg7', 0):.1f} vs 7d avg" if pd.notna(rhr_hoy) and pd.notna(m['FC Reposo'].get('avg7')) else None, delta_color="inverse")
-            st.metric("Puntuación Sueño", f"{sleep_hoy:.0f}" if pd.notna(sleep_hoy) else "N/A")
-
-        st.markdown("---")
-        st.header("❤️ Tus Líneas Basales de Referencia")
-        st.caption("Compara tus valores diarios con estas referencias para entender tu estado a largo plazo.")
-        
-        b_col1, b_col2, b_col3 = st.columns(3)
-        with b_col1:
-            st.subheader("De Recuperación")
-            st.caption("Tu estado 'fresco'")
-            st.metric("RHR", f"{b.get('recovery', pd.Series()).get('restingHR', 0):.1f} bpm")
-            st.metric("HRV", f"{b.get('recovery', pd.Series()).get('hrv', 0):.1f} ms")
-        with b_col2:
-            st.subheader("Crónica (28 días)")
-            st.caption("Tu tendencia reciente")
-            st.metric("RHR", f"{b.get('chronic', pd.Series()).get('restingHR', 0):.1f} bpm")
-            st.metric("HRV", f"{b.get('chronic', pd.Series()).get('hrv', 0):.1f} ms")
-        with b_col3:
-            st.subheader("Histórica (60 días)")
-            st.caption("Tu referencia a largo plazo")
-            st.metric("RHR", f"{b.get('historic', pd.Series()).get('restingHR', 0):.1f} bpm")
-            st.metric("HRV", f"{b.get('historic', pd.Series()).get('hrv', 0):.1f} ms")
-
-        with st.expander("💡 ¿Cómo se calculan estas Líneas Basales?"):
+                st.warning(f"⚠️ **Señal fuera de tu rango habitual:** {detail}.")
+        else:
+            st.success("✅ Ninguna señal fuera de control para este día.")
+        recent_multi = recent_flags(anomaly_state, until=end_date, days=90, multi_only=True)
+        if recent_multi:
+            st.caption("Anomalías multiseñal en los últimos 90 días: " + ", ".join(pd.to_datetime(d).strftime('%d-%m') for d, _ in recent_multi))
+
+@st.fragment
+def detail_section(start_date, end_date):
+    analysis = get_day_summary(start_date, end_date, readiness_rules.version(current_rules()))
+    m = analysis["metrics"]
+    hrv_hoy, rhr_hoy, sleep_hoy = m['VFC (HRV)']['value'], m['FC Reposo']['value'], m['Puntuación Sueño']['value']
+
+    st.markdown("---")
+    st.subheader("📈 Puntuación y Métricas Detalladas del Día")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown(f"**Veredicto General: {analysis['verdict']}**")
+        display_gauge(analysis['readiness_score'])
+    with col2:
+        st.metric("VFC (HRV)", f"{hrv_hoy:.1f} ms" if pd.notna(hrv_hoy) else "N/A", f"{hrv_hoy - m['VFC (HRV)'].get('avg7', 0):.1f} vs 7d avg" if pd.notna(hrv_hoy) and pd.notna(m['VFC (HRV)'].get('avg7')) else None)
+        st.metric("FC Reposo", f"{rhr_hoy:.0f} bpm" if pd.notna(rhr_hoy) else "N/A", f"{rhr_hoy - m['FC Reposo'].get('avg7', 0):.1f} vs 7d avg" if pd.notna(rhr_hoy) and pd.notna(m['FC Reposo'].get('avg7')) else None, delta_color="inverse")
+        st.metric("Puntuación Sueño", f"{sleep_hoy:.0f}" if pd.notna(sleep_hoy) else "N/A")
+
+@st.fragment
+def baselines_section(start_date, end_date):
+    b = get_baselines(start_date, end_date)
+
+    st.markdown("---")
+    st.header("❤️ Tus Líneas Basales de Referencia")
+    st.caption("Compara tus valores diarios con estas referencias para entender tu estado a largo plazo.")
+
+    b_col1, b_col2, b_col3 = st.columns(3)
+    with b_col1:
+        st.subheader("De Recuperación")
+        st.caption("Tu estado 'fresco'")
+        st.metric("RHR", f"{b.get('recovery', pd.Series()).get('restingHR', 0):.1f} bpm")
+        st.metric("HRV", f"{b.get('recovery', pd.Series()).get('hrv', 0):.1f} ms")
+    with b_col2:
+        st.subheader("Crónica (28 días)")
+        st.caption("Tu tendencia reciente")
+        st.metric("RHR", f"{b.get('chronic', pd.Series()).get('restingHR', 0):.1f} bpm")
+        st.metric("HRV", f"{b.get('chronic', pd.Series()).get('hrv', 0):.1f} ms")
+    with b_col3:
+        st.subheader("Histórica (60 días)")
+        st.caption("Tu referencia a largo plazo")
+        st.metric("RHR", f"{b.get('historic', pd.Series()).get('restingHR', 0):.1f} bpm")
+        st.metric("HRV", f"{b.get('historic', pd.Series()).get('hrv', 0):.1f} ms")
+
+    expander = st.expander("💡 ¿Cómo se calculan estas Líneas Basales?", key="salud_basales_ayuda", on_change="rerun")
+    with expander:
+        if expander.open:
             st.markdown("""
             Para asegurar la estabilidad, los cálculos de las líneas basales en esta pestaña se basan en **promedios semanales** derivados de tus datos diarios. Así es como funciona cada una:
             1.  **Línea Basal de Recuperación:**
@@ -305,4 +249,92 @@ if selected_date:
                 * **Método:** Se toman los promedios semanales de `RHR` y `HRV` de las **últimas 8 semanas** y se calcula su media.
             
             **Nota Importante:** Estas basales solo incluyen `RHR` y `HRV`, no la puntuación de sueño.
-            """)
\ No newline at end of file
+            """)
+
+@timed()
+def rescore_history(saved_rules, edited_rules, fallback):
+    """Puntúa todo el historial local con las reglas guardadas y con las editadas. Devuelve ambas y los ms empleados."""
+    conn = local_store.connect(ATHLETE_ID)
+    try:
+        history = local_store.load_wellness(conn)
+    finally:
+        conn.close()
+    if history.empty:
+        history = fallback
+    started = time.perf_counter()
+    saved = readiness_rules.compile_rules(saved_rules).score(history)
+    edited = readiness_rules.compile_rules(edited_rules).score(history)
+    return saved, edited, (time.perf_counter() - started) * 1000
+
+@st.fragment
+def rules_section(start_date, end_date):
+    expander = st.expander("⚙️ Ajustar las Reglas de Readiness", key="salud_reglas", on_change="rerun")
+    with expander:
+        if not expander.open:
+            return
+        saved_rules = current_rules()
+        rules = copy.deepcopy(saved_rules)
+        st.caption("Cada señal suma los puntos de la primera banda que cumple. Edita umbrales y puntos: todo el historial "
+                   "se vuelve a puntuar al momento para comparar con las reglas guardadas.")
+
+        cols = st.columns(len(rules["signals"]))
+        for col, signal in zip(cols, rules["signals"]):
+            with col:
+                window = (signal.get("baseline") or {}).get("window")
+                condition = "≥" if signal["direction"] == 'higher' else "≤"
+                unit = f"desviaciones sobre la media de {window} días" if window else signal.get("unit") or "valor"
+                st.markdown(f"**{signal.get('label', signal['name'])}** ({condition} umbral, en {unit})")
+                bands = st.data_editor(pd.DataFrame(signal["bands"], columns=["Umbral", "Puntos"]), num_rows="dynamic",
+                                       hide_index=True, key=f"reglas_{signal['name']}")
+                signal["bands"] = [[float(u), float(p)] for u, p in bands.dropna().to_numpy()]
+
+        level_cols = st.columns(len(rules["levels"]))
+        for col, level in zip(level_cols, rules["levels"]):
+            level[0] = col.number_input(f"Nivel «{level[1]}» desde", 0.0, 1000.0, float(level[0]), step=5.0, key=f"reglas_nivel_{level[1]}")
+
+        try:
+            readiness_rules.validate(rules)
+        except ValueError as e:
+            st.error(f"Reglas no válidas: {e}")
+            return
+
+        saved, edited, elapsed_ms = rescore_history(saved_rules, rules, get_wellness_data(start_date, end_date))
+        charts.line_chart(pd.DataFrame({'Reglas guardadas': saved['score'], 'Reglas editadas': edited['score']}))
+        days = pd.DataFrame({'Reglas guardadas': saved['level'].value_counts(), 'Reglas editadas': edited['level'].value_counts()}).fillna(0).astype(int)
+        days.index = days.index.map(lambda level: VERDICTS.get(level, level).split(':')[0].replace('*', ''))
+        st.dataframe(days, use_container_width=True)
+        st.caption(f"{len(saved)} días puntuados dos veces en {elapsed_ms:.1f} ms.")
+
+        c1, c2 = st.columns(2)
+        if c1.button("💾 Guardar estas reglas", disabled=readiness_rules.version(rules) == readiness_rules.version(saved_rules)):
+            readiness_rules.save_rules(ATHLETE_ID, rules)
+            st.rerun(scope="app")
+        if c2.button("↩️ Volver a las reglas por defecto"):
+            readiness_rules.reset_rules(ATHLETE_ID)
+            for key in [k for k in st.session_state if str(k).startswith("reglas_")]:
+                del st.session_state[key]
+            st.rerun(scope="app")
+
+# --- INTERFAZ PRINCIPAL ---
+st.set_page_config(layout="wide", page_title="Coach IA de Readiness")
+st.title("💗 Estado de Salud y Coaching Diario")
+
+selected_date = st.date_input("Selecciona la fecha de análisis:", datetime.now().date())
+
+if selected_date:
+    window = wellness_window(selected_date)
+    try:
+        summary = get_day_summary(*window, readiness_rules.version(current_rules()))
+    except requests.exceptions.RequestException as e:
+        summary = {"error": f"Error de conexión con la API: {e}"}
+
+    if "error" in summary:
+        st.error(summary["error"])
+    else:
+        coaching_section(*window)
+        self_assessment_section(*window)
+        detail_section(*window)
+        baselines_section(*window)
+        rules_section(*window)
+
+finish_page(rerun, selected_date=selected_date)
\ No newline at end of file
@@ -1,12 +1,19 @@
 import streamlit as st
 import requests
 from datetime import datetime, timedelta
-import re
+import pandas as pd
+from plan_optimizer import optimize_plan, proposed_weekly_targets
+from workout_parser import estimate_workout, steps_to_rows
+from instrumentation import http_get
+from perf_panel import start_page, finish_page
+
+rerun = start_page("Planificación")
 
 # --- CONFIGURACIÓN ---
 try:
     ATHLETE_ID = st.secrets["ATHLETE_ID"]
     API_KEY = st.secrets["API_KEY"]
+    FTP = st.secrets.get("FTP")
 except FileNotFoundError:
     st.error("❌ No se ha encontrado el fichero de secretos.")
     st.stop()
@@ -31,11 +38,10 @@ def fetch_planned_events(start_date, end_date):
     url = f"https://intervals.icu/api/v1/athlete/{ATHLETE_ID}/events"
     params = {
         'oldest': start_date.strftime('%Y-%m-%d'),
-        'newest': end_date.strftime('%Y-%m-%d'),
-        'resolve': True 
+        'newest': end_date.strftime('%Y-%m-%d')
     }
     try:
-        response = requests.get(url, auth=('API_KEY', API_KEY), params=params)
+        response = http_get(url, auth=('API_KEY', API_KEY), params=params)
         if response.status_code == 200:
             return response.json()
         else:
@@ -45,6 +51,20 @@ def fetch_planned_events(start_date, end_date):
         st.error(f"Error de conexión: {e}")
         return None
 
+def fetch_current_load(day):
+    """Obtiene CTL y ATL del día indicado, punto de partida del optimizador."""
+    url = f"https://intervals.icu/api/v1/athlete/{ATHLETE_ID}/wellness"
+    params = {'oldest': (day - timedelta(days=7)).strftime('%Y-%m-%d'), 'newest': day.strftime('%Y-%m-%d')}
+    try:
+        response = http_get(url, auth=('API_KEY', API_KEY), params=params)
+        if response.status_code == 200 and response.json():
+            last = [d for d in response.json() if d.get('ctl') is not None and d.get('atl') is not None]
+            if last:
+                return last[-1]['ctl'], last[-1]['atl']
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error de conexión: {e}")
+    return None, None
+
 # --- INTERFAZ DE USUARIO ---
 st.set_page_config(layout="wide")
 st.title("🗓️ Planificador Semanal")
@@ -58,16 +78,57 @@ with col1:
 with col2:
     selected_week = st.number_input("Número de Semana", min_value=1, max_value=53, value=current_week)
 
+# --- OPTIMIZADOR DE CARGA HACIA LA CARRERA ---
+with st.expander("🎯 Optimizador de Carga hacia una Carrera Objetivo"):
+    st.caption("Busca la distribución de TSS que lleva tu CTL y tu TSB al objetivo el día de la carrera, respetando una rampa máxima de CTL por semana.")
+    o1, o2, o3, o4, o5 = st.columns(5)
+    race_date = o1.date_input("Fecha de la carrera", datetime.now().date() + timedelta(weeks=12))
+    target_ctl = o2.number_input("CTL objetivo", min_value=10.0, max_value=200.0, value=80.0, step=1.0)
+    target_tsb = o3.number_input("TSB objetivo", min_value=-40.0, max_value=40.0, value=10.0, step=1.0)
+    max_ramp = o4.number_input("Rampa máx. CTL/semana", min_value=1.0, max_value=15.0, value=6.0, step=0.5)
+    granularity = o5.radio("Reparto", ["weekly", "daily"], format_func=lambda g: "Semanal" if g == "weekly" else "Diario")
+
+    if st.button("⚙️ Optimizar Plan"):
+        today = datetime.now().date()
+        ctl0, atl0 = fetch_current_load(today)
+        if ctl0 is None:
+            st.warning("No se pudo obtener tu CTL/ATL actual para arrancar la simulación.")
+        else:
+            with st.spinner("Evaluando planes candidatos..."):
+                plan = optimize_plan(today, race_date, ctl0, atl0, target_ctl, target_tsb, max_ramp=max_ramp, granularity=granularity)
+            if "error" in plan:
+                st.error(plan["error"])
+            else:
+                st.session_state['optimized_plan'] = plan
+                st.session_state['proposed_weekly_tss'] = proposed_weekly_targets(plan)
+
+    plan = st.session_state.get('optimized_plan')
+    if plan:
+        p1, p2 = st.columns(2)
+        p1.metric("CTL el día de la carrera", f"{plan['final_ctl']:.1f}", f"{plan['final_ctl'] - target_ctl:.1f} vs. objetivo")
+        p2.metric("TSB el día de la carrera", f"{plan['final_tsb']:.1f}", f"{plan['final_tsb'] - target_tsb:.1f} vs. objetivo")
+        weekly_view = plan['weekly'].copy()
+        weekly_view.index = [f"S{w % 100} ({row['Inicio'].strftime('%d-%m')})" for w, row in weekly_view.iterrows()]
+        st.dataframe(weekly_view.drop(columns=['Inicio']).style.format("{:.1f}"), use_container_width=True)
+        st.line_chart(plan['daily'][['CTL', 'ATL', 'TSB']])
+        st.caption("Los TSS semanales propuestos se usan como objetivo en esta página y como valor por defecto en el Análisis Semanal.")
+
 # --- LÓGICA PARA MOSTRAR EL PLAN ---
 if selected_year and selected_week:
     start_date, end_date = get_week_dates(selected_year, selected_week)
     st.header(f"Plan para la Semana {selected_week} ({start_date.strftime('%d-%m')} al {end_date.strftime('%d-%m')})")
 
+    proposed_tss = st.session_state.get('proposed_weekly_tss', {}).get((int(selected_year), int(selected_week)))
+
     events = fetch_planned_events(start_date, end_date)
     if events:
         workouts = [evt for evt in events if evt.get("category") == "WORKOUT"]
         if workouts:
             workouts.sort(key=lambda x: x.get('start_date_local', ''))
+
+            if proposed_tss is not None:
+                planned_week_tss = sum(w.get('icu_training_load', 0) or 0 for w in workouts)
+                st.metric("TSS Semanal Planificado", f"{planned_week_tss:.0f}", f"{planned_week_tss - proposed_tss:.0f} vs. objetivo propuesto ({proposed_tss:.0f})")
             
             for workout in workouts:
                 fecha_obj = datetime.fromisoformat(workout.get('start_date_local'))
@@ -81,11 +142,17 @@ if selected_year and selected_week:
                 
                 activity_name = workout.get('name', 'Entrenamiento sin nombre')
                 description = workout.get("description", "")
-                
-                duration_sec = workout.get('moving_time', 0)
-                tss = workout.get('icu_training_load', 0)
-                intensity_if = workout.get('icu_intensity', 0)
-                np_planned = workout.get('_power', {}).get('value', 0)
+                if description and description.strip().lower() == 'none':
+                    description = ""
+
+                # Estimación local a partir de la estructura (sin expansión `resolve` en el servidor)
+                ftp = workout.get('icu_ftp') or FTP
+                estimate = estimate_workout(description, ftp)
+
+                duration_sec = workout.get('moving_time') or estimate['duration']
+                tss = workout.get('icu_training_load') or estimate['tss'] or 0
+                intensity_if = workout.get('icu_intensity') or (estimate['if'] or 0) * 100
+                np_planned = estimate['np'] or 0
                 
                 expander_title = f"**{activity_date} - {activity_name}**"
                 expander_metrics = []
@@ -108,8 +175,20 @@ if selected_year and selected_week:
                     
                     st.markdown("---")
                     st.markdown("##### Estructura del Entrenamiento:")
-                    st.text(description if description and description.strip().lower() != 'none' else "Sin estructura detallada.")
+                    if estimate['steps'].size:
+                        s1, s2 = st.columns([2, 1])
+                        steps_df = pd.DataFrame(steps_to_rows(estimate['steps'], ftp))
+                        steps_df.insert(0, 'Duración', steps_df.pop('Duración (s)').map(lambda secs: format_duration(int(secs))))
+                        s1.dataframe(steps_df, use_container_width=True, hide_index=True)
+                        zones_df = pd.DataFrame({'Minutos': estimate['zone_times'] / 60, 'Zona': [f"Z{i+1}" for i in range(7)]}).set_index('Zona')
+                        s2.bar_chart(zones_df['Minutos'])
+                        st.caption("Descripción original:")
+                        st.text(description)
+                    else:
+                        st.text(description or "Sin estructura detallada.")
         else:
             st.info("✅ No hay entrenamientos estructurados planificados para esta semana.")
     else:
-        st.info("ℹ️ No se encontraron eventos planificados para la semana seleccionada.")
\ No newline at end of file
+        st.info("ℹ️ No se encontraron eventos planificados para la semana seleccionada.")
+
+finish_page(rerun, year=selected_year, week=selected_week)
\ No newline at end of file
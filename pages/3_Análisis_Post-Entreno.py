@@ -2,6 +2,19 @@ import streamlit as st
 import requests
 from datetime import datetime, timedelta
 import pandas as pd
+from concurrent_fetch import fetch_all, unwrap
+from data_cache import bounded_cache
+from instrumentation import http_get, timed
+from perf_panel import start_page, finish_page
+import charts
+import decoupling
+import local_store
+import similar_sessions
+import stream_archive
+import zone_times
+from intervals_client import STREAM_TYPES
+
+rerun = start_page("Análisis Post-Entreno")
 
 # --- CONFIGURACIÓN ---
 try:
@@ -20,43 +33,122 @@ def format_duration(seconds):
         return f"{int(h)}h {int(m)}m"
     return f"{int(m)}m {int(s)}s"
 
+@bounded_cache(ttl=3600)
+def fetch_planned_workout(date_str):
+    """Entrenamiento planificado del día (compartido entre sesiones; los errores de red no se cachean)."""
+    events_url = f"https://intervals.icu/api/v1/athlete/{ATHLETE_ID}/events"
+    events_response = http_get(events_url, auth=('API_KEY', API_KEY), params={'oldest': date_str, 'newest': date_str})
+    events_response.raise_for_status()
+    for event in events_response.json() or []:
+        if event.get("category") == "WORKOUT":
+            return {
+                "duration": event.get('moving_time', 0),
+                "tss": event.get('icu_training_load', 0),
+                "if": event.get('icu_intensity', 0) / 100 if event.get('icu_intensity') else 0
+            }
+    return {}
+
+@bounded_cache(ttl=3600)
+def fetch_actual_ride(date_str):
+    """Primera salida en bici del día con todos sus datos (para el análisis de intervalos)."""
+    activities_url = f"https://intervals.icu/api/v1/athlete/{ATHLETE_ID}/activities?oldest={date_str}&newest={date_str}"
+    activities_response = http_get(activities_url, auth=('API_KEY', API_KEY))
+    activities_response.raise_for_status()
+    for activity in activities_response.json() or []:
+        if activity.get('type') in ['Ride', 'VirtualRide']:
+            return activity
+    return {}
+
 def fetch_data_for_day(selected_date):
+    """Plan y salida real del día, pedidos a la vez; si una de las dos peticiones falla, esa parte queda vacía."""
     date_str = selected_date.strftime('%Y-%m-%d')
-    results = {"planned": {}, "actual": {}}
-    auth_tuple = ('API_KEY', API_KEY)
+    fetched = fetch_all({"planned": (fetch_planned_workout, date_str), "actual": (fetch_actual_ride, date_str)})
+    results = {}
+    for name, value in fetched.items():
+        try:
+            results[name] = unwrap(value)
+        except requests.exceptions.RequestException:
+            results[name] = {}
+    return results
 
-    # --- 1. OBTENER DATOS DEL PLAN ---
+@bounded_cache(ttl=3600)
+def get_stream_archive(activity_id):
+    """Archivo comprimido de streams de la actividad: del almacén local o, si no está, de la API (y se guarda)."""
+    conn = local_store.connect(ATHLETE_ID)
     try:
-        events_url = f"https://intervals.icu/api/v1/athlete/{ATHLETE_ID}/events"
-        params = {'oldest': date_str, 'newest': date_str}
-        events_response = requests.get(events_url, auth=auth_tuple, params=params)
-        if events_response.status_code == 200 and events_response.json():
-            for event in events_response.json():
-                if event.get("category") == "WORKOUT":
-                    results["planned"] = {
-                        "duration": event.get('moving_time', 0),
-                        "tss": event.get('icu_training_load', 0),
-                        "if": event.get('icu_intensity', 0) / 100 if event.get('icu_intensity') else 0
-                    }
-                    break
-    except requests.exceptions.RequestException:
-        pass
+        blob = local_store.get_stream_blob(conn, activity_id)
+        if blob is None:
+            url = f"https://intervals.icu/api/v1/activity/{activity_id}/streams"
+            response = http_get(url, auth=('API_KEY', API_KEY), params={'types': STREAM_TYPES})
+            response.raise_for_status()
+            streams = {s['type']: s.get('data') or [] for s in response.json() or [] if s.get('type')}
+            with conn:
+                local_store.put_streams(conn, [(activity_id, streams)])
+            blob = local_store.get_stream_blob(conn, activity_id)
+        return blob
+    finally:
+        conn.close()
+
+@bounded_cache(ttl=3600)
+def get_zone_times(activity_id, zone_set):
+    """Tiempo en zonas de potencia y FC recalculado desde los streams con un juego de zonas (parte de la clave de caché)."""
+    blob = get_stream_archive(activity_id)
+    if not blob:
+        return None, None
+    power, hr = zone_times.compute_batch([stream_archive.decode_streams(blob, ['watts', 'heartrate'])], [zone_set])
+    return power[0], hr[0]
 
-    # --- 2. OBTENER DATOS REALES ---
+def zone_set_for(day):
+    """Juego de zonas vigente en `day` según el historial del atleta (None si no hay historial)."""
+    conn = local_store.connect(ATHLETE_ID)
     try:
-        activities_url = f"https://intervals.icu/api/v1/athlete/{ATHLETE_ID}/activities?oldest={date_str}&newest={date_str}"
-        activities_response = requests.get(activities_url, auth=auth_tuple)
-        if activities_response.status_code == 200 and activities_response.json():
-            for activity in activities_response.json():
-                if activity.get('type') in ['Ride', 'VirtualRide']:
-                    results["actual"] = activity # Guardamos toda la actividad para el análisis de intervalos
-                    break
+        history = zone_times.load_history(ATHLETE_ID, conn)
+    finally:
+        conn.close()
+    index = zone_times.effective_sets(history, [day])[0]
+    return history[index] if index >= 0 else None
+
+@bounded_cache(ttl=3600)
+def get_local_decoupling(activity_id):
+    """Pa:HR calculado en local desde los streams de la actividad (None si no tiene streams)."""
+    if not get_stream_archive(activity_id):
+        return None
+    conn = local_store.connect(ATHLETE_ID)
+    try:
+        return decoupling.activity_value(conn, activity_id)
+    finally:
+        conn.close()
+
+def ride_decoupling(activity):
+    """Pa:HR de la salida calculado en local; el de Intervals.icu solo si no hay streams."""
+    try:
+        value = get_local_decoupling(activity['id']) if activity.get('id') else None
     except requests.exceptions.RequestException:
-        pass
+        value = None
+    if value is None:
+        return activity.get('decoupling')
+    return value if pd.notna(value) else None
 
-    return results
+@timed()
+def find_similar_sessions(activity, k=5):
+    """Las `k` salidas anteriores más parecidas del historial local, el número de salidas indexadas y el
+    Pa:HR con que se han comparado (el local del índice o, si no lo hay, el de Intervals.icu) por actividad."""
+    conn = local_store.connect(ATHLETE_ID)
+    try:
+        index = similar_sessions.index_for_store(conn)
+    finally:
+        conn.close()
+    before = (activity.get('start_date_local') or '')[:10] or None
+    similar = similar_sessions.most_similar(index, activity, k, before)
+    compared = {str(a.get('id')): index["decoupling"].get(str(a.get('id')), a.get('decoupling')) for a in [activity] + [a for a, _ in similar]}
+    return similar, len(index["ids"]), compared
+
+def efficiency(activity):
+    power, hr = activity.get('icu_weighted_avg_watts'), activity.get('average_heartrate')
+    return power / hr if power and hr else None
 
 # --- NUEVA FUNCIÓN PARA ANALIZAR INTERVALOS ---
+@timed()
 def analyze_intervals(activity_data):
     intervals = activity_data.get("intervals", [])
     if not intervals:
@@ -70,14 +162,15 @@ def analyze_intervals(activity_data):
         watts = interval.get('avg_watts')
         hr = interval.get('avg_hr')
         
+        # Los valores se dejan numéricos: el formato y los degradados se aplican al mostrar la tabla
         processed_intervals.append({
             "Serie": i,
             "Duración": format_duration(interval.get('duration', 0)),
-            "Potencia (W)": f"{watts:.0f}" if watts is not None else "N/A",
-            "FC Media": f"{hr:.0f}" if hr is not None else "N/A",
-            "FC Máx": f"{interval.get('max_hr', 0):.0f}",
-            "Cadencia": f"{interval.get('avg_cadence', 0):.0f}",
-            "Eficiencia (W/lpm)": f"{(watts / hr):.2f}" if watts is not None and hr is not None and hr > 0 else "N/A"
+            "Potencia (W)": watts,
+            "FC Media": hr,
+            "FC Máx": interval.get('max_hr', 0),
+            "Cadencia": interval.get('avg_cadence', 0),
+            "Eficiencia (W/lpm)": (watts / hr) if watts is not None and hr is not None and hr > 0 else None
         })
         
     return pd.DataFrame(processed_intervals)
@@ -119,7 +212,8 @@ if selected_date:
         with col3:
             st.metric("IF", f"{(actual.get('icu_intensity', 0) / 100 if actual.get('icu_intensity') else 0):.2f}", f"{if_delta:.2f} vs. Plan" if planned_if > 0 else None)
         with col4:
-            st.metric("Desacoplamiento", f"{actual.get('decoupling', 0):.1f}%")
+            ride_dec = ride_decoupling(actual)
+            st.metric("Desacoplamiento", f"{ride_dec:.1f}%" if ride_dec is not None else "N/A")
 
         st.markdown("---")
         
@@ -134,7 +228,8 @@ if selected_date:
                     .background_gradient(cmap='viridis', subset=['Potencia (W)'])
                     .background_gradient(cmap='Reds', subset=['FC Media', 'FC Máx'])
                     .highlight_max(subset=['Eficiencia (W/lpm)'], color='#5cb85c')
-                    .format("{:.2f}", subset=['Eficiencia (W/lpm)'])
+                    .format("{:.0f}", subset=['Potencia (W)', 'FC Media', 'FC Máx', 'Cadencia'], na_rep="N/A")
+                    .format("{:.2f}", subset=['Eficiencia (W/lpm)'], na_rep="N/A")
                     .set_properties(**{'text-align': 'center'}),
                 use_container_width=True
             )
@@ -144,13 +239,43 @@ if selected_date:
 
         st.markdown("---")
 
-        # --- SECCIÓN 3: Tiempo en Zonas (sin cambios) ---
+        # --- SECCIÓN: Potencia y FC segundo a segundo ---
+        st.subheader("📉 Potencia y Frecuencia Cardíaca Segundo a Segundo")
+        try:
+            blob = get_stream_archive(actual.get('id')) if actual.get('id') else None
+        except requests.exceptions.RequestException:
+            blob = None
+        if blob:
+            total_min = max(int(stream_archive.duration(blob) // 60) + 1, 1)
+            window = st.slider("Ventana a analizar (minutos)", 0, total_min, (0, total_min))
+            window_data = stream_archive.decode_slice(blob, window[0] * 60, window[1] * 60, ['time', 'watts', 'heartrate'])
+            if window_data.get('time') is not None and len(window_data['time']):
+                df_stream = pd.DataFrame({k: v for k, v in window_data.items() if k != 'time'}, index=window_data['time'] / 60)
+                df_stream.index.name = 'Minuto'
+                # Mínimo y máximo por tramo: la ventana se reduce a un número fijo de puntos sin perder los picos
+                charts.line_chart(df_stream.rename(columns={'watts': 'Potencia (W)', 'heartrate': 'FC (lpm)'}), method='minmax')
+            else:
+                st.caption("No hay muestras en la ventana seleccionada.")
+        else:
+            st.info("No hay datos segundo a segundo disponibles para esta actividad.")
+
+        st.markdown("---")
+
+        # --- SECCIÓN 3: Tiempo en Zonas ---
         st.subheader("📊 Tiempo en Zonas")
-        # ... (código de zonas sin cambios) ...
+        # Con streams se recalcula con las zonas vigentes ese día; si no, se usan las que guardó Intervals.icu al subirla
+        zone_set = zone_set_for((actual.get('start_date_local') or selected_date.strftime('%Y-%m-%d'))[:10])
+        power_secs = hr_secs = None
+        if blob and zone_set:
+            power_secs, hr_secs = get_zone_times(actual.get('id'), zone_set)
         col_pow, col_hr = st.columns(2)
         with col_pow:
             st.write("**Zonas de Potencia**")
-            power_zones = actual.get("icu_zone_times", [])
+            if power_secs is not None and not pd.isna(power_secs).any():
+                st.caption(f"Recalculadas con FTP {zone_set['ftp']:.0f} W (vigente desde el {zone_set['from']}).")
+                power_zones = [{'secs': int(secs)} for secs in power_secs]
+            else:
+                power_zones = actual.get("icu_zone_times", [])
             total_time = actual.get("moving_time", 1)
             for i, zone_data in enumerate(power_zones[:7]):
                 zone_time = zone_data.get('secs', 0)
@@ -159,10 +284,55 @@ if selected_date:
                     st.progress(zone_time / total_time)
         with col_hr:
             st.write("**Zonas de Frecuencia Cardíaca**")
-            hr_zones = actual.get("icu_hr_zone_times", [])
+            if hr_secs is not None and not pd.isna(hr_secs).any():
+                st.caption(f"Recalculadas con las zonas de FC vigentes desde el {zone_set['from']}.")
+                hr_zones = [int(secs) for secs in hr_secs]
+            else:
+                hr_zones = actual.get("icu_hr_zone_times", [])
             if hr_zones and sum(hr_zones) > 0:
                 total_time_hr = sum(hr_zones)
                 for i, zone_time in enumerate(hr_zones):
                     if zone_time > 0:
                         st.text(f"Z{i+1}: {format_duration(zone_time)}")
-                        st.progress(zone_time / total_time_hr)
\ No newline at end of file
+                        st.progress(zone_time / total_time_hr)
+
+        st.markdown("---")
+
+        # --- SECCIÓN 4: Sesiones similares del historial ---
+        st.subheader("🧭 Sesiones Similares del Historial")
+        similar, n_indexed, compared_dec = find_similar_sessions(actual)
+        if not similar:
+            st.info("No hay salidas anteriores en el historial local. Cárgalo con `python backfill.py --start AAAA-MM-DD`.")
+        else:
+            st.caption(f"Las {len(similar)} salidas anteriores más parecidas entre {n_indexed} del historial "
+                       "(duración, carga, IF, zonas, estructura de series, eficiencia y desacoplamiento).")
+            rows = [{
+                "Fecha": (a.get('start_date_local') or '')[:10],
+                "Actividad": a.get('name', 'Sin Nombre'),
+                "Distancia": distance,
+                "Duración": format_duration(a.get('moving_time', 0)),
+                "TSS": a.get('icu_training_load'),
+                "IF": a.get('icu_intensity') / 100 if a.get('icu_intensity') else None,
+                "NP (W)": a.get('icu_weighted_avg_watts'),
+                "FC Media": a.get('average_heartrate'),
+                "NP/FC": efficiency(a),
+                "Desacoplamiento (%)": compared_dec.get(str(a.get('id'))),
+            } for a, distance in similar]
+            df_similar = pd.DataFrame(rows)
+            st.dataframe(
+                df_similar.style.format({"Distancia": "{:.2f}", "TSS": "{:.0f}", "IF": "{:.2f}", "NP (W)": "{:.0f}",
+                                         "FC Media": "{:.0f}", "NP/FC": "{:.2f}", "Desacoplamiento (%)": "{:.1f}"}, na_rep="N/A"),
+                use_container_width=True, hide_index=True
+            )
+
+            col1, col2 = st.columns(2)
+            today_ef, past_ef = efficiency(actual), pd.to_numeric(df_similar["NP/FC"], errors='coerce').mean()
+            today_dec, past_dec = compared_dec.get(str(actual.get('id'))), pd.to_numeric(df_similar["Desacoplamiento (%)"], errors='coerce').mean()
+            with col1:
+                if today_ef and pd.notna(past_ef):
+                    st.metric("Eficiencia NP/FC", f"{today_ef:.2f}", f"{(today_ef / past_ef - 1) * 100:+.1f}% vs. similares")
+            with col2:
+                if today_dec is not None and pd.notna(past_dec):
+                    st.metric("Desacoplamiento", f"{today_dec:.1f}%", f"{today_dec - past_dec:+.1f} pts vs. similares", delta_color="inverse")
+
+finish_page(rerun, selected_date=selected_date)
\ No newline at end of file
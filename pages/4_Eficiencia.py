@@ -3,6 +3,14 @@ import requests
 from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
+import analytics
+import decoupling
+import local_store
+import power_model
+from instrumentation import http_get, timed
+from perf_panel import start_page, finish_page
+
+rerun = start_page("Eficiencia")
 
 # --- CONFIGURACIÓN ---
 try:
@@ -17,7 +25,7 @@ def fetch_activities(start_date, end_date):
     """Obtiene todas las actividades en un rango de fechas."""
     url = f"https://intervals.icu/api/v1/athlete/{ATHLETE_ID}/activities?oldest={start_date}&newest={end_date}"
     try:
-        response = requests.get(url, auth=('API_KEY', API_KEY))
+        response = http_get(url, auth=('API_KEY', API_KEY))
         if response.status_code == 200:
             return response.json() or []
         st.error(f"Error al contactar con la API: {response.status_code}")
@@ -26,34 +34,24 @@ def fetch_activities(start_date, end_date):
         st.error(f"Error de conexión: {e}")
         return []
 
-def process_activities_to_df(activities_raw):
-    """Procesa una lista de actividades y devuelve un DataFrame de pandas."""
-    processed_list = []
-    for activity in activities_raw:
-        if activity.get('type') not in ['Ride', 'VirtualRide']:
-            continue
-
-        power_norm = activity.get("icu_weighted_avg_watts")
-        hr_avg = activity.get("average_heartrate")
-        power_avg = activity.get("icu_average_watts")
+@timed()
+def load_cp_history(window_days, model, end_date):
+    """Tendencia de CP/W′ desde el almacén local y la curva de la ventana que termina en `end_date`."""
+    conn = local_store.connect(ATHLETE_ID)
+    try:
+        history = power_model.cp_history(conn, window_days, model)
+        return history, power_model.window_curve(conn, end_date, window_days)
+    finally:
+        conn.close()
 
-        efficiency = round(power_norm / hr_avg, 2) if hr_avg and power_norm and hr_avg > 0 and power_norm > 0 else 0
-        power_hr = round(power_avg / hr_avg, 2) if hr_avg and power_avg and hr_avg > 0 and power_avg > 0 else 0
-        
-        processed_list.append({
-            "date": pd.to_datetime(activity.get("start_date_local")), # <-- Mantenemos como objeto de fecha
-            "Actividad": activity.get("name", "N/A"),
-            "Eficiencia (NP/FC)": efficiency,
-            "Potencia/FC": power_hr,
-            "Eficiencia Z2 (Pot/FC)": activity.get("icu_power_hr_z2", 0),
-        })
-    
-    if not processed_list:
-        return pd.DataFrame()
-        
-    df = pd.DataFrame(processed_list).set_index('date')
-    df.sort_index(inplace=True) # <-- ¡CORRECCIÓN CLAVE! Ordenamos el índice cronológicamente
-    return df
+@timed()
+def load_decoupling(start, end, params):
+    """Pa:HR de las salidas de resistencia del rango, calculado en local desde los streams guardados."""
+    conn = local_store.connect(ATHLETE_ID)
+    try:
+        return decoupling.history(conn, start, end, params)
+    finally:
+        conn.close()
 
 # --- INTERFAZ DE USUARIO ---
 st.set_page_config(layout="wide")
@@ -69,7 +67,7 @@ if selected_date:
     if not activities_raw:
         st.warning("No se encontraron actividades en el periodo de 60 días para calcular tendencias.")
     else:
-        df_efficiency = process_activities_to_df(activities_raw)
+        df_efficiency = analytics.efficiency_frame(activities_raw)
         
         st.markdown("---")
         st.subheader(f"Métricas para el día {selected_date.strftime('%d-%m-%Y')}")
@@ -98,11 +96,9 @@ if selected_date:
         st.subheader("📊 Promedios Móviles Desplegables")
         st.caption("Haz clic en cada periodo para ver las actividades que se han usado para calcular la media.")
 
-        for period in [7, 30, 60]:
+        averages = analytics.efficiency_averages(df_efficiency, selected_date)
+        for period, period_avg in averages.items():
             period_df = df_efficiency[df_efficiency.index.date <= selected_date].tail(period)
-            
-            numeric_cols = period_df.select_dtypes(include=np.number)
-            period_avg = numeric_cols.replace(0, np.nan).mean()
 
             title = (
                 f"Últimos {period} días  |  "
@@ -115,4 +111,86 @@ if selected_date:
                 display_period_df = period_df[(period_df.select_dtypes(include=np.number) > 0).any(axis=1)].copy()
                 # Formateamos el índice a un formato de texto legible antes de mostrarlo
                 display_period_df.index = display_period_df.index.strftime('%d-%m-%Y')
-                st.dataframe(display_period_df, use_container_width=True)
\ No newline at end of file
+                st.dataframe(display_period_df, use_container_width=True)
+
+    st.markdown("---")
+    st.subheader("💪 Potencia Crítica (CP) y W′")
+    st.caption("Ajuste con tus mejores esfuerzos de cada ventana móvil (de 5 s a 30 min), a partir de los streams guardados en local.")
+    col1, col2 = st.columns(2)
+    with col1:
+        window_days = st.selectbox("Ventana", [42, 90, 180, 365], index=1, format_func=lambda d: f"{d} días")
+    with col2:
+        model = st.radio("Modelo", power_model.MODELS, horizontal=True,
+                         format_func={'2p': "2 parámetros (CP, W′)", '3p': "3 parámetros (CP, W′, Pmax)"}.get)
+
+    week_end = pd.Timestamp(selected_date + timedelta(days=6 - selected_date.weekday()))
+    cp_df, curve = load_cp_history(window_days, model, week_end)
+    if cp_df['cp'].notna().sum() == 0:
+        st.info("ℹ️ No hay streams de potencia en el almacén local. Descárgalos con `python backfill.py --start AAAA-MM-DD --streams`.")
+    else:
+        fitted = cp_df.loc[:week_end].dropna(subset=['cp'])
+        if fitted.empty:
+            st.info("ℹ️ No hay ajuste para ventanas anteriores a la fecha seleccionada.")
+        else:
+            fit = fitted.iloc[-1]
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric(f"CP ({window_days} días)", f"{fit['cp']:.0f} W", f"{fit['cp'] - fitted['cp'].iloc[-5]:+.0f} W vs. 4 semanas" if len(fitted) > 4 else None)
+            with col2:
+                st.metric("W′", f"{fit['w_prime'] / 1000:.1f} kJ")
+            with col3:
+                if model == '3p':
+                    st.metric("Pmax", f"{fit['p_max']:.0f} W")
+                else:
+                    st.metric("Salidas en la ventana", f"{fit['n_rides']:.0f}")
+            st.caption(f"Ventana que termina el {fitted.index[-1]:%d-%m-%Y} · error del ajuste (RMSE): {fit['rmse']:.1f} W")
+
+        trend = cp_df.dropna(subset=['cp'])
+        st.line_chart(trend[['cp']].rename(columns={'cp': 'CP (W)'}))
+        st.line_chart((trend[['w_prime']] / 1000).rename(columns={'w_prime': "W′ (kJ)"}))
+
+        if not fitted.empty and not curve.empty:
+            curve_df = pd.DataFrame({'Mejores marcas (W)': curve,
+                                     'Modelo (W)': power_model.model_power(fit.to_dict(), curve.index)}, index=curve.index)
+            curve_df.index.name = 'Duración (s)'
+            with st.expander("📈 Curva de potencia de la ventana frente al modelo"):
+                st.line_chart(curve_df)
+
+    st.markdown("---")
+    st.subheader("🫀 Desacoplamiento Aeróbico (Pa:HR)")
+    st.caption("Pérdida de eficiencia (potencia/FC) entre la primera y la segunda mitad de cada salida de resistencia, "
+               "calculada con los streams guardados en local. Por debajo del 5 % indica buena resistencia aeróbica.")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        years = st.selectbox("Periodo", [1, 2, 3, 5], index=1, format_func=lambda y: f"Últimos {y} años" if y > 1 else "Último año")
+    with col2:
+        warmup_min = st.slider("Calentamiento descartado (min)", 0, 30, decoupling.DEFAULTS["warmup_secs"] // 60)
+    with col3:
+        tolerance = st.slider("Filtro de estabilidad (± % potencia)", 10, 100, int(decoupling.DEFAULTS["steady_tolerance"] * 100), step=5)
+    with col4:
+        max_if = st.slider("IF máximo", 0.5, 1.0, decoupling.DEFAULTS["max_intensity"], step=0.05)
+
+    params = {"warmup_secs": warmup_min * 60, "steady_tolerance": tolerance / 100, "max_intensity": max_if}
+    dec_df = load_decoupling(selected_date - timedelta(days=365 * years), selected_date, params)
+    if dec_df.empty:
+        st.info("ℹ️ No hay salidas de resistencia con streams en el periodo. Descárgalos con `python backfill.py --start AAAA-MM-DD --streams`.")
+    else:
+        recent = dec_df.loc[dec_df.index > pd.Timestamp(selected_date) - pd.Timedelta(days=42), 'pa_hr']
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Mediana últimas 6 semanas", f"{recent.median():.1f}%", f"{recent.median() - dec_df['pa_hr'].median():+.1f} vs. periodo", delta_color="inverse")
+        with col2:
+            st.metric("Salidas analizadas", f"{len(dec_df)}", f"{(dec_df['pa_hr'] < 5).mean() * 100:.0f}% por debajo del 5%", delta_color="off")
+        trend = pd.DataFrame({
+            'Pa:HR por salida (%)': dec_df['pa_hr'],
+            'Mediana móvil 6 semanas (%)': dec_df['pa_hr'].rolling('42D').median(),
+        })
+        st.line_chart(trend)
+        with st.expander("📋 Detalle por salida"):
+            table = dec_df.rename(columns={'name': 'Actividad', 'pa_hr': 'Pa:HR (%)', 'ef_first': 'EF 1ª mitad',
+                                           'ef_second': 'EF 2ª mitad', 'kept_share': 'Muestras estables'}).drop(columns='activity_id')
+            table.index = table.index.strftime('%d-%m-%Y')
+            st.dataframe(table.iloc[::-1].style.format({'Pa:HR (%)': "{:.1f}", 'EF 1ª mitad': "{:.2f}", 'EF 2ª mitad': "{:.2f}",
+                                                        'Muestras estables': "{:.0%}"}), use_container_width=True)
+
+finish_page(rerun, selected_date=selected_date)
\ No newline at end of file
@@ -5,6 +5,14 @@ import pandas as pd
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
+import backfill
+import charts
+import decomposition
+import local_store
+from instrumentation import timed
+from perf_panel import start_page, finish_page
+
+rerun = start_page("Correlaciones")
 
 # --- CONFIGURACIÓN ---
 try:
@@ -15,64 +23,43 @@ except FileNotFoundError:
     st.stop()
 
 # --- FUNCIONES ---
-@st.cache_data(ttl=3600)
-def fetch_data_in_range(start_date, end_date):
-    """Obtiene actividades y bienestar en un rango de fechas."""
-    date_format = "%Y-%m-%d"
-    s, e = start_date.strftime(date_format), end_date.strftime(date_format)
-    
-    wellness_url = f"https://intervals.icu/api/v1/athlete/{ATHLETE_ID}/wellness?oldest={s}&newest={e}"
-    wellness_response = requests.get(wellness_url, auth=('API_KEY', API_KEY))
-    wellness_data = wellness_response.json() if wellness_response.status_code == 200 else []
-    
-    activities_url = f"https://intervals.icu/api/v1/athlete/{ATHLETE_ID}/activities?oldest={s}&newest={e}"
-    activities_response = requests.get(activities_url, auth=('API_KEY', API_KEY))
-    activities_data = activities_response.json() if activities_response.status_code == 200 else []
-
-    return wellness_data, activities_data
-
+def load_weekly_rollups(start_date, end_date):
+    """Resúmenes por semana ISO del almacén local, sincronizando antes las semanas que falten o sean recientes."""
+    try:
+        return backfill.weekly_rollups(ATHLETE_ID, API_KEY, start_date, end_date)
+    except requests.exceptions.RequestException as e:
+        st.warning(f"No se pudo sincronizar con Intervals.icu ({e}). Se muestran los datos guardados.")
+        return backfill.weekly_rollups(ATHLETE_ID, API_KEY, start_date, end_date, sync=False)
+
+@timed()
 def process_weekly_data(end_date, num_weeks=12):
-    """Procesa los datos para devolver un DataFrame con métricas semanales."""
-    start_date = end_date - timedelta(days=num_weeks*7 - 1)
-    wellness, activities = fetch_data_in_range(start_date, end_date)
+    """Procesa los datos para devolver un DataFrame con métricas semanales (semanas ISO, de lunes a domingo)."""
+    start_date = end_date - timedelta(days=end_date.weekday() + (num_weeks - 1) * 7)
+    weekly = load_weekly_rollups(start_date, end_date)
+    weekly = weekly[weekly['wellness_days'] > 0]
 
-    if not wellness:
+    if weekly.empty:
         return pd.DataFrame()
 
-    df_wellness = pd.DataFrame(wellness)
-    df_wellness['date'] = pd.to_datetime(df_wellness['id'])
-    
-    df_activities = pd.DataFrame(activities)
-    if not df_activities.empty:
-        df_activities['date'] = pd.to_datetime(df_activities['start_date_local'])
-    else:
-        df_activities = pd.DataFrame(columns=['date', 'icu_training_load'])
-
-    weekly_summary = []
-    for i in range(num_weeks):
-        week_end = end_date - timedelta(days=i*7)
-        week_start = week_end - timedelta(days=6)
-        
-        week_wellness = df_wellness[(df_wellness['date'] >= pd.to_datetime(week_start)) & (df_wellness['date'] <= pd.to_datetime(week_end))]
-        week_activities_data = df_activities[(df_activities['date'] >= pd.to_datetime(week_start)) & (df_activities['date'] <= pd.to_datetime(week_end))]
-        
-        if week_wellness.empty:
-            continue
-
-        total_tss = week_activities_data['icu_training_load'].sum()
-        metrics = {
-            'Semana': f"{week_start.strftime('%d/%m')}-{week_end.strftime('%d/%m')}",
-            'TSS Semanal': total_tss,
-            'ATL': week_wellness['atl'].mean(),
-            'CTL': week_wellness['ctl'].mean(),
-            'RHR': week_wellness['restingHR'].mean(),
-            'HRV': week_wellness['hrv'].mean(),
-            'P. Sueño': week_wellness['sleepScore'].mean()
-        }
-        weekly_summary.append(metrics)
-    
-    df = pd.DataFrame(weekly_summary).dropna(subset=['RHR', 'HRV', 'ATL', 'CTL']).set_index('Semana')
-    return df.iloc[::-1]
+    df = pd.DataFrame({
+        'Semana': weekly['period_start'].dt.strftime('%d/%m') + '-' + weekly['period_end'].dt.strftime('%d/%m'),
+        'TSS Semanal': weekly['tss'],
+        'ATL': weekly['atl'],
+        'CTL': weekly['ctl'],
+        'RHR': weekly['rhr'],
+        'HRV': weekly['hrv'],
+        'P. Sueño': weekly['sleep_score'],
+    }).astype({c: float for c in ['TSS Semanal', 'ATL', 'CTL', 'RHR', 'HRV', 'P. Sueño']})
+    return df.dropna(subset=['RHR', 'HRV', 'ATL', 'CTL']).set_index('Semana')
+
+@timed()
+def load_decomposition(signal, end_date):
+    """Componentes diarios de una métrica hasta `end_date`, desde la descomposición guardada en el almacén."""
+    conn = local_store.connect(ATHLETE_ID)
+    try:
+        return decomposition.components(conn, signal, end=end_date), decomposition.profiles(conn, signal)
+    finally:
+        conn.close()
 
 # --- INTERFAZ DE USUARIO ---
 st.set_page_config(layout="wide")
@@ -214,4 +201,42 @@ if end_date:
             
         st.markdown("---")
         st.header("📋 Resumen de las Últimas 12 Semanas")
-        st.dataframe(df_weekly.style.format("{:.1f}"), use_container_width=True)
\ No newline at end of file
+        st.dataframe(df_weekly.style.format("{:.1f}"), use_container_width=True)
+
+    # --- TENDENCIA A LARGO PLAZO ---
+    st.markdown("---")
+    st.header("📉 Tendencia a Largo Plazo")
+    st.caption("Todo el historial local separado en tendencia, patrón semanal, estacionalidad anual y residuo. "
+               "El residuo es lo que no explican la época del año ni el día de la semana: tu respuesta al entrenamiento.")
+    signal = st.selectbox("Métrica", list(decomposition.SIGNALS), format_func=decomposition.SIGNALS.get)
+    components, profiles = load_decomposition(signal, end_date)
+    if components.empty:
+        st.info("No hay historial local de esta métrica. Cárgalo con `python backfill.py --start AAAA-MM-DD`.")
+    else:
+        last = components.iloc[-1]
+        year_ago = components['trend'].asof(components.index[-1] - pd.Timedelta(days=365))
+        weekly_profile = pd.Series(profiles[0], index=['Lun', 'Mar', 'Mié', 'Jue', 'Vie', 'Sáb', 'Dom']) if profiles else pd.Series(dtype='float64')
+        k1, k2, k3, k4 = st.columns(4)
+        k1.metric("Tendencia actual", f"{last['trend']:.2f}", f"{last['trend'] - year_ago:+.2f} vs. hace un año" if pd.notna(year_ago) else None)
+        k2.metric("Efecto estacional hoy", f"{last['seasonal']:+.2f}")
+        k3.metric("Amplitud semanal", f"{weekly_profile.max() - weekly_profile.min():.2f}" if not weekly_profile.empty else "N/A")
+        k4.metric("Residuo medio (7 días)", f"{components['residual'].tail(7).mean():+.2f}")
+
+        charts.zoomable_line_chart(pd.DataFrame({
+            'Valor': components['value'],
+            'Tendencia': components['trend'],
+            'Tendencia + estacionalidad': components['trend'] + components['seasonal'],
+        }), key="tendencia")
+        c1, c2 = st.columns(2)
+        with c1:
+            st.write("**Patrón semanal**")
+            if not weekly_profile.empty:
+                st.bar_chart(weekly_profile.rename('Efecto'))
+        with c2:
+            st.write("**Residuo (media de 7 días)**")
+            charts.line_chart(components['residual'].rolling(7, min_periods=1).mean().rename('Residuo'))
+        years = len(components) / decomposition.SEASON_DAYS
+        if years < decomposition.MIN_SEASON_YEARS:
+            st.caption(f"Con {years:.1f} años de historial no se estima la estacionalidad anual (hacen falta {decomposition.MIN_SEASON_YEARS}).")
+
+finish_page(rerun, end_date=end_date)
\ No newline at end of file
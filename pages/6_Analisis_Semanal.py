@@ -3,127 +3,85 @@ import requests
 from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
-from statistics import mean
-import base64
+from plan_optimizer import weeks_back
+import backfill
+import local_store
+import rollups
+import zone_times
+from instrumentation import timed
+from perf_panel import start_page, finish_page
+
+rerun = start_page("Análisis Semanal")
 
 # --- CONFIGURACIÓN DE LA PÁGINA ---
 st.set_page_config(layout="wide", page_title="Análisis Semanal")
 
+# --- CONFIGURACIÓN ---
+try:
+    ATHLETE_ID = st.secrets["ATHLETE_ID"]
+    API_KEY = st.secrets["API_KEY"]
+except FileNotFoundError:
+    st.error("❌ No se ha encontrado el fichero de secretos.")
+    st.stop()
+
 # --- FUNCIONES DE OBTENCIÓN Y PROCESAMIENTO DE DATOS ---
-@st.cache_data(ttl=3600)
-def fetch_data(url, headers):
-    """Función genérica para obtener datos de la API de Intervals.icu."""
+def load_weekly_rollups(start_date, end_date):
+    """Resúmenes por semana ISO del almacén local, sincronizando antes las semanas que falten o sean recientes."""
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return response.json()
+        return backfill.weekly_rollups(ATHLETE_ID, API_KEY, start_date, end_date)
     except requests.exceptions.RequestException as e:
         st.error(f"Error de conexión con la API: {e}")
-        return []
+        return backfill.weekly_rollups(ATHLETE_ID, API_KEY, start_date, end_date, sync=False)
+
+def _value(row, column):
+    """Valor de una columna del resumen, o None si la semana no tiene dato."""
+    if row is None or pd.isna(row[column]):
+        return None
+    return float(row[column])
+
+@timed()
+def load_zone_totals(start_date, end_date):
+    """Tiempo en zonas por semana recalculado desde los streams con el historial de zonas del atleta."""
+    conn = local_store.connect(ATHLETE_ID)
+    try:
+        return zone_times.period_totals(conn, zone_times.load_history(ATHLETE_ID, conn), 'week', start_date, end_date)
+    finally:
+        conn.close()
 
-def process_wellness_data(data, date_obj_for_sunday_check):
-    """Procesa los datos de bienestar de una semana."""
-    if not data: return {}
-    
-    rhr_list = [d.get('restingHR') for d in data if d.get('restingHR') is not None]
-    hrv_list = [d.get('hrv') for d in data if d.get('hrv') is not None]
-    bb_max_list = [d.get('BodyBatteryMax') for d in data if d.get('BodyBatteryMax') is not None]
-    bb_min_list = [d.get('BodyBatteryMin') for d in data if d.get('BodyBatteryMin', 0) > 0]
-    sleep_list = [d.get('sleepScore') for d in data if d.get('sleepScore') is not None]
-    
-    sunday_data = next((d for d in reversed(data) if d.get('id') and datetime.strptime(d['id'], '%Y-%m-%d').date() == date_obj_for_sunday_check), None)
-    
-    sunday_ctl = sunday_data.get('ctl') if sunday_data else None
-    sunday_atl = sunday_data.get('atl') if sunday_data else None
-    sunday_tsb = (sunday_ctl - sunday_atl) if sunday_ctl is not None and sunday_atl is not None else None
-
-    return {
-        'RHR_Avg': mean(rhr_list) if rhr_list else None,
-        'HRV_Avg': mean(hrv_list) if hrv_list else None,
-        'BodyBatteryMax_Avg': mean(bb_max_list) if bb_max_list else None,
-        'BodyBatteryMin_Avg': mean(bb_min_list) if bb_min_list else None,
-        'SleepScore_Avg': mean(sleep_list) if sleep_list else None,
-        'CTL_Sunday': sunday_ctl,
-        'ATL_Sunday': sunday_atl,
-        'TSB_Sunday': sunday_tsb,
-    }
-
-def calculate_training_metrics(activities_data):
-    """Procesa las actividades de una semana para obtener métricas de entrenamiento."""
-    if not activities_data: return {}
-
-    total_tss = 0
-    total_hr_zone_times, total_power_zone_times = [0]*7, [0]*7
-    efficiency_list, power_hr_list, power_hr_z2_list = [], [], []
-
-    for activity in activities_data:
-        tss = activity.get('icu_training_load', 0) or 0
-        if activity.get('type') == 'WeightTraining': tss = 10
-        total_tss += tss
-
-        power_norm = activity.get("icu_weighted_avg_watts")
-        hr_avg = activity.get("average_heartrate")
-        power_avg = activity.get("icu_average_watts")
-        power_hr_z2 = activity.get("icu_power_hr_z2")
-
-        if hr_avg and hr_avg > 0:
-            if power_norm and power_norm > 0: efficiency_list.append(power_norm / hr_avg)
-            if power_avg and power_avg > 0: power_hr_list.append(power_avg / hr_avg)
-        if power_hr_z2 and power_hr_z2 > 0: power_hr_z2_list.append(power_hr_z2)
-
-        hr_zones = activity.get('icu_hr_zone_times')
-        if hr_zones:
-            for i, secs in enumerate(hr_zones):
-                if i < 7: total_hr_zone_times[i] += (secs or 0)
-        
-        power_zones = activity.get('icu_zone_times')
-        if power_zones:
-            for zone_data in power_zones:
-                if 'id' in zone_data and isinstance(zone_data['id'], str) and zone_data['id'].startswith('Z'):
-                    try:
-                        zone_index = int(zone_data['id'][1:]) - 1
-                        if 0 <= zone_index < 7:
-                            total_power_zone_times[zone_index] += (zone_data.get('secs', 0) or 0)
-                    except (ValueError, IndexError):
-                        continue
-
-    return {
-        'TSS_Realizado': total_tss,
-        'HR_Zone_Times': total_hr_zone_times,
-        'Power_Zone_Times': total_power_zone_times,
-        'Eficiencia_Avg': mean(efficiency_list) if efficiency_list else None,
-        'Potencia_FC_Avg': mean(power_hr_list) if power_hr_list else None,
-        'Potencia_FC_Z2_Avg': mean(power_hr_z2_list) if power_hr_z2_list else None
-    }
-
-def get_weekly_analysis(end_date, planned_tss_list):
-    """Función principal que orquesta el análisis de 4 semanas."""
-    api_key = "27i9azt55smmhvg1ogc5gmn7x"
-    athlete_id = "i10474"
-    
-    base_url = "https://intervals.icu/api/v1"
-    headers = {"Authorization": f"Basic {base64.b64encode(f'API_KEY:{api_key}'.encode()).decode()}"}
-    
-    weekly_data = []
+@timed()
+def get_weekly_analysis(end_date, planned_tss_list, recompute_zones=False):
+    """Función principal que orquesta el análisis de las 4 semanas ISO que terminan en la de `end_date`."""
+    last_monday = end_date - timedelta(days=end_date.weekday())
+    weekly = load_weekly_rollups(last_monday - timedelta(weeks=3), end_date)
+    zones = load_zone_totals(last_monday - timedelta(weeks=3), end_date) if recompute_zones else None
 
+    weekly_data = []
     for i in range(4):
-        week_end_obj = end_date - timedelta(days=7 * i)
-        week_start_obj = week_end_obj - timedelta(days=6)
-        week_start_str, week_end_str = week_start_obj.strftime("%Y-%m-%d"), week_end_obj.strftime("%Y-%m-%d")
-
-        wellness_data = fetch_data(f"{base_url}/athlete/{athlete_id}/wellness?oldest={week_start_str}&newest={week_end_str}", headers)
-        activities_data = fetch_data(f"{base_url}/athlete/{athlete_id}/activities?oldest={week_start_str}&newest={week_end_str}", headers)
+        week_start_obj = last_monday - timedelta(weeks=i)
+        week_end_obj = week_start_obj + timedelta(days=6)
+        key = rollups.week_key(week_start_obj)
+        row = weekly.loc[key] if key in weekly.index else None
+        ctl, atl = _value(row, 'ctl_end'), _value(row, 'atl_end')
 
-        wellness_metrics = process_wellness_data(wellness_data, week_end_obj)
-        training_metrics = calculate_training_metrics(activities_data)
-
-        week_summary = {
+        weekly_data.append({
             "Semana": f"{week_start_obj.strftime('%d/%m')} - {week_end_obj.strftime('%d/%m')}",
             "TSS_Programado": planned_tss_list[i],
-            **training_metrics,
-            **wellness_metrics
-        }
-        weekly_data.append(week_summary)
+            'TSS_Realizado': float(row['tss']) if row is not None else 0.0,
+            'HR_Zone_Times': zones.at[key, 'hr_zone_times'] if zones is not None else row['hr_zone_times'] if row is not None else [0] * 7,
+            'Power_Zone_Times': zones.at[key, 'power_zone_times'] if zones is not None else row['power_zone_times'] if row is not None else [0] * 7,
+            'Zonas_Recalculadas': int(zones.at[key, 'recomputed']) if zones is not None else 0,
+            'Eficiencia_Avg': _value(row, 'efficiency'),
+            'Potencia_FC_Avg': _value(row, 'power_hr'),
+            'Potencia_FC_Z2_Avg': _value(row, 'power_hr_z2'),
+            'RHR_Avg': _value(row, 'rhr'),
+            'HRV_Avg': _value(row, 'hrv'),
+            'BodyBatteryMax_Avg': _value(row, 'body_battery_max'),
+            'BodyBatteryMin_Avg': _value(row, 'body_battery_min'),
+            'SleepScore_Avg': _value(row, 'sleep_score'),
+            'CTL_Sunday': ctl,
+            'ATL_Sunday': atl,
+            'TSB_Sunday': (ctl - atl) if ctl is not None and atl is not None else None,
+        })
 
     df = pd.DataFrame(weekly_data).set_index("Semana")
     return df.iloc[::-1]
@@ -141,18 +99,57 @@ with st.form(key='analysis_form'):
     
     with col2:
         st.write("**TSS Programado para cada semana**")
+        # Si el optimizador de la Planificación ha propuesto objetivos, se usan como valor por defecto
+        proposals = st.session_state.get('proposed_weekly_tss', {})
+        week_keys = weeks_back(end_date, 4)[::-1]
+        defaults = [int(round(proposals.get(k, d))) for k, d in zip(week_keys, [330, 350, 385, 195])]
         cols_tss = st.columns(4)
         planned_tss = [
-            cols_tss[0].number_input("Semana -3", value=330, step=5),
-            cols_tss[1].number_input("Semana -2", value=350, step=5),
-            cols_tss[2].number_input("Semana -1", value=385, step=5),
-            cols_tss[3].number_input("Semana Actual", value=195, step=5)
+            cols_tss[0].number_input("Semana -3", value=defaults[0], step=5),
+            cols_tss[1].number_input("Semana -2", value=defaults[1], step=5),
+            cols_tss[2].number_input("Semana -1", value=defaults[2], step=5),
+            cols_tss[3].number_input("Semana Actual", value=defaults[3], step=5)
         ]
 
+    recompute_zones = st.checkbox("Recalcular el tiempo en zonas desde los streams con el historial de zonas", value=True,
+                                  help="Las zonas de Intervals.icu son las que había al subir cada actividad; recalculadas, "
+                                       "todas las semanas usan el FTP y las zonas de FC vigentes en su fecha.")
     submit_button = st.form_submit_button(label='🚀 Generar Análisis')
 
+with st.expander("🎚️ Historial de Zonas (FTP y FC)"):
+    conn = local_store.connect(ATHLETE_ID)
+    try:
+        history = zone_times.load_history(ATHLETE_ID, conn)
+    finally:
+        conn.close()
+    st.caption("Cada fila es un juego de zonas que entra en vigor en su fecha. Límites superiores de Z1 a Z6 separados por comas: "
+               "potencia en % del FTP y FC en lpm. Si no guardas ninguno, se deduce del FTP y las zonas de tus actividades.")
+    edited = st.data_editor(pd.DataFrame({
+        'Desde': [pd.Timestamp(s['from']).date() for s in history],
+        'FTP (W)': [s['ftp'] for s in history],
+        'Zonas potencia (% FTP)': [', '.join(f"{v:g}" for v in s['power_zones']) if s['power_zones'] else '' for s in history],
+        'Zonas FC (lpm)': [', '.join(f"{v:g}" for v in s['hr_zones']) if s['hr_zones'] else '' for s in history],
+    }), num_rows="dynamic", hide_index=True, key="historial_zonas",
+        column_config={'Desde': st.column_config.DateColumn(required=True), 'FTP (W)': st.column_config.NumberColumn(min_value=1)})
+    c1, c2 = st.columns(2)
+    if c1.button("💾 Guardar historial de zonas"):
+        try:
+            zone_times.save_history(ATHLETE_ID, [{
+                'from': str(r['Desde']),
+                'ftp': float(r['FTP (W)']) if pd.notna(r['FTP (W)']) else None,
+                'power_zones': [float(v) for v in str(r['Zonas potencia (% FTP)'] or '').split(',') if v.strip()] or None,
+                'hr_zones': [float(v) for v in str(r['Zonas FC (lpm)'] or '').split(',') if v.strip()] or None,
+            } for r in edited.dropna(subset=['Desde']).to_dict(orient='records')])
+            st.success("Historial guardado: solo se recalcularán las actividades de los juegos que han cambiado.")
+        except ValueError as e:
+            st.error(f"Historial no válido: {e}")
+    if c2.button("↩️ Deducir de las actividades"):
+        zone_times.reset_history(ATHLETE_ID)
+        st.session_state.pop("historial_zonas", None)
+        st.rerun()
+
 if submit_button:
-    df_analysis = get_weekly_analysis(end_date, planned_tss[::-1])
+    df_analysis = get_weekly_analysis(end_date, planned_tss[::-1], recompute_zones)
 
     if not df_analysis.empty:
         st.markdown("---")
@@ -192,6 +189,9 @@ if submit_button:
                     st.metric(label="Sueño Promedio Semanal", value=f"{week_data.get('SleepScore_Avg', 0):.1f}")
 
                 st.subheader("📈 Distribución de Zonas e Insights")
+                if recompute_zones:
+                    st.caption(f"{week_data.get('Zonas_Recalculadas', 0)} actividades con zonas recalculadas desde sus streams; "
+                               "el resto usa las de Intervals.icu.")
                 expander_cols = st.columns(3)
                 with expander_cols[0]:
                     with st.expander("Zonas de Potencia"):
@@ -228,4 +228,6 @@ if submit_button:
             st.dataframe(df_analysis.style.format("{:.1f}", subset=numeric_cols, na_rep="N/A"))
 
     else:
-        st.warning("No se pudieron obtener datos para el periodo seleccionado. Revisa la configuración o el rango de fechas.")
\ No newline at end of file
+        st.warning("No se pudieron obtener datos para el periodo seleccionado. Revisa la configuración o el rango de fechas.")
+
+finish_page(rerun, end_date=end_date)
\ No newline at end of file
@@ -0,0 +1,132 @@
+import streamlit as st
+import requests
+from datetime import datetime, timedelta
+import pandas as pd
+import backfill
+import local_store
+import search_index
+from instrumentation import timed
+from perf_panel import start_page, finish_page
+
+rerun = start_page("Buscador")
+
+# --- CONFIGURACIÓN ---
+try:
+    ATHLETE_ID = st.secrets["ATHLETE_ID"]
+    API_KEY = st.secrets["API_KEY"]
+except FileNotFoundError:
+    st.error("❌ No se ha encontrado el fichero de secretos.")
+    st.stop()
+
+KIND_LABELS = {search_index.KIND_ACTIVITY: "Realizada", search_index.KIND_EVENT: "Planificada"}
+IF_MAX, TSS_MAX, DURATION_MAX_MIN = 1.5, 500, 600
+
+# --- FUNCIONES ---
+def format_duration(seconds):
+    if pd.isna(seconds) or seconds < 0: return "-"
+    h, m = divmod(int(seconds) // 60, 60)
+    return f"{h}h {m}m" if h > 0 else f"{m}m"
+
+def _range(values, full_range, scale=1):
+    """Rango del slider como filtro; los extremos en el límite del slider no filtran."""
+    low, high = values
+    return (low * scale if low > full_range[0] else None, high * scale if high < full_range[1] else None)
+
+@timed()
+def run_search(text, kinds, types, start, end, ranges, order):
+    conn = local_store.connect(ATHLETE_ID)
+    try:
+        return search_index.search(conn, text, kinds, types, start, end, ranges, order)
+    finally:
+        conn.close()
+
+# --- INTERFAZ DE USUARIO ---
+st.set_page_config(layout="wide", page_title="Buscador")
+st.title("🔎 Buscador de Sesiones")
+st.caption("Busca en todo el historial guardado en local: actividades realizadas y entrenamientos del calendario.")
+
+conn = local_store.connect(ATHLETE_ID)
+try:
+    available = search_index.facets(conn)
+finally:
+    conn.close()
+
+with st.sidebar:
+    if st.button("🔄 Sincronizar últimos 90 días"):
+        today = datetime.now().date()
+        conn = local_store.connect(ATHLETE_ID)
+        try:
+            backfill.sync_range(conn, ATHLETE_ID, API_KEY, today - timedelta(days=90), today, kinds=('activities', 'events'))
+            st.success("Historial actualizado.")
+        except requests.exceptions.RequestException as e:
+            st.error(f"❌ Error de conexión: {e}")
+        finally:
+            conn.close()
+        st.rerun()
+
+if not available["count"]:
+    st.info("El historial local está vacío. Sincroniza los últimos 90 días desde la barra lateral o carga todo el "
+            "historial con `python backfill.py --start AAAA-MM-DD`.")
+    finish_page(rerun)
+    st.stop()
+
+text = st.text_input("Nombre o descripción contiene", placeholder="p. ej. sweet spot")
+col1, col2, col3 = st.columns(3)
+with col1:
+    kind_values = st.multiselect("Sesiones", list(KIND_LABELS), default=[search_index.KIND_ACTIVITY], format_func=KIND_LABELS.get)
+with col2:
+    types = st.multiselect("Tipo", available["types"])
+with col3:
+    # Las sesiones sin fecha no dan límites: sin ellos no se filtra por fechas
+    if available["first"] and available["last"]:
+        first, last = datetime.strptime(available["first"], '%Y-%m-%d').date(), datetime.strptime(available["last"], '%Y-%m-%d').date()
+        dates = st.date_input("Fechas", (first, last), min_value=first, max_value=last)
+    else:
+        first = last = dates = None
+        st.caption("Las sesiones del historial no tienen fecha: no se puede filtrar por fechas.")
+
+col1, col2, col3, col4 = st.columns(4)
+with col1:
+    if_range = st.slider("IF", 0.0, IF_MAX, (0.0, IF_MAX), step=0.01)
+with col2:
+    tss_range = st.slider("TSS", 0, TSS_MAX, (0, TSS_MAX), step=5)
+with col3:
+    duration_range = st.slider("Duración (min)", 0, DURATION_MAX_MIN, (0, DURATION_MAX_MIN), step=5)
+with col4:
+    order = st.radio("Orden", ['date', 'relevance'], format_func={'date': "Más recientes", 'relevance': "Relevancia"}.get, horizontal=True)
+
+start, end = (dates[0], dates[-1]) if isinstance(dates, (tuple, list)) and dates else (None, None)
+# Como en los sliders, el rango completo no filtra: así también aparecen las sesiones sin fecha
+start = start if start and start > first else None
+end = end if end and end < last else None
+ranges = {
+    'intensity': _range(if_range, (0.0, IF_MAX)),
+    'tss': _range(tss_range, (0, TSS_MAX)),
+    'duration': _range(duration_range, (0, DURATION_MAX_MIN), scale=60),
+}
+results = run_search(text, kind_values, types, start, end, ranges, order)
+
+st.markdown("---")
+st.subheader(f"📋 {len(results)} sesiones" + (" (se muestran las 500 primeras)" if len(results) >= 500 else ""))
+if results.empty:
+    st.info("Ninguna sesión cumple los filtros.")
+else:
+    table = pd.DataFrame({
+        'Fecha': results['date'].dt.date,
+        'Sesión': results['kind'].map(KIND_LABELS),
+        'Tipo': results['type'],
+        'Nombre': results['name'],
+        'Duración': results['duration'].map(format_duration),
+        'TSS': results['tss'],
+        'IF': results['intensity'],
+        'NP (W)': results['np'],
+    })
+    st.dataframe(table.style.format({'TSS': "{:.0f}", 'IF': "{:.2f}", 'NP (W)': "{:.0f}"}, na_rep="-"),
+                 use_container_width=True, hide_index=True)
+    with st.expander("📝 Descripciones"):
+        for _, row in results[results['description'].fillna('').str.strip() != ''].head(50).iterrows():
+            day = row['date'].strftime('%d/%m/%Y') if pd.notna(row['date']) else "Sin fecha"
+            st.markdown(f"**{day} · {row['name']}**")
+            st.text(row['description'])
+
+finish_page(rerun, text=text, types=",".join(types), start=start, end=end)
@@ -0,0 +1,594 @@
+"""Control de regresiones de rendimiento: tiempos y memoria de los cálculos y páginas principales frente a una línea base.
+
+Cada caso prepara sus datos a partir de unos datos sintéticos fijos (5 años de bienestar, actividades,
+entrenamientos planificados y streams, generados con semilla) y mide el mejor tiempo de varias
+ejecuciones (los casos de pocos milisegundos se repiten más veces) y el pico de memoria de una más con `tracemalloc`. Las páginas se cargan con `streamlit.testing`
+contra una API simulada que sirve esos mismos datos, con las cachés vacías y el almacén ya cargado.
+
+La línea base (`perf/baseline.json`) guarda el resultado de cada caso y las tolerancias. Como los
+tiempos dependen de la máquina, cada medida va acompañada de una carga de calibración y, si la
+máquina actual es más lenta que la de la línea base, los límites de tiempo se amplían en la misma
+proporción. Se compara el mínimo de las ejecuciones, que apenas varía con la carga de la máquina.
+Un caso es una regresión si supera su línea base en más de la tolerancia relativa y, además, en más
+del mínimo absoluto (para que el ruido de los casos de pocos milisegundos no haga fallar el control),
+y sigue siéndolo al medirlo una segunda vez.
+
+Cada ejecución se añade a `perf/history.jsonl` (una línea JSON por ejecución) para seguir la evolución.
+
+Uso:
+    python perf_gate.py run [--cases analytics.,page.salud] [--repeat 5]   # falla (código 1) si hay regresiones
+    python perf_gate.py record [--cases ...]                             # actualiza la línea base
+    python perf_gate.py list
+"""
+import argparse
+import atexit
+import hashlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from urllib.parse import urlparse
+
+# El almacén, las cachés en disco y los perfiles van a un directorio temporal, nunca a los datos reales
+WORK_DIR = tempfile.mkdtemp(prefix="coach-perf-")
+os.environ["COACH_DATA_DIR"] = WORK_DIR
+os.environ["COACH_PROFILE_RATE"] = "0"
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True)
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import requests  # noqa: E402
+
+import analytics  # noqa: E402
+import anomaly_detector  # noqa: E402
+import charts  # noqa: E402
+import data_cache  # noqa: E402
+import decomposition  # noqa: E402
+import decoupling  # noqa: E402
+import local_store  # noqa: E402
+import plan_optimizer  # noqa: E402
+import power_model  # noqa: E402
+import readiness_rules  # noqa: E402
+import rollups  # noqa: E402
+import search_index  # noqa: E402
+import similar_sessions  # noqa: E402
+import stream_archive  # noqa: E402
+import warehouse  # noqa: E402
+import zone_times  # noqa: E402
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PERF_DIR = os.path.join(ROOT, "perf")
+BASELINE_PATH = os.path.join(PERF_DIR, "baseline.json")
+HISTORY_PATH = os.path.join(PERF_DIR, "history.jsonl")
+
+ATHLETE_ID = "perf"
+DEFAULT_REPEAT = 5
+MIN_SAMPLE_MS = 200  # Los casos más rápidos se repiten hasta sumar este tiempo...
+MAX_REPEAT = 50      # ...con este máximo de ejecuciones
+PAGE_TIMEOUT = 120  # Segundos
+DEFAULT_TOLERANCES = {"time": 0.5, "memory": 0.25, "min_time_ms": 5.0, "min_memory_kb": 512}
+PAGE_TOLERANCES = {"time": 1.0, "min_time_ms": 50.0}  # Una carga de página incluye el arranque del script de Streamlit
+
+# Cambiar la generación de los datos sintéticos exige subir `version` y volver a grabar la línea base
+FIXTURE = {"version": 1, "seed": 20240601, "years": 5, "ride_share": 0.8, "streams": 40, "stream_secs": 7200, "planned_weeks": 4}
+FIXTURE_DIGEST = hashlib.sha1(json.dumps(FIXTURE, sort_keys=True).encode()).hexdigest()[:12]
+
+POWER_ZONES = [55, 75, 90, 105, 120, 150, 999]
+HR_ZONES = [130, 145, 155, 165, 172, 178, 195]
+NAMES = ["Sweet Spot 3x15", "Z2 Resistencia", "VO2 5x4", "Recuperación", "Tempo 2x20", "Umbral 4x8"]
+
+
+# --- DATOS SINTÉTICOS ---
+class Fixtures:
+    """Historial sintético reproducible que termina en `end` (hoy, para que las páginas lo encuentren por defecto)."""
+
+    def __init__(self, end=None, spec=FIXTURE):
+        rng = np.random.default_rng(spec["seed"])
+        self.end = end or date.today()
+        days = pd.date_range(self.end - timedelta(days=365 * spec["years"]), self.end, freq='D')
+        n = len(days)
+
+        # Carga diaria: salidas en ~80 % de los días, más largas el fin de semana
+        rides = rng.random(n) < spec["ride_share"]
+        weekend = days.dayofweek.to_numpy() >= 5
+        tss = np.where(rides, rng.gamma(4, 15, n) * np.where(weekend, 1.6, 1.0), 0.0)
+        ctl, atl = np.zeros(n), np.zeros(n)
+        for i in range(1, n):
+            ctl[i] = ctl[i - 1] + (tss[i] - ctl[i - 1]) / 42
+            atl[i] = atl[i - 1] + (tss[i] - atl[i - 1]) / 7
+
+        t = np.arange(n)
+        season = np.sin(2 * np.pi * (days.dayofyear.to_numpy() - 80) / 365.25)
+        hrv = 58 + 4 * t / n + 3 * season - 0.05 * (atl - ctl) + rng.normal(0, 5, n)
+        rhr = 48 - 2 * t / n - 1.5 * season + 0.04 * (atl - ctl) + rng.normal(0, 2, n)
+        sleep = np.clip(78 + 2 * season + rng.normal(0, 8, n), 30, 100)
+        recorded = rng.random(n) > 0.03  # Algunos días sin lectura
+        self.wellness = [
+            {"id": day.strftime('%Y-%m-%d'), "ctl": round(c, 2), "atl": round(a, 2), "hrv": round(h, 1), "restingHR": round(r),
+             "sleepScore": round(s), "BodyBatteryMax": int(rng.integers(55, 100)), "BodyBatteryMin": int(rng.integers(5, 40))}
+            for day, c, a, h, r, s, ok in zip(days, ctl, atl, hrv, rhr, sleep, recorded) if ok
+        ]
+
+        self.activities = []
+        for i in np.flatnonzero(tss > 0):
+            secs = int(tss[i] / 60 * 3600 / 0.75 ** 2 * rng.uniform(0.8, 1.2))
+            ftp = 240 + 20 * int(i * 4 // n)  # La FTP sube cada año y pico
+            intensity = float(rng.uniform(0.55, 0.95))
+            hr = float(rng.uniform(120, 160))
+            zone_secs = rng.dirichlet(np.ones(7)) * secs
+            kind = rng.choice(["Ride", "VirtualRide", "Ride", "Run", "WeightTraining"])
+            self.activities.append({
+                "id": f"i{len(self.activities) + 1}", "start_date_local": f"{days[i].strftime('%Y-%m-%d')}T08:00:00",
+                "type": kind, "name": f"{NAMES[i % len(NAMES)]} #{len(self.activities) + 1}",
+                "moving_time": secs, "elapsed_time": secs + 120, "icu_training_load": round(float(tss[i])),
+                "icu_intensity": round(intensity * 100, 1), "icu_weighted_avg_watts": round(ftp * intensity),
+                "icu_average_watts": round(ftp * intensity * 0.92), "average_heartrate": round(hr), "max_heartrate": round(hr + 25),
+                "icu_ctl": round(float(ctl[i]), 1), "icu_atl": round(float(atl[i]), 1), "icu_power_hr_z2": round(float(rng.uniform(1.2, 1.8)), 2),
+                "decoupling": round(float(rng.uniform(-2, 10)), 1), "icu_ftp": ftp, "icu_power_zones": POWER_ZONES, "icu_hr_zones": HR_ZONES,
+                "icu_zone_times": [{"id": f"Z{z + 1}", "secs": int(s)} for z, s in enumerate(zone_secs)],
+                "icu_hr_zone_times": [int(s) for s in rng.permutation(zone_secs)],
+            })
+
+        planned = pd.date_range(days[0], self.end + timedelta(weeks=spec["planned_weeks"]), freq='D')
+        self.events = [
+            {"id": i + 1, "category": "WORKOUT", "type": "Ride", "start_date_local": f"{day.strftime('%Y-%m-%d')}T00:00:00",
+             "name": f"Plan {NAMES[i % len(NAMES)]}", "moving_time": 3600, "icu_training_load": 70, "icu_intensity": 80,
+             "description": "Calentamiento\n- 10m ramp 50-75%\n\nSerie principal 3x\n- 8m 95-100%\n- 4m 55%\n\nVuelta a la calma\n- 10m 50%"}
+            for i, day in enumerate(d for d in planned if d.dayofweek in (1, 3, 5))
+        ]
+
+        # Streams a 1 Hz (listas, como los da la API) de las últimas salidas en bici: bloques de intervalos
+        # y FC que sigue a la potencia con retraso
+        bikes = [a for a in self.activities if a["type"] in analytics.RIDE_TYPES][-spec["streams"]:]
+        secs = spec["stream_secs"]
+        self.streams = {}
+        for a in bikes:
+            base = a["icu_ftp"] * rng.uniform(0.55, 0.7)
+            blocks = np.repeat(rng.choice([0.0, 0.3, 0.6], secs // 300 + 1, p=[0.6, 0.25, 0.15]), 300)[:secs]
+            watts = np.clip(base * (1 + blocks) + rng.normal(0, 25, secs), 0, None)
+            watts[rng.random(secs) < 0.02] = 0  # Soltar pedales
+            effort = np.convolve(watts, np.ones(60) / 60, mode='same') / a["icu_ftp"]
+            heartrate = 105 + 60 * effort + np.linspace(0, 8, secs) + rng.normal(0, 2, secs)
+            self.streams[a["id"]] = {
+                "time": list(range(secs)), "watts": np.round(watts).astype(int).tolist(),
+                "heartrate": np.round(heartrate).astype(int).tolist(), "cadence": rng.integers(80, 96, secs).tolist(),
+                "velocity_smooth": np.round(rng.normal(8.5, 0.6, secs), 2).tolist(),
+            }
+
+    def wellness_frame(self):
+        df = pd.DataFrame(self.wellness)
+        df['id'] = pd.to_datetime(df['id'])
+        return df.set_index('id').sort_index()
+
+    def zone_sets(self, activity_ids):
+        by_id = {a["id"]: a for a in self.activities}
+        return [{"ftp": by_id[i]["icu_ftp"], "power_zones": POWER_ZONES[:6], "hr_zones": HR_ZONES[:6]} for i in activity_ids]
+
+
+class FixtureAPI:
+    """Sustituto de `requests.get` que responde como Intervals.icu con los datos sintéticos."""
+
+    def __init__(self, fixtures):
+        self.fixtures = fixtures
+        self.activities = {a["id"]: a for a in fixtures.activities}
+
+    @staticmethod
+    def _in_range(day, params):
+        return str(params.get('oldest', '0000'))[:10] <= day[:10] <= str(params.get('newest', '9999'))[:10]
+
+    def get(self, url, params=None, **kwargs):
+        params, parts = params or {}, [p for p in urlparse(url).path.split('/') if p]
+        status, data = 200, None
+        if parts[-1] == 'wellness':
+            data = [w for w in self.fixtures.wellness if self._in_range(w["id"], params)]
+        elif parts[-1] == 'activities':
+            data = [a for a in reversed(self.fixtures.activities) if self._in_range(a["start_date_local"], params)]
+        elif parts[-1] == 'events':
+            data = [e for e in self.fixtures.events if self._in_range(e["start_date_local"], params)]
+        elif parts[-1] == 'streams' and parts[-2] in self.fixtures.streams:
+            data = [{"type": name, "data": values} for name, values in self.fixtures.streams[parts[-2]].items()]
+        elif parts[-2] == 'activity' and parts[-1] in self.activities:
+            data = self.activities[parts[-1]]
+        else:
+            status = 404
+        response = requests.models.Response()
+        response.status_code, response.url = status, url
+        response.headers['Content-Type'] = 'application/json'
+        response._content = json.dumps(data).encode()
+        return response
+
+
+# --- CASOS ---
+CASES = {}  # nombre -> (preparación, repeticiones, tolerancias); la preparación devuelve la función que se mide
+
+
+def case(name, repeat=DEFAULT_REPEAT, tolerances=None):
+    def decorator(setup):
+        CASES[name] = (setup, repeat, tolerances or {})
+        return setup
+    return decorator
+
+
+class Environment:
+    """Datos sintéticos, API simulada y almacén cargado que comparten todos los casos."""
+
+    def __init__(self):
+        self.fx = Fixtures()
+        requests.get = FixtureAPI(self.fx).get
+        self.conn = local_store.connect(ATHLETE_ID)
+        with self.conn:
+            local_store.upsert_wellness(self.conn, self.fx.wellness)
+            local_store.upsert_activities(self.conn, self.fx.activities)
+            local_store.upsert_events(self.conn, self.fx.events)
+            local_store.put_streams(self.conn, self.fx.streams.items())
+            rollups.rebuild(self.conn)
+        self.wellness = self.fx.wellness_frame()
+        self.start = self.wellness.index[0].date()
+
+
+@case("analytics.activity_table")
+def _(env):
+    return lambda: analytics.format_durations(analytics.activity_table(env.fx.activities)['Duración (s)'])
+
+
+@case("analytics.readiness_analysis")
+def _(env):
+    return lambda: analytics.readiness_analysis(env.wellness, env.fx.end)
+
+
+@case("analytics.efficiency_frame")
+def _(env):
+    return lambda: analytics.efficiency_averages(analytics.efficiency_frame(env.fx.activities), env.fx.end)
+
+
+@case("readiness_rules.score_history")
+def _(env):
+    evaluator = readiness_rules.compile_rules()
+    return lambda: evaluator.score(env.wellness)
+
+
+@case("anomaly_detector.update_from_frame")
+def _(env):
+    return lambda: anomaly_detector.update_from_frame(anomaly_detector.new_state(), env.wellness)
+
+
+@case("rollups.compute_weeks")
+def _(env):
+    return lambda: rollups.compute(env.conn, 'week', env.start, env.fx.end)
+
+
+@case("decomposition.fit")
+def _(env):
+    series = decomposition.daily_series(env.conn, 'hrv')
+    return lambda: decomposition.fit(series)
+
+
+@case("zone_times.compute_batch")
+def _(env):
+    ids = list(env.fx.streams)
+    streams, zone_sets = [env.fx.streams[i] for i in ids], env.fx.zone_sets(ids)
+    return lambda: zone_times.compute_batch(streams, zone_sets)
+
+
+@case("decoupling.compute_batch")
+def _(env):
+    streams = list(env.fx.streams.values())
+    return lambda: decoupling.compute_batch(streams)
+
+
+@case("power_model.mean_max")
+def _(env):
+    streams = list(env.fx.streams.values())
+    return lambda: [power_model.mean_max(s["watts"]) for s in streams]
+
+
+@case("stream_archive.roundtrip")
+def _(env):
+    streams = list(env.fx.streams.values())[:10]
+
+    def run():
+        for s in streams:
+            blob = stream_archive.encode_streams(s)
+            stream_archive.decode_slice(blob, 1800, 3600, ['watts', 'heartrate'])
+    return run
+
+
+@case("charts.downsample_stream")
+def _(env):
+    s = next(iter(env.fx.streams.values()))
+    frame = pd.DataFrame({'watts': s["watts"], 'heartrate': s["heartrate"]}, index=np.asarray(s["time"]) / 60)
+    return lambda: charts.downsample(frame, method='minmax')
+
+
+@case("charts.downsample_daily")
+def _(env):
+    frame = env.wellness[['hrv', 'restingHR', 'sleepScore']].asfreq('D')
+    return lambda: charts.downsample(frame, max_points=600)
+
+
+@case("similar_sessions.build_index")
+def _(env):
+    return lambda: similar_sessions.build_index(env.fx.activities)
+
+
+@case("search_index.search")
+def _(env):
+    return lambda: search_index.search(env.conn, text="sweet spot")
+
+
+@case("plan_optimizer.optimize_plan")
+def _(env):
+    return lambda: plan_optimizer.optimize_plan(env.fx.end, env.fx.end + timedelta(weeks=12), 60, 65, 80, 5)
+
+
+@case("warehouse.scan")
+def _(env):
+    warehouse.export(ATHLETE_ID, conn=env.conn, log=None)
+    return lambda: warehouse.scan(ATHLETE_ID, 'activities', start=env.fx.end - timedelta(days=365),
+                                  columns=['date', 'name', 'icu_training_load'], filters=[('icu_training_load', '>', 100)])
+
+
+def _page(script):
+    def setup(env):
+        from streamlit.testing.v1 import AppTest
+
+        def load():
+            data_cache.invalidate_all()
+            at = AppTest.from_file(os.path.join(ROOT, script), default_timeout=PAGE_TIMEOUT)
+            at.secrets["ATHLETE_ID"], at.secrets["API_KEY"] = ATHLETE_ID, "perf"
+            at.run()
+            if at.exception:
+                raise RuntimeError(f"{script}: {at.exception[0].message}")
+        load()  # La primera carga sincroniza el almacén; las medidas son con el almacén al día y las cachés vacías
+        return load
+    return setup
+
+
+for _name, _script in (("page.resumen", "streamlit_app.py"), ("page.salud", "pages/1_Salud.py"),
+                       ("page.correlaciones", "pages/5_Correlaciones.py"), ("page.semanal", "pages/6_Analisis_Semanal.py")):
+    case(_name, tolerances=PAGE_TOLERANCES)(_page(_script))
+
+
+# --- MEDICIÓN ---
+def _elapsed_ms(func):
+    started = time.perf_counter()
+    func()
+    return (time.perf_counter() - started) * 1000
+
+
+def calibrate(repeat=7):
+    """Tiempo (ms) de una carga fija de numpy, pandas y Python puro con la que se escalan los límites de tiempo."""
+    values = np.random.default_rng(0).random(300_000)
+
+    def work():
+        np.sort(values)
+        pd.Series(values).rolling(7).mean()
+        sum(i * i for i in range(300_000))
+    work()
+    return min(_elapsed_ms(work) for _ in range(repeat))
+
+
+def measure(func, repeat):
+    """Mediana y mínimo (ms) de al menos `repeat` ejecuciones tras una de calentamiento, y pico de memoria (KB) de otra aparte.
+
+    Si las `repeat` ejecuciones no llegan a `MIN_SAMPLE_MS` se sigue midiendo (hasta `MAX_REPEAT`), para
+    que el mínimo de los casos de pocos milisegundos no dependa de un par de ejecuciones.
+    """
+    func()
+    times = [_elapsed_ms(func) for _ in range(repeat)]
+    while sum(times) < MIN_SAMPLE_MS and len(times) < MAX_REPEAT:
+        times.append(_elapsed_ms(func))
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"ms": round(statistics.median(times), 2), "min_ms": round(min(times), 2), "peak_kb": round(peak / 1024)}
+
+
+def selected_cases(patterns):
+    if not patterns:
+        return list(CASES)
+    prefixes = [p.strip() for p in patterns.split(",") if p.strip()]
+    names = [name for name in CASES if any(name.startswith(p) for p in prefixes)]
+    if not names:
+        raise ValueError(f"Ningún caso coincide con {patterns!r}. Disponibles: {', '.join(CASES)}")
+    return names
+
+
+def run_cases(names, repeat=None, log=print):
+    """Mide los casos indicados. Devuelve {caso: resultado}; un caso que falla queda como {"error": ...}."""
+    env = Environment()
+    results = {}
+    for name in names:
+        setup, default_repeat, _ = CASES[name]
+        try:
+            results[name] = measure(setup(env), repeat or default_repeat)
+        except Exception as e:  # Un caso roto no impide medir los demás, pero cuenta como fallo
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+        if log:
+            r = results[name]
+            log(f"  {name:<36} " + (r["error"] if "error" in r else f"{r['ms']:>9.1f} ms {r['peak_kb'] / 1024:>8.1f} MB"))
+    env.conn.close()
+    return results
+
+
+# --- LÍNEA BASE ---
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def tolerances(baseline, name):
+    """Tolerancias de un caso: las generales de la línea base, con las del caso (en el código y en la línea base) encima."""
+    entry = baseline["cases"].get(name) or {}
+    own = CASES[name][2] if name in CASES else {}
+    return {**DEFAULT_TOLERANCES, **baseline.get("tolerances", {}), **own, **entry.get("tolerances", {})}
+
+
+def _best_ms(result):
+    """Tiempo que se compara: el mínimo de las ejecuciones (las líneas base antiguas solo tienen la mediana)."""
+    return result.get("min_ms", result["ms"])
+
+
+def compare(results, baseline, calibration_ms):
+    """Compara con la línea base. Devuelve (filas del informe, regresiones)."""
+    rows, regressions = [], []
+    for name, result in results.items():
+        base = baseline["cases"].get(name)
+        if "error" in result:
+            rows.append((name, result, base, None, None, "ERROR"))
+            regressions.append({"case": name, "kind": "error", "detail": result["error"]})
+            continue
+        if not base:
+            rows.append((name, result, None, None, None, "NUEVO"))
+            continue
+        tol = tolerances(baseline, name)
+        # En una máquina más lenta los límites se relajan en proporción; nunca se aprietan, para que el
+        # ruido de la propia calibración no dé falsos positivos
+        speed = max(calibration_ms / base["calibration_ms"], 1.0) if base.get("calibration_ms") else 1.0
+        expected_ms = _best_ms(base) * speed
+        time_limit = max(expected_ms * (1 + tol["time"]), expected_ms + tol["min_time_ms"])
+        memory_limit = max(base["peak_kb"] * (1 + tol["memory"]), base["peak_kb"] + tol["min_memory_kb"])
+        status = []
+        if _best_ms(result) > time_limit:
+            status.append("LENTO")
+            regressions.append({"case": name, "kind": "time", "value": _best_ms(result), "limit": round(time_limit, 2)})
+        if result["peak_kb"] > memory_limit:
+            status.append("MEMORIA")
+            regressions.append({"case": name, "kind": "memory", "value": result["peak_kb"], "limit": round(memory_limit)})
+        rows.append((name, result, base, time_limit, memory_limit, " ".join(status) or "OK"))
+    return rows, regressions
+
+
+def print_report(rows):
+    print(f"{'Caso':<36} {'mín. ms':>9} {'base':>9} {'límite':>9} {'MB':>8} {'base':>8} {'límite':>8}  Estado")
+    for name, result, base, time_limit, memory_limit, status in rows:
+        if "error" in result:
+            print(f"{name:<36} {'':>9} {'':>9} {'':>9} {'':>8} {'':>8} {'':>8}  {status}: {result['error']}")
+            continue
+
+        def cell(value, scale=1.0, width=9):
+            return f"{value / scale:>{width}.1f}" if value is not None else f"{'-':>{width}}"
+        print(f"{name:<36} {cell(_best_ms(result))} {cell(base and _best_ms(base))} {cell(time_limit)} "
+              f"{cell(result['peak_kb'], 1024, 8)} {cell(base and base['peak_kb'], 1024, 8)} {cell(memory_limit, 1024, 8)}  {status}")
+
+
+def record(results, calibration_ms, path=BASELINE_PATH):
+    """Guarda los resultados como línea base, conservando las tolerancias y los casos no medidos esta vez."""
+    failed = [name for name, r in results.items() if "error" in r]
+    if failed:
+        raise RuntimeError(f"No se graba la línea base: fallan {', '.join(failed)}")
+    baseline = load_baseline(path) or {"tolerances": dict(DEFAULT_TOLERANCES), "cases": {}}
+    # Con otros datos sintéticos los valores anteriores no son comparables
+    cases = baseline["cases"] if baseline.get("fixtures") == FIXTURE_DIGEST else {}
+    for name, result in results.items():
+        # Cada caso guarda la calibración con que se midió, así se pueden volver a grabar solo algunos
+        own = {"tolerances": cases[name]["tolerances"]} if "tolerances" in cases.get(name, {}) else {}
+        cases[name] = {**result, "calibration_ms": round(calibration_ms, 2), **own}
+    baseline.update({"fixtures": FIXTURE_DIGEST, "recorded_at": datetime.now().isoformat(timespec='seconds'), "commit": _commit(),
+                     "python": platform.python_version(), "cases": dict(sorted(cases.items()))})
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    return baseline
+
+
+# --- HISTORIAL ---
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def append_history(command, results, calibration_ms, regressions, path=HISTORY_PATH):
+    entry = {
+        "timestamp": datetime.now().isoformat(timespec='seconds'), "command": command, "commit": _commit(),
+        "python": platform.python_version(), "machine": platform.machine(), "fixtures": FIXTURE_DIGEST,
+        "calibration_ms": round(calibration_ms, 2), "results": results, "regressions": regressions,
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+# --- LÍNEA DE COMANDOS ---
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Control de regresiones de rendimiento frente a una línea base grabada.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("run", "Medir y comparar con la línea base (código 1 si hay regresiones)"),
+                            ("record", "Medir y guardar como nueva línea base")):
+        sub = commands.add_parser(name, help=help_text)
+        sub.add_argument("--cases", help="Prefijos de los casos separados por comas (por defecto, todos)")
+        sub.add_argument("--repeat", type=int, help="Ejecuciones medidas por caso como mínimo (por defecto, 5)")
+        sub.add_argument("--baseline", default=BASELINE_PATH, help="Fichero de la línea base")
+        sub.add_argument("--history", default=HISTORY_PATH, help="Fichero JSONL del historial")
+        sub.add_argument("--no-history", action="store_true", help="No añadir la ejecución al historial")
+    commands.add_parser("list", help="Mostrar los casos disponibles")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "list":
+        for name in CASES:
+            print(name)
+        return
+
+    try:
+        names = selected_cases(args.cases)
+    except ValueError as e:
+        sys.exit(str(e))
+    baseline = load_baseline(args.baseline)
+    if args.command == "run" and baseline is None:
+        sys.exit(f"No hay línea base en {args.baseline}. Grábala con `python perf_gate.py record`.")
+    if args.command == "run" and baseline.get("fixtures") != FIXTURE_DIGEST:
+        sys.exit("La línea base se grabó con otros datos sintéticos. Vuelve a grabarla con `python perf_gate.py record`.")
+
+    calibration_ms = calibrate()
+    print(f"Midiendo {len(names)} casos (datos sintéticos {FIXTURE_DIGEST}, calibración {calibration_ms:.1f} ms)...")
+    results = run_cases(names, args.repeat)
+
+    if args.command == "record":
+        try:
+            record(results, calibration_ms, args.baseline)
+        except RuntimeError as e:
+            sys.exit(str(e))
+        if not args.no_history:
+            append_history("record", results, calibration_ms, [], args.history)
+        print(f"Línea base guardada en {args.baseline}.")
+        return
+
+    rows, regressions = compare(results, baseline, calibration_ms)
+    # Un caso lento se vuelve a medir una vez: una racha de carga de la máquina no se repite, una regresión sí
+    slow = [r["case"] for r in regressions if r["kind"] == "time"]
+    if slow:
+        print(f"Repitiendo {len(slow)} casos lentos...")
+        for name, again in run_cases(slow, args.repeat, log=None).items():
+            if "error" not in again:
+                results[name] = {**results[name], "min_ms": min(_best_ms(results[name]), again["min_ms"])}
+        rows, regressions = compare(results, baseline, calibration_ms)
+    print_report(rows)
+    if not args.no_history:
+        append_history("run", results, calibration_ms, regressions, args.history)
+    if regressions:
+        print(f"\n{len(regressions)} regresiones: " + ", ".join(f"{r['case']} ({r['kind']})" for r in regressions), file=sys.stderr)
+        sys.exit(1)
+    print("\nSin regresiones.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Medición de cada ejecución de página: perfilado opcional y panel de rendimiento en la barra lateral."""
+import os
+
+import pandas as pd
+import streamlit as st
+
+import ingest
+import instrumentation
+import profiling
+
+
+def _secret(name):
+    try:
+        return st.secrets.get(name)
+    except FileNotFoundError:
+        return None
+
+
+def start_page(page):
+    """Empieza a medir la ejecución del script (llamar al principio de la página).
+
+    Antes de que la página lea datos se aplican las invalidaciones de caché pendientes de `ingest`.
+    """
+    ingest.apply_changes(_secret("ATHLETE_ID"))
+    rerun = instrumentation.begin_rerun(page)
+    rate = profiling.sample_rate({"PROFILE_RATE": _secret("PROFILE_RATE")})
+    if profiling.should_profile(st.session_state, rate):
+        rerun["profile"] = profiling.start()
+    return rerun
+
+
+def finish_page(rerun, **tags):
+    """Cierra la medición, guarda el perfil si la sesión está muestreada y muestra el panel si se activa.
+
+    `tags` son las entradas de la página (fechas seleccionadas, etc.) con las que se etiqueta el perfil.
+    """
+    if rerun.get("profile"):
+        profiling.stop(rerun["profile"], rerun["page"], {"athlete": _secret("ATHLETE_ID"), **tags})
+    summary = instrumentation.end_rerun(rerun)
+    if not st.sidebar.toggle("📊 Panel de rendimiento", key="perf_panel"):
+        return
+
+    with st.sidebar:
+        st.markdown(f"**Última ejecución de {summary['page']}:** {summary['wall_ms']:.0f} ms")
+        st.caption(
+            f"API: {summary['http_ms']:.0f} ms en {summary['http_calls']} llamadas ({summary['http_bytes'] / 1024:.0f} KB) · "
+            f"Cálculo: {summary['compute_ms']:.0f} ms · Render y resto: {summary['render_ms']:.0f} ms"
+        )
+
+        snap = instrumentation.snapshot()
+        if snap["histograms"]:
+            latencies = pd.DataFrame(snap["histograms"])[["type", "name", "count", "mean_ms", "p50_ms", "p95_ms"]]
+            latencies.columns = ["Tipo", "Nombre", "N", "Media (ms)", "p50 ≤", "p95 ≤"]
+            st.dataframe(latencies.style.format({"Media (ms)": "{:.0f}"}), hide_index=True)
+
+        if snap["caches"]:
+            caches = pd.DataFrame(snap["caches"])
+            caches["name"] = caches["name"].map(lambda n: os.path.basename(n))
+            caches["MB"] = caches["bytes"] / 1024 / 1024
+            caches = caches[["name", "entries", "MB", "hits", "misses", "coalesced", "hit_ratio"]]
+            caches.columns = ["Caché", "Entradas", "MB", "Aciertos", "Fallos", "Agrupadas", "% Acierto"]
+            st.dataframe(caches.style.format({"MB": "{:.2f}", "% Acierto": "{:.0%}"}, na_rep="-"), hide_index=True)
+
+        c1, c2 = st.columns(2)
+        c1.download_button("JSON", instrumentation.to_json(), file_name="metricas.json", mime="application/json")
+        c2.download_button("Prometheus", instrumentation.to_prometheus(), file_name="metricas.prom", mime="text/plain")
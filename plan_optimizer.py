@@ -0,0 +1,156 @@
+"""Optimizador de la carga de entrenamiento (TSS) hacia un objetivo de CTL/TSB en fecha de carrera."""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+# --- MODELO DE CARGA (Banister / PMC) ---
+CTL_DAYS = 42
+ATL_DAYS = 7
+
+# Reparto por defecto del TSS semanal entre los días (lunes..domingo)
+DEFAULT_WEEK_PATTERN = np.array([0.0, 0.18, 0.14, 0.18, 0.0, 0.28, 0.22])
+
+
+def _decay_matrix(n_days, time_constant):
+    """Matriz (días x días) tal que carga_final = tss @ M + decaimiento * carga_inicial."""
+    k = 1.0 / time_constant
+    idx = np.arange(n_days)
+    lag = idx[None, :] - idx[:, None]  # fila = día del TSS, columna = día evaluado
+    m = np.where(lag >= 0, k * (1 - k) ** np.clip(lag, 0, None), 0.0)
+    decay = (1 - k) ** (idx + 1)
+    return m, decay
+
+
+def simulate_load(daily_tss, ctl0, atl0, at=None):
+    """Simula CTL/ATL/TSB para un lote de planes diarios (candidatos x días) de una sola vez.
+
+    Con `at` solo se evalúan los días indicados, lo que abarata mucho los lotes grandes.
+    """
+    daily_tss = np.atleast_2d(np.asarray(daily_tss, dtype=float))
+    n_days = daily_tss.shape[1]
+    m_ctl, d_ctl = _decay_matrix(n_days, CTL_DAYS)
+    m_atl, d_atl = _decay_matrix(n_days, ATL_DAYS)
+    if at is not None:
+        m_ctl, d_ctl, m_atl, d_atl = m_ctl[:, at], d_ctl[at], m_atl[:, at], d_atl[at]
+    ctl = daily_tss @ m_ctl + d_ctl * ctl0
+    atl = daily_tss @ m_atl + d_atl * atl0
+    return ctl, atl, ctl - atl
+
+
+def build_calendar(start_date, race_date, week_pattern=DEFAULT_WEEK_PATTERN):
+    """Devuelve los días del plan (hasta la víspera de la carrera) y su semana ISO."""
+    n_days = (race_date - start_date).days
+    if n_days <= 0:
+        return pd.DataFrame(columns=['date', 'week', 'weight'])
+    days = pd.DataFrame({'date': pd.date_range(start_date, periods=n_days, freq='D')})
+    iso = days['date'].dt.isocalendar()
+    days['week'] = iso['year'].astype(int) * 100 + iso['week'].astype(int)
+    days['weight'] = np.asarray(week_pattern, dtype=float)[days['date'].dt.weekday.to_numpy()]
+    return days
+
+
+def _mapping_matrix(days, granularity):
+    """Matriz (variables x días) que reparte cada variable de decisión sobre los días del plan."""
+    if granularity == 'daily':
+        return np.eye(len(days)), list(days['date'].dt.date)
+
+    weeks = list(dict.fromkeys(days['week']))
+    week_idx = days['week'].map({w: i for i, w in enumerate(weeks)}).to_numpy()
+    weights = days['weight'].to_numpy()
+    mass = np.bincount(week_idx, weights=weights, minlength=len(weeks))
+    a = np.zeros((len(weeks), len(days)))
+    a[week_idx, np.arange(len(days))] = np.divide(weights, mass[week_idx], out=np.zeros_like(weights), where=mass[week_idx] > 0)
+    return a, weeks
+
+
+def _score(ctl, tsb, ctl0, target_ctl, target_tsb, max_ramp, x, upper):
+    """Puntuación (menor es mejor) de cada candidato: error en la fecha objetivo + penalizaciones.
+
+    `ctl` y `tsb` vienen evaluados al final de cada semana; la última columna es la víspera de la carrera.
+    """
+    error = (ctl[:, -1] - target_ctl) ** 2 + (tsb[:, -1] - target_tsb) ** 2
+
+    prev = np.concatenate([np.full((ctl.shape[0], 1), ctl0), ctl[:, :-1]], axis=1)
+    ramp = ctl - prev
+    ramp_violation = np.clip(ramp - max_ramp, 0, None).sum(axis=1)
+
+    bounds_violation = (np.clip(-x, 0, None) + np.clip(x - upper, 0, None)).sum(axis=1)
+    smoothness = np.abs(np.diff(x, axis=1)).mean(axis=1) if x.shape[1] > 1 else 0.0
+    return error + 1000 * ramp_violation ** 2 + 10 * bounds_violation + 0.01 * smoothness
+
+
+def optimize_plan(start_date, race_date, ctl0, atl0, target_ctl, target_tsb,
+                  max_ramp=6.0, granularity='weekly', week_pattern=DEFAULT_WEEK_PATTERN,
+                  max_weekly_tss=900, max_daily_tss=300, batch_size=4096, iterations=40,
+                  elite_frac=0.05, seed=0):
+    """Busca la distribución de TSS que lleva CTL/TSB al objetivo el día de la carrera.
+
+    Usa el método de entropía cruzada: cada iteración evalúa un lote grande de
+    candidatos con álgebra matricial y reajusta la distribución de muestreo
+    alrededor de los mejores.
+    """
+    days = build_calendar(start_date, race_date, week_pattern)
+    if days.empty:
+        return {"error": "La fecha de la carrera debe ser posterior a la fecha de inicio del plan."}
+
+    a, labels = _mapping_matrix(days, granularity)
+    n_vars = a.shape[0]
+    upper = max_daily_tss if granularity == 'daily' else max_weekly_tss
+
+    # Índice del último día de cada semana dentro del horizonte (para la restricción de rampa)
+    week_end_idx = days.groupby('week', sort=False).tail(1).index.to_numpy()
+
+    rng = np.random.default_rng(seed)
+    per_var_start = ctl0 * 7 if granularity == 'weekly' else ctl0
+    mean = np.full(n_vars, max(per_var_start, 1.0))
+    std = np.full(n_vars, max(mean[0] * 0.5, 20.0))
+    n_elite = max(int(batch_size * elite_frac), 2)
+
+    best_x, best_score = None, np.inf
+    for _ in range(iterations):
+        x = rng.normal(mean, std, size=(batch_size, n_vars))
+        x = np.clip(x, 0, upper)
+        ctl, _, tsb = simulate_load(x @ a, ctl0, atl0, at=week_end_idx)
+        scores = _score(ctl, tsb, ctl0, target_ctl, target_tsb, max_ramp, x, upper)
+
+        elite = np.argpartition(scores, n_elite)[:n_elite]
+        if scores[elite].min() < best_score:
+            i = elite[np.argmin(scores[elite])]
+            best_score, best_x = scores[i], x[i].copy()
+        mean = x[elite].mean(axis=0)
+        std = np.maximum(x[elite].std(axis=0), 1.0)
+
+    ctl, atl, tsb = simulate_load(best_x @ a, ctl0, atl0)
+    daily = days[['date', 'week']].copy()
+    daily['TSS'] = (best_x @ a).round()
+    daily['CTL'], daily['ATL'], daily['TSB'] = ctl[0], atl[0], tsb[0]
+
+    weekly = daily.groupby('week', sort=False).agg(
+        Inicio=('date', 'first'), TSS=('TSS', 'sum'), CTL=('CTL', 'last'), ATL=('ATL', 'last'), TSB=('TSB', 'last')
+    )
+    weekly['Rampa CTL'] = weekly['CTL'].diff().fillna(weekly['CTL'].iloc[0] - ctl0)
+
+    return {
+        "daily": daily.set_index('date'),
+        "weekly": weekly,
+        "final_ctl": float(ctl[0, -1]),
+        "final_tsb": float(tsb[0, -1]),
+        "score": float(best_score),
+        "granularity": granularity,
+        "labels": labels,
+    }
+
+
+def proposed_weekly_targets(plan):
+    """Convierte un plan optimizado en objetivos semanales {(año ISO, semana ISO): TSS}."""
+    return {(int(week) // 100, int(week) % 100): float(row['TSS']) for week, row in plan['weekly'].iterrows()}
+
+
+def weeks_back(end_date, n):
+    """Claves ISO (año, semana) de las n semanas que terminan en end_date, de la más reciente a la más antigua."""
+    keys = []
+    for i in range(n):
+        iso = (end_date - timedelta(days=7 * i)).isocalendar()
+        keys.append((iso[0], iso[1]))
+    return keys
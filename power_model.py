@@ -0,0 +1,201 @@
+"""Modelo de potencia crítica (CP) y W′ ajustado por ventanas móviles sobre todo el historial.
+
+De cada salida con streams en el almacén se guardan sus mejores potencias medias (MMP) en unas
+duraciones fijas. Para cada ventana (p. ej. los 90 días que terminan cada domingo) se toma la mejor
+marca de cada duración y se ajusta, para todas las ventanas a la vez con álgebra vectorizada:
+
+- 2 parámetros: P(t) = CP + W′/t, mínimos cuadrados lineales en 1/t con esfuerzos de 2 a 20 min.
+- 3 parámetros (Morton): P(t) = CP + W′/(t + k), con k = W′/(Pmax − CP). Para cada k de una
+  rejilla el ajuste es lineal; se queda el k de menor error en cada ventana.
+
+Los ajustes se guardan en `cp_fits` por (modelo, días de ventana, fin de ventana), así que las
+tendencias de varios años se leen de la tabla. Cuando cambian los mejores esfuerzos de una salida
+se borran solo los ajustes de las ventanas que la contienen.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+import local_store
+import stream_archive
+
+DURATIONS = np.array([5, 15, 30, 60, 120, 180, 300, 480, 600, 720, 1200, 1800])
+CP2_RANGE = (120, 1200)  # Duraciones (s) que usa el modelo de 2 parámetros
+K_GRID = np.geomspace(1, 300, 80)  # Valores de k (s) que se prueban en el modelo de 3 parámetros
+MIN_POINTS = 3
+MODELS = ('2p', '3p')
+WINDOW_FREQ = 'W-SUN'  # Cada ventana termina en domingo
+
+
+def mean_max(watts, durations=DURATIONS):
+    """Mejor potencia media para cada duración (s) en un stream a 1 Hz; NaN si la salida es más corta."""
+    w = np.nan_to_num(np.asarray(watts, dtype=float))
+    cumulative = np.concatenate([[0.0], np.cumsum(w)])
+    out = np.full(len(durations), np.nan)
+    for i, d in enumerate(durations):
+        if d <= len(w):
+            out[i] = (cumulative[d:] - cumulative[:-d]).max() / d
+    return out
+
+
+def _forget_windows(conn, days):
+    """Borra los ajustes de las ventanas que contienen alguno de los días."""
+    conn.executemany("DELETE FROM cp_fits WHERE window_end >= ? AND window_end < date(?, '+' || window_days || ' days')",
+                     [(d, d) for d in sorted(set(days)) if d])
+
+
+def update_best_efforts(conn):
+    """Calcula los mejores esfuerzos de las salidas con streams nuevos o cambiados. Devuelve cuántas.
+
+    Cada fila recuerda el rowid del stream del que salió: si `put_streams` lo reemplaza, cambia el
+    rowid y se recalcula. Las filas cuyo stream ya no existe se borran.
+    """
+    stale = conn.execute(
+        "SELECT s.activity_id, s.rowid, a.date FROM streams s JOIN activities a ON a.id = s.activity_id "
+        "LEFT JOIN best_efforts b ON b.activity_id = s.activity_id "
+        "WHERE a.type IN ('Ride', 'VirtualRide') AND (b.activity_id IS NULL OR b.stream_rowid != s.rowid)"
+    ).fetchall()
+    orphans = conn.execute(
+        "SELECT b.activity_id, b.date FROM best_efforts b LEFT JOIN streams s ON s.activity_id = b.activity_id "
+        "WHERE s.activity_id IS NULL"
+    ).fetchall()
+    if not stale and not orphans:
+        return 0
+
+    rows = []
+    for activity_id, _, day in stale:
+        blob = local_store.get_stream_blob(conn, activity_id)
+        watts = stream_archive.decode_streams(blob, ['watts']).get('watts') if blob else None
+        efforts = mean_max(watts) if watts is not None and len(watts) else np.full(len(DURATIONS), np.nan)
+        # El rowid se lee después de get_stream_blob, que puede reescribir los streams antiguos en JSON
+        rowid = conn.execute("SELECT rowid FROM streams WHERE activity_id = ?", (activity_id,)).fetchone()[0]
+        data = {str(int(d)): round(float(p), 1) for d, p in zip(DURATIONS, efforts) if np.isfinite(p)}
+        rows.append((activity_id, day, rowid, json.dumps(data)))
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO best_efforts (activity_id, date, stream_rowid, watts) VALUES (?, ?, ?, ?)", rows)
+        conn.executemany("DELETE FROM best_efforts WHERE activity_id = ?", [(a,) for a, _ in orphans])
+        _forget_windows(conn, [r[1] for r in rows] + [d for _, d in orphans])
+    return len(rows) + len(orphans)
+
+
+def load_best_efforts(conn):
+    """Mejores esfuerzos por salida: DataFrame (fecha, una columna por duración) con NaN donde no hay dato."""
+    rows = conn.execute("SELECT activity_id, date, watts FROM best_efforts WHERE date != '' ORDER BY date").fetchall()
+    values = np.full((len(rows), len(DURATIONS)), np.nan)
+    for i, (_, _, watts) in enumerate(rows):
+        for d, p in json.loads(watts).items():
+            j = np.searchsorted(DURATIONS, int(d))
+            if j < len(DURATIONS) and DURATIONS[j] == int(d):
+                values[i, j] = p
+    df = pd.DataFrame(values, columns=DURATIONS, index=pd.to_datetime([r[1] for r in rows]))
+    df.index.name = 'date'
+    return df
+
+
+def window_bests(efforts, ends, window_days):
+    """Mejor marca de cada duración en los `window_days` días que terminan en cada fecha de `ends`.
+
+    Devuelve (matriz ventanas x duraciones, salidas por ventana).
+    """
+    ends = pd.DatetimeIndex(ends)
+    if efforts.empty or ends.empty:
+        return np.full((len(ends), len(DURATIONS)), np.nan), np.zeros(len(ends), dtype=int)
+    days = pd.date_range(min(efforts.index.min(), ends.min()), max(efforts.index.max(), ends.max()), freq='D')
+    daily = efforts.groupby(level=0).max().reindex(days)
+    counts = efforts.groupby(level=0).size().reindex(days, fill_value=0)
+    rolling = daily.rolling(window_days, min_periods=1).max().reindex(ends)
+    rides = counts.rolling(window_days, min_periods=1).sum().reindex(ends).fillna(0).astype(int)
+    return rolling.to_numpy(), rides.to_numpy()
+
+
+def _linear_fit(y, mask, x):
+    """Ajuste y = a + b·x por mínimos cuadrados para muchas series a la vez.
+
+    `y` y `mask` son (ventanas, duraciones); `x` es (duraciones,) o (rejilla, duraciones) y
+    entonces el resultado tiene forma (ventanas, rejilla). Devuelve (a, b, rmse, puntos).
+    """
+    x = np.atleast_2d(x)
+    m = mask.astype(float)
+    y0 = np.where(mask, y, 0.0)
+    n = m.sum(axis=1)[:, None]
+    sx, sxx = m @ x.T, m @ (x ** 2).T
+    sy, syy = y0.sum(axis=1)[:, None], (y0 ** 2).sum(axis=1)[:, None]
+    sxy = y0 @ x.T
+    det = n * sxx - sx ** 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        b = (n * sxy - sx * sy) / det
+        a = (sy - b * sx) / n
+        sse = syy - 2 * a * sy - 2 * b * sxy + n * a ** 2 + 2 * a * b * sx + b ** 2 * sxx
+        rmse = np.sqrt(np.maximum(sse, 0) / n)
+    valid = (n >= MIN_POINTS) & (np.abs(det) > 1e-12) & (a > 0) & (b > 0)
+    return np.where(valid, a, np.nan), np.where(valid, b, np.nan), np.where(valid, rmse, np.nan), n
+
+
+def fit_2p(bests):
+    """CP y W′ (J) de cada ventana con P = CP + W′/t. Devuelve un dict de arrays."""
+    use = (DURATIONS >= CP2_RANGE[0]) & (DURATIONS <= CP2_RANGE[1])
+    y = bests[:, use]
+    cp, w_prime, rmse, _ = _linear_fit(y, ~np.isnan(y), 1.0 / DURATIONS[use])
+    return {"cp": cp[:, 0], "w_prime": w_prime[:, 0], "p_max": np.full(len(bests), np.nan), "rmse": rmse[:, 0]}
+
+
+def fit_3p(bests):
+    """CP, W′ y Pmax de cada ventana con P = CP + W′/(t + k), eligiendo k en `K_GRID`."""
+    cp, w_prime, rmse, _ = _linear_fit(bests, ~np.isnan(bests), 1.0 / (DURATIONS[None, :] + K_GRID[:, None]))
+    best = np.argmin(np.where(np.isnan(rmse), np.inf, rmse), axis=1)
+    rows = np.arange(len(bests))
+    cp, w_prime, rmse = cp[rows, best], w_prime[rows, best], rmse[rows, best]
+    return {"cp": cp, "w_prime": w_prime, "p_max": cp + w_prime / K_GRID[best], "rmse": rmse}
+
+
+def model_power(fit, durations=DURATIONS):
+    """Curva de potencia del modelo ajustado (dict con cp, w_prime y p_max) en las duraciones dadas."""
+    durations = np.asarray(durations, dtype=float)
+    if not np.isfinite(fit.get("p_max") or np.nan):
+        return fit["cp"] + fit["w_prime"] / durations
+    k = fit["w_prime"] / (fit["p_max"] - fit["cp"])
+    return fit["cp"] + fit["w_prime"] / (durations + k)
+
+
+def window_ends(first, last):
+    """Domingos desde la semana de `first` hasta la de `last`."""
+    return pd.date_range(pd.Timestamp(first), pd.Timestamp(last) + pd.Timedelta(days=6), freq=WINDOW_FREQ)
+
+
+def cp_history(conn, window_days=90, model='2p', start=None, end=None):
+    """Ajustes por ventana (una fila por domingo) desde la tabla `cp_fits`, calculando solo los que faltan.
+
+    Devuelve un DataFrame indexado por fin de ventana con cp, w_prime (J), p_max, rmse y n_rides.
+    """
+    if model not in MODELS:
+        raise ValueError(f"Modelo desconocido: {model}")
+    update_best_efforts(conn)
+    first, last = conn.execute("SELECT MIN(date), MAX(date) FROM best_efforts WHERE date != ''").fetchone()
+    if not first:
+        return pd.DataFrame(columns=['cp', 'w_prime', 'p_max', 'rmse', 'n_rides'])
+    ends = window_ends(start or first, end or last)
+
+    cached = {r[0] for r in conn.execute("SELECT window_end FROM cp_fits WHERE model = ? AND window_days = ?", (model, window_days))}
+    missing = pd.DatetimeIndex([e for e in ends if e.strftime('%Y-%m-%d') not in cached])
+    if len(missing):
+        bests, rides = window_bests(load_best_efforts(conn), missing, window_days)
+        fits = (fit_2p if model == '2p' else fit_3p)(bests)
+        rows = [(model, window_days, e.strftime('%Y-%m-%d'), *(None if np.isnan(fits[c][i]) else float(fits[c][i]) for c in ('cp', 'w_prime', 'p_max', 'rmse')), int(rides[i]))
+                for i, e in enumerate(missing)]
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO cp_fits (model, window_days, window_end, cp, w_prime, p_max, rmse, n_rides) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    df = pd.read_sql_query(
+        "SELECT window_end, cp, w_prime, p_max, rmse, n_rides FROM cp_fits WHERE model = ? AND window_days = ? "
+        "AND window_end BETWEEN ? AND ? ORDER BY window_end",
+        conn, params=(model, window_days, ends.min().strftime('%Y-%m-%d'), ends.max().strftime('%Y-%m-%d')))
+    df['window_end'] = pd.to_datetime(df['window_end'])
+    return df.set_index('window_end').astype(float)
+
+
+def window_curve(conn, end, window_days=90):
+    """Mejores marcas por duración (Serie indexada en segundos) de la ventana que termina en `end`."""
+    bests, _ = window_bests(load_best_efforts(conn), [pd.Timestamp(end)], window_days)
+    return pd.Series(bests[0], index=DURATIONS).dropna()
@@ -0,0 +1,85 @@
+"""Perfilado opcional de cada ejecución de página con cProfile, guardado en disco con etiquetas."""
+import cProfile
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+from settings import DATA_DIR
+
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles")
+
+_local = threading.local()
+
+
+def sample_rate(secrets=None):
+    """Fracción de sesiones perfiladas: COACH_PROFILE_RATE o `PROFILE_RATE` en los secretos (0 = desactivado)."""
+    value = os.environ.get("COACH_PROFILE_RATE")
+    if value is None and secrets is not None:
+        value = secrets.get("PROFILE_RATE")
+    try:
+        return min(max(float(value or 0), 0.0), 1.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def keep_last():
+    return int(os.environ.get("COACH_PROFILE_KEEP", 50))
+
+
+def should_profile(session_state, rate):
+    """Decide una vez por sesión si se perfila, para que el coste recaiga solo en una muestra."""
+    if rate <= 0:
+        return False
+    if "_profile_sampled" not in session_state:
+        session_state["_profile_sampled"] = random.random() < rate
+    return session_state["_profile_sampled"]
+
+
+def start():
+    """Arranca el perfilador en el hilo del script. Devuelve None si no se puede (otro perfilador activo)."""
+    # Si la ejecución anterior terminó con st.stop() o una excepción, su perfilador sigue activo
+    leftover = getattr(_local, "profiler", None)
+    if leftover is not None:
+        leftover.disable()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None
+    _local.profiler = profiler
+    return {"profiler": profiler, "started": time.perf_counter()}
+
+
+def stop(handle, page, tags):
+    """Detiene el perfilador y guarda el perfil (.prof) y sus etiquetas (.json)."""
+    handle["profiler"].disable()
+    _local.profiler = None
+    wall_ms = (time.perf_counter() - handle["started"]) * 1000
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S_%f")
+    slug = re.sub(r"[^\w-]+", "_", page).strip("_") or "page"
+    base = os.path.join(PROFILE_DIR, f"{stamp}-{slug}")
+    handle["profiler"].dump_stats(f"{base}.prof")
+    with open(f"{base}.json", "w") as f:
+        json.dump({"page": page, "timestamp": stamp, "wall_ms": round(wall_ms, 1), **{k: str(v) for k, v in tags.items()}}, f, ensure_ascii=False)
+    prune(keep_last())
+    return f"{base}.prof"
+
+
+def prune(keep):
+    """Conserva solo los `keep` perfiles más recientes."""
+    try:
+        profiles = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith(".prof"))
+    except FileNotFoundError:
+        return
+    for name in profiles[:max(len(profiles) - keep, 0)]:
+        for ext in (".prof", ".json"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, name[:-5] + ext))
+            except FileNotFoundError:
+                pass
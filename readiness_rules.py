@@ -0,0 +1,215 @@
+"""Reglas de puntuación de readiness declarativas y por atleta, compiladas a un evaluador vectorizado.
+
+Las reglas son un dict JSON que se guarda en `readiness_rules.json` dentro del directorio del atleta:
+
+    {"signals": [{"name": "hrv", "column": "hrv", "label": "VFC (HRV)", "unit": "ms", "decimals": 1,
+                  "direction": "higher", "baseline": {"window": 28},
+                  "bands": [[0.5, 45], [-0.75, 30], [-1.0, 15]], "normal_range": [-0.75, 0.5]}, ...],
+     "levels": [[80, "green"], [60, "yellow"]], "default_level": "red"}
+
+Cada señal suma los puntos de la primera banda (umbral, puntos) que cumple: con `direction` "higher"
+el valor debe ser mayor o igual que el umbral y con "lower", menor o igual. Si la señal tiene
+`baseline`, los umbrales son desviaciones típicas respecto a la media de los `window` días anteriores
+(y `normal_range` es el rango que se muestra en el desglose); si no, son valores absolutos.
+
+`compile_rules` valida las reglas una sola vez y devuelve un `Evaluator` que puntúa todos los días de
+un DataFrame de bienestar con operaciones sobre columnas, así que se pueden volver a puntuar años de
+historial con otras reglas en milisegundos.
+"""
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from settings import athlete_dir
+
+DEFAULT_RULES = {
+    "signals": [
+        {"name": "hrv", "column": "hrv", "label": "VFC (HRV)", "unit": "ms", "decimals": 1, "direction": "higher",
+         "baseline": {"window": 28}, "bands": [[0.5, 45], [-0.75, 30], [-1.0, 15]], "normal_range": [-0.75, 0.5]},
+        {"name": "restingHR", "column": "restingHR", "label": "FC Reposo", "unit": "bpm", "decimals": 0, "direction": "lower",
+         "bands": [[45, 35], [48, 25], [52, 10]]},
+        {"name": "sleepScore", "column": "sleepScore", "label": "P. Sueño", "unit": "", "decimals": 0, "direction": "higher",
+         "bands": [[80, 20], [70, 10]]},
+    ],
+    "levels": [[80, "green"], [60, "yellow"]],
+    "default_level": "red",
+}
+DIRECTIONS = ('higher', 'lower')
+
+MAX_COMPILED = 64  # Evaluadores en memoria (al ajustar reglas se compila uno por cada cambio)
+
+_compiled = OrderedDict()  # versión de las reglas -> Evaluator
+_loaded = {}  # ruta -> (mtime, reglas)
+_lock = threading.Lock()
+
+
+def version(rules):
+    """Identificador corto del contenido de unas reglas (sirve como clave de caché)."""
+    return hashlib.sha1(json.dumps(rules, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def validate(rules):
+    """Comprueba la estructura de unas reglas. Lanza ValueError con el primer problema encontrado."""
+    if not isinstance(rules, dict) or not isinstance(rules.get("signals"), list) or not rules["signals"]:
+        raise ValueError("Las reglas necesitan una lista `signals` no vacía.")
+    names = set()
+    for signal in rules["signals"]:
+        name = signal.get("name")
+        if not name or name in names:
+            raise ValueError(f"Nombre de señal vacío o repetido: {name!r}")
+        names.add(name)
+        if signal.get("direction") not in DIRECTIONS:
+            raise ValueError(f"{name}: `direction` debe ser uno de {DIRECTIONS}.")
+        bands = signal.get("bands")
+        if not bands or any(len(b) != 2 or not all(isinstance(x, (int, float)) for x in b) for b in bands):
+            raise ValueError(f"{name}: `bands` debe ser una lista de pares [umbral, puntos].")
+        baseline = signal.get("baseline")
+        if baseline is not None and (not isinstance(baseline.get("window"), int) or baseline["window"] < 2):
+            raise ValueError(f"{name}: la ventana de la línea basal debe ser un entero >= 2.")
+    levels = rules.get("levels") or []
+    if any(len(l) != 2 or not isinstance(l[0], (int, float)) or not isinstance(l[1], str) for l in levels):
+        raise ValueError("`levels` debe ser una lista de pares [puntuación mínima, nivel].")
+    return rules
+
+
+class Evaluator:
+    """Reglas compiladas: umbrales y puntos como arrays ordenados de la banda más exigente a la menos."""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.signals = []
+        for signal in rules["signals"]:
+            higher = signal["direction"] == 'higher'
+            bands = sorted(signal["bands"], key=lambda b: b[0], reverse=higher)
+            self.signals.append({
+                **signal,
+                "column": signal.get("column", signal["name"]),
+                "higher": higher,
+                "thresholds": np.array([b[0] for b in bands], dtype=float),
+                "points": np.array([b[1] for b in bands], dtype=float),
+                "window": (signal.get("baseline") or {}).get("window"),
+            })
+        levels = sorted(rules.get("levels") or [], key=lambda l: l[0], reverse=True)
+        self.level_thresholds = np.array([l[0] for l in levels], dtype=float)
+        self.level_names = [l[1] for l in levels]
+        self.default_level = rules.get("default_level", "red")
+
+    def score(self, df):
+        """Puntuación de cada día de `df` (indexado por día, en orden).
+
+        Devuelve un DataFrame con `score`, `level` y, por señal, `<señal>_value`, `<señal>_points`
+        (NaN si la señal no puntúa ese día) y, para las relativas, `<señal>_mean` y `<señal>_std`.
+        """
+        n = len(df)
+        out, total = {}, np.zeros(n)
+        for signal in self.signals:
+            column = signal["column"]
+            series = df[column].astype(float) if column in df.columns else pd.Series(np.nan, index=df.index)
+            values = series.to_numpy()
+            if signal["window"]:
+                # Media y desviación de los `window` días anteriores (sin incluir el propio día)
+                mean = series.rolling(signal["window"], min_periods=1).mean().shift(1).to_numpy()
+                std = series.rolling(signal["window"], min_periods=1).std().shift(1).to_numpy()
+                thresholds = mean[:, None] + std[:, None] * signal["thresholds"][None, :]
+                valid = ~np.isnan(values) & ~np.isnan(mean) & ~np.isnan(std)
+                out[f"{signal['name']}_mean"], out[f"{signal['name']}_std"] = mean, std
+            else:
+                thresholds = np.broadcast_to(signal["thresholds"], (n, len(signal["thresholds"])))
+                valid = ~np.isnan(values)
+            with np.errstate(invalid='ignore'):
+                hit = values[:, None] >= thresholds if signal["higher"] else values[:, None] <= thresholds
+            points = np.where(hit.any(axis=1), signal["points"][hit.argmax(axis=1)], 0.0)
+            points = np.where(valid, points, np.nan)
+            total += np.nan_to_num(points)
+            out[f"{signal['name']}_value"], out[f"{signal['name']}_points"] = values, points
+
+        out["score"] = total
+        out["level"] = np.select([total >= t for t in self.level_thresholds], self.level_names, default=self.default_level) \
+            if len(self.level_names) else np.full(n, self.default_level)
+        return pd.DataFrame(out, index=df.index)
+
+    def breakdown(self, scored, day):
+        """Desglose de un día ya puntuado: una entrada por señal que puntúa."""
+        row = scored.loc[day]
+        items = []
+        for signal in self.signals:
+            name = signal["name"]
+            if pd.isna(row[f"{name}_points"]):
+                continue
+            item = {"signal": name, "label": signal.get("label", name), "unit": signal.get("unit", ""),
+                    "decimals": signal.get("decimals", 0), "value": float(row[f"{name}_value"]),
+                    "points": int(row[f"{name}_points"]) if float(row[f"{name}_points"]).is_integer() else float(row[f"{name}_points"])}
+            if signal["window"] and signal.get("normal_range"):
+                low, high = signal["normal_range"]
+                mean, std = row[f"{name}_mean"], row[f"{name}_std"]
+                item["normal_range"] = [float(mean + low * std), float(mean + high * std)]
+            items.append(item)
+        return items
+
+
+def compile_rules(rules=None):
+    """Evaluador de unas reglas (por defecto, las de `DEFAULT_RULES`), compilado una sola vez por contenido."""
+    rules = rules or DEFAULT_RULES
+    key = version(rules)
+    with _lock:
+        evaluator = _compiled.get(key)
+        if evaluator is not None:
+            _compiled.move_to_end(key)
+            return evaluator
+    evaluator = Evaluator(validate(copy.deepcopy(rules)))
+    with _lock:
+        _compiled[key] = evaluator
+        while len(_compiled) > MAX_COMPILED:
+            _compiled.popitem(last=False)
+    return evaluator
+
+
+def _rules_path(athlete_id):
+    return os.path.join(athlete_dir(athlete_id), "readiness_rules.json")
+
+
+def load_rules(athlete_id):
+    """Reglas del atleta (o las de por defecto). Solo se vuelve a leer el fichero si ha cambiado."""
+    if not athlete_id:
+        return DEFAULT_RULES
+    path = _rules_path(athlete_id)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return DEFAULT_RULES
+    with _lock:
+        cached = _loaded.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(path) as f:
+            rules = validate(json.load(f))
+    except (json.JSONDecodeError, ValueError):
+        return DEFAULT_RULES
+    with _lock:
+        _loaded[path] = (mtime, rules)
+    return rules
+
+
+def save_rules(athlete_id, rules):
+    """Valida y guarda las reglas del atleta de forma atómica."""
+    validate(rules)
+    path = _rules_path(athlete_id)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(rules, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def reset_rules(athlete_id):
+    """Vuelve a las reglas por defecto borrando las del atleta."""
+    try:
+        os.remove(_rules_path(athlete_id))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,211 @@
+"""Resúmenes materializados por semana ISO (lunes a domingo) y por mes en el almacén local.
+
+Cada vez que se sincronizan días nuevos se recalculan solo las semanas y meses que los contienen,
+de modo que las páginas leen una fila por semana en lugar de agregar los datos diarios en cada visita.
+Los meses reflejan lo que haya en el almacén: quedan completos tras una carga con `backfill.py`.
+"""
+import json
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import local_store
+from local_store import ROLLUP_COLUMNS
+
+KINDS = ('week', 'month')
+TABLES = {'week': 'weekly_rollups', 'month': 'monthly_rollups'}
+N_ZONES = 7
+WEIGHT_TRAINING_TSS = 10  # Las sesiones de fuerza cuentan con un TSS fijo
+RECENT_DAYS = 2  # Las semanas que incluyen estos últimos días pueden cambiar todavía
+
+
+def _as_date(day):
+    return date.fromisoformat(day[:10]) if isinstance(day, str) else pd.Timestamp(day).date()
+
+
+def week_key(day):
+    year, week, _ = _as_date(day).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def month_key(day):
+    day = _as_date(day)
+    return f"{day.year}-{day.month:02d}"
+
+
+def period_bounds(kind, day):
+    """Primer y último día del periodo que contiene `day`."""
+    day = _as_date(day)
+    if kind == 'week':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    start = day.replace(day=1)
+    return start, (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+
+def periods(kind, start, end):
+    """[(clave, primer día, último día)] de los periodos que se solapan con [start, end]."""
+    result = []
+    current, end = period_bounds(kind, start)[0], _as_date(end)
+    while current <= end:
+        p_start, p_end = period_bounds(kind, current)
+        result.append((week_key(p_start) if kind == 'week' else month_key(p_start), p_start, p_end))
+        current = p_end + timedelta(days=1)
+    return result
+
+
+def _keys(kind, dates):
+    """Clave de periodo para cada fecha de un índice o serie de fechas."""
+    dates = pd.DatetimeIndex(dates)
+    if kind == 'week':
+        iso = dates.isocalendar()
+        return (iso['year'].astype(str) + '-W' + iso['week'].astype(str).str.zfill(2)).to_numpy()
+    return np.asarray(dates.strftime('%Y-%m'))
+
+
+def _zone_row(zones, power):
+    row = np.zeros(N_ZONES)
+    if not isinstance(zones, list):
+        return row
+    for i, zone in enumerate(zones):
+        if power:
+            # Las zonas de potencia llegan como [{'id': 'Z1', 'secs': ...}, ...] (más SS, etc., que se ignoran)
+            zone_id = zone.get('id') if isinstance(zone, dict) else None
+            if isinstance(zone_id, str) and zone_id[1:].isdigit() and zone_id.startswith('Z') and 1 <= int(zone_id[1:]) <= N_ZONES:
+                row[int(zone_id[1:]) - 1] += zone.get('secs') or 0
+        elif i < N_ZONES:
+            row[i] = zone or 0
+    return row
+
+
+def _activity_frame(records):
+    """Columnas numéricas que intervienen en los resúmenes, una fila por actividad."""
+    def numeric(column):
+        return pd.to_numeric(pd.Series([a.get(column) for a in records], dtype=object), errors='coerce')
+
+    tss = numeric('icu_training_load').fillna(0)
+    tss = tss.where(pd.Series([a.get('type') for a in records], dtype=object) != 'WeightTraining', WEIGHT_TRAINING_TSS)
+    power_norm, power_avg, hr_avg, power_hr_z2 = (numeric(c) for c in ('icu_weighted_avg_watts', 'icu_average_watts', 'average_heartrate', 'icu_power_hr_z2'))
+    frame = pd.DataFrame({
+        'date': pd.to_datetime([(a.get('start_date_local') or '')[:10] or None for a in records]),
+        'activities': 1,
+        'tss': tss,
+        'moving_time': numeric('moving_time').fillna(0),
+        'efficiency': (power_norm / hr_avg).where((hr_avg > 0) & (power_norm > 0)),
+        'power_hr': (power_avg / hr_avg).where((hr_avg > 0) & (power_avg > 0)),
+        'power_hr_z2': power_hr_z2.where(power_hr_z2 > 0),
+    })
+    hr_zones = np.array([_zone_row(a.get('icu_hr_zone_times'), False) for a in records]).reshape(-1, N_ZONES)
+    power_zones = np.array([_zone_row(a.get('icu_zone_times'), True) for a in records]).reshape(-1, N_ZONES)
+    valid = frame['date'].notna().to_numpy()
+    return frame[valid], hr_zones[valid], power_zones[valid]
+
+
+def compute(conn, kind, start, end):
+    """Filas de resumen de todos los periodos que se solapan con [start, end], calculadas desde el almacén."""
+    span = periods(kind, start, end)
+    if not span:
+        return []
+    keys = [key for key, _, _ in span]
+    wellness = local_store.load_wellness(conn, span[0][1], span[-1][2])
+    activities, hr_zones, power_zones = _activity_frame(local_store.load_activities(conn, span[0][1], span[-1][2], raw=True))
+
+    w_keys = _keys(kind, wellness.index)
+    means = (wellness[['restingHR', 'hrv', 'sleepScore', 'BodyBatteryMax', 'ctl', 'atl']]
+             .groupby(w_keys).mean().reindex(keys))
+    # Los mínimos de Body Battery a 0 son días sin dato, no valores reales
+    body_battery_min = wellness['BodyBatteryMin'].where(wellness['BodyBatteryMin'] > 0).groupby(w_keys).mean().reindex(keys)
+    days = wellness.groupby(w_keys).size().reindex(keys, fill_value=0)
+    # CTL/ATL del último día con datos del periodo (el domingo en las semanas ya cerradas)
+    load = wellness[['ctl', 'atl']].dropna()
+    at_end = load.groupby(_keys(kind, load.index)).last().reindex(keys)
+
+    a_keys = _keys(kind, activities['date'])
+    sums = activities[['activities', 'tss', 'moving_time']].groupby(a_keys).sum().reindex(keys, fill_value=0)
+    ratios = activities[['efficiency', 'power_hr', 'power_hr_z2']].groupby(a_keys).mean().reindex(keys)
+    hr_totals = pd.DataFrame(hr_zones).groupby(a_keys).sum().reindex(keys, fill_value=0)
+    power_totals = pd.DataFrame(power_zones).groupby(a_keys).sum().reindex(keys, fill_value=0)
+
+    table = pd.DataFrame({
+        'wellness_days': days,
+        'activities': sums['activities'],
+        'tss': sums['tss'],
+        'moving_time': sums['moving_time'],
+        'rhr': means['restingHR'],
+        'hrv': means['hrv'],
+        'sleep_score': means['sleepScore'],
+        'body_battery_max': means['BodyBatteryMax'],
+        'body_battery_min': body_battery_min,
+        'ctl': means['ctl'],
+        'atl': means['atl'],
+        'ctl_end': at_end['ctl'],
+        'atl_end': at_end['atl'],
+        'tsb_end': at_end['ctl'] - at_end['atl'],
+        'efficiency': ratios['efficiency'],
+        'power_hr': ratios['power_hr'],
+        'power_hr_z2': ratios['power_hr_z2'],
+    }, index=keys).astype(float)
+    table = table.astype(object).where(table.notna(), None)
+
+    rows = []
+    for (key, p_start, p_end), values, hr, power in zip(span, table.itertuples(index=False), hr_totals.to_numpy(), power_totals.to_numpy()):
+        rows.append((key, p_start.isoformat(), p_end.isoformat(), *values, json.dumps(hr.tolist()), json.dumps(power.tolist())))
+    return rows
+
+
+def refresh(conn, start, end):
+    """Recalcula los resúmenes semanales y mensuales que se solapan con [start, end] (sin confirmar la transacción)."""
+    columns = ['period', 'period_start', 'period_end', *ROLLUP_COLUMNS]
+    for kind in KINDS:
+        conn.executemany(f"INSERT OR REPLACE INTO {TABLES[kind]} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                         compute(conn, kind, start, end))
+
+
+def rebuild(conn):
+    """Recalcula todos los resúmenes desde cero (p. ej., en un almacén creado antes de que existieran)."""
+    first, last = conn.execute(
+        "SELECT MIN(date), MAX(date) FROM (SELECT date FROM wellness UNION ALL SELECT date FROM activities WHERE date != '')"
+    ).fetchone()
+    with conn:
+        for table in TABLES.values():
+            conn.execute(f"DELETE FROM {table}")
+        if first:
+            refresh(conn, first, last)
+    return first, last
+
+
+def stale_range(conn, start, end, max_age=3600):
+    """Días [primero, último] que hay que sincronizar para tener al día las semanas de [start, end].
+
+    Faltan las semanas sin resumen y las que incluyen días recientes con un resumen de hace más de
+    `max_age` segundos. Devuelve None si todo está al día.
+    """
+    span = periods('week', start, end)
+    fresh = dict(conn.execute(
+        "SELECT period, updated_at >= datetime('now', ?) FROM weekly_rollups WHERE period_end >= ? AND period_start <= ?",
+        (f"-{int(max_age)} seconds", span[0][1].isoformat(), span[-1][2].isoformat())).fetchall()) if span else {}
+    recent = date.today() - timedelta(days=RECENT_DAYS)
+    pending = [(p_start, p_end) for key, p_start, p_end in span if key not in fresh or (p_end >= recent and not fresh[key])]
+    return (pending[0][0], pending[-1][1]) if pending else None
+
+
+def load(conn, kind, start, end):
+    """Resúmenes de los periodos que se solapan con [start, end], indexados por clave de periodo."""
+    df = pd.read_sql_query(
+        f"SELECT period, period_start, period_end, {', '.join(ROLLUP_COLUMNS)}, updated_at FROM {TABLES[kind]} "
+        "WHERE period_end >= ? AND period_start <= ? ORDER BY period_start",
+        conn, params=(str(_as_date(start)), str(_as_date(end))))
+    for column in ('hr_zone_times', 'power_zone_times'):
+        df[column] = df[column].map(json.loads)
+    for column in ('period_start', 'period_end'):
+        df[column] = pd.to_datetime(df[column])
+    return df.set_index('period')
+
+
+def load_weekly(conn, start, end):
+    return load(conn, 'week', start, end)
+
+
+def load_monthly(conn, start, end):
+    return load(conn, 'month', start, end)
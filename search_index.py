@@ -0,0 +1,158 @@
+"""Índice de búsqueda sobre las actividades realizadas y los entrenamientos del calendario del almacén local.
+
+Cada actividad o evento es un documento de `search_docs` con sus campos filtrables (fecha, tipo,
+duración, TSS, IF, NP) indexados, y su nombre y descripción en un índice de texto FTS5 que se
+mantiene con disparadores. Los `upsert_*` de `local_store` actualizan el índice en la misma
+transacción, así que nunca hay que reconstruirlo salvo en almacenes creados antes de que existiera
+(eso lo hace `ensure_index` la primera vez). Si SQLite no trae FTS5 se busca con LIKE.
+"""
+import json
+import re
+import sqlite3
+
+import pandas as pd
+
+KIND_ACTIVITY, KIND_EVENT = 'activity', 'event'
+# Campos numéricos por los que se puede filtrar con un rango (mínimo, máximo)
+NUMERIC_FIELDS = ('duration', 'tss', 'intensity', 'np')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_docs (
+    key TEXT PRIMARY KEY, kind TEXT, ref_id TEXT, date TEXT, type TEXT, category TEXT, name TEXT, description TEXT,
+    duration REAL, tss REAL, intensity REAL, np REAL
+);
+CREATE INDEX IF NOT EXISTS search_docs_date ON search_docs(date);
+CREATE INDEX IF NOT EXISTS search_docs_type_date ON search_docs(type, date);
+CREATE INDEX IF NOT EXISTS search_docs_intensity ON search_docs(intensity);
+CREATE INDEX IF NOT EXISTS search_docs_tss ON search_docs(tss);
+"""
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS search_text USING fts5(
+    name, description, content='search_docs', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS search_docs_ai AFTER INSERT ON search_docs BEGIN
+    INSERT INTO search_text(rowid, name, description) VALUES (new.rowid, new.name, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS search_docs_ad AFTER DELETE ON search_docs BEGIN
+    INSERT INTO search_text(search_text, rowid, name, description) VALUES ('delete', old.rowid, old.name, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS search_docs_au AFTER UPDATE ON search_docs BEGIN
+    INSERT INTO search_text(search_text, rowid, name, description) VALUES ('delete', old.rowid, old.name, old.description);
+    INSERT INTO search_text(rowid, name, description) VALUES (new.rowid, new.name, new.description);
+END;
+"""
+_COLUMNS = ('key', 'kind', 'ref_id', 'date', 'type', 'category', 'name', 'description', 'duration', 'tss', 'intensity', 'np')
+_UPSERT = (f"INSERT INTO search_docs ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))}) "
+           f"ON CONFLICT(key) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in _COLUMNS[1:])}")
+
+
+def _has_table(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+
+def ensure_index(conn):
+    """Crea el índice si no existe y, si es nuevo, lo llena con lo que ya hay en el almacén."""
+    if _has_table(conn, 'search_docs'):
+        return
+    with conn:
+        conn.executescript(SCHEMA)
+        try:
+            conn.executescript(FTS_SCHEMA)
+        except sqlite3.OperationalError:
+            pass  # SQLite sin FTS5: `search` usará LIKE
+        index_activities(conn, [json.loads(r[0]) for r in conn.execute("SELECT raw FROM activities")])
+        index_events(conn, [json.loads(r[0]) for r in conn.execute("SELECT raw FROM events")])
+
+
+def _number(value, scale=1.0):
+    return float(value) / scale if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def _activity_doc(a):
+    return (f"a:{a['id']}", KIND_ACTIVITY, str(a['id']), (a.get('start_date_local') or '')[:10], a.get('type'), None,
+            a.get('name'), a.get('description'), _number(a.get('moving_time')), _number(a.get('icu_training_load')),
+            _number(a.get('icu_intensity'), 100), _number(a.get('icu_weighted_avg_watts')))
+
+
+def _event_doc(e):
+    return (f"e:{e['id']}", KIND_EVENT, str(e['id']), (e.get('start_date_local') or '')[:10], e.get('type'), e.get('category'),
+            e.get('name'), e.get('description'), _number(e.get('moving_time')), _number(e.get('icu_training_load')),
+            _number(e.get('icu_intensity'), 100), None)
+
+
+def index_activities(conn, records):
+    """Añade o actualiza actividades en el índice (no-op si el índice aún no existe)."""
+    if _has_table(conn, 'search_docs'):
+        conn.executemany(_UPSERT, [_activity_doc(a) for a in records if a.get('id')])
+
+
+def index_events(conn, records):
+    if _has_table(conn, 'search_docs'):
+        conn.executemany(_UPSERT, [_event_doc(e) for e in records if e.get('id')])
+
+
+def remove_activities(conn, activity_ids):
+    if _has_table(conn, 'search_docs'):
+        conn.executemany("DELETE FROM search_docs WHERE key = ?", [(f"a:{i}",) for i in activity_ids])
+
+
+def _match_expression(text):
+    """Texto libre -> expresión FTS5: cada palabra como prefijo y todas obligatorias."""
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def search(conn, text=None, kinds=None, types=None, start=None, end=None, ranges=None, order='date', limit=500):
+    """Busca en el índice. Devuelve un DataFrame con una fila por documento.
+
+    `text` se busca en nombre y descripción (sin distinguir mayúsculas ni tildes), `types` y `kinds`
+    son listas de valores admitidos y `ranges` es {campo: (mínimo, máximo)} sobre NUMERIC_FIELDS,
+    con None para no limitar un extremo. `order` es 'date' (más recientes primero) o 'relevance'.
+    """
+    ensure_index(conn)
+    where, params, source, rank = [], [], "search_docs d", "d.date DESC"
+    if text and text.strip():
+        if _has_table(conn, 'search_text') and _match_expression(text):
+            # CROSS JOIN fija el orden: primero la consulta de texto y luego los documentos por rowid
+            # (si no, SQLite puede repetir la consulta FTS por cada fila del rango de fechas)
+            source = "search_text CROSS JOIN search_docs d ON d.rowid = search_text.rowid"
+            where.append("search_text MATCH ?")
+            params.append(_match_expression(text))
+            if order == 'relevance':
+                rank = "bm25(search_text), d.date DESC"
+        else:
+            where.append("(d.name LIKE ? OR d.description LIKE ?)")
+            params += [f"%{text.strip()}%"] * 2
+    for column, values in (('kind', kinds), ('type', types)):
+        if values:
+            where.append(f"d.{column} IN ({', '.join('?' * len(values))})")
+            params += list(values)
+    if start:
+        where.append("d.date >= ?")
+        params.append(str(start))
+    if end:
+        where.append("d.date <= ?")
+        params.append(str(end))
+    for field, (low, high) in (ranges or {}).items():
+        if field not in NUMERIC_FIELDS:
+            raise ValueError(f"Campo desconocido: {field}")
+        if low is not None:
+            where.append(f"d.{field} >= ?")
+            params.append(low)
+        if high is not None:
+            where.append(f"d.{field} <= ?")
+            params.append(high)
+
+    sql = (f"SELECT d.kind, d.ref_id, d.date, d.type, d.category, d.name, d.description, d.duration, d.tss, d.intensity, d.np "
+           f"FROM {source} {'WHERE ' + ' AND '.join(where) if where else ''} ORDER BY {rank} LIMIT ?")
+    df = pd.read_sql_query(sql, conn, params=[*params, int(limit)])
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    return df
+
+
+def facets(conn):
+    """Valores disponibles para los filtros: tipos, primer y último día indexados y número de documentos."""
+    ensure_index(conn)
+    types = [r[0] for r in conn.execute("SELECT DISTINCT type FROM search_docs WHERE type IS NOT NULL ORDER BY type")]
+    first, last, count = conn.execute("SELECT MIN(NULLIF(date, '')), MAX(date), COUNT(*) FROM search_docs").fetchone()
+    return {"types": types, "first": first, "last": last, "count": count}
@@ -0,0 +1,40 @@
+"""Configuración compartida por las páginas y las herramientas de línea de comandos."""
+import os
+
+# Directorio donde se guardan los datos locales (estado de detectores, almacén histórico, etc.)
+DATA_DIR = os.environ.get("COACH_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+
+# Memoria máxima (MB) de cada caché de datos en memoria
+CACHE_MAX_MB = float(os.environ.get("COACH_CACHE_MB", 64))
+
+# Secreto compartido que deben incluir las notificaciones que recibe `ingest.py` (vacío = sin comprobar,
+# solo permitido si el receptor escucha en la propia máquina)
+WEBHOOK_SECRET = os.environ.get("COACH_WEBHOOK_SECRET", "")
+
+
+def athlete_dir(athlete_id):
+    """Directorio de datos locales de un atleta (se crea si no existe)."""
+    path = os.path.join(DATA_DIR, str(athlete_id))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def load_credentials():
+    """Credenciales de Intervals.icu para las herramientas que no corren dentro de Streamlit.
+
+    Se leen de las variables de entorno INTERVALS_ATHLETE_ID / INTERVALS_API_KEY o,
+    si no existen, del mismo `.streamlit/secrets.toml` que usan las páginas.
+    """
+    athlete_id = os.environ.get("INTERVALS_ATHLETE_ID")
+    api_key = os.environ.get("INTERVALS_API_KEY")
+    if athlete_id and api_key:
+        return athlete_id, api_key
+
+    import tomllib
+    secrets_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".streamlit", "secrets.toml")
+    try:
+        with open(secrets_path, "rb") as f:
+            secrets = tomllib.load(f)
+        return secrets["ATHLETE_ID"], secrets["API_KEY"]
+    except (FileNotFoundError, KeyError):
+        raise RuntimeError("No se han encontrado las credenciales (INTERVALS_ATHLETE_ID / INTERVALS_API_KEY o .streamlit/secrets.toml).")
@@ -0,0 +1,131 @@
+"""Búsqueda de las salidas del historial más parecidas a una dada (vecinos más cercanos).
+
+Cada salida se resume en un vector de características (duración, TSS, IF, reparto del tiempo en
+zonas de potencia, estructura de series, eficiencia NP/FC y desacoplamiento). El desacoplamiento es
+el que calcula `decoupling` en local (configuración por defecto) si ya está en el almacén, el mismo
+que muestra la página de eficiencia, y si no el que da Intervals.icu. Los vectores se estandarizan
+con la mediana y la desviación típica del historial, se ponderan por grupo y se indexan en un
+KD-tree, así que cada consulta cuesta milisegundos aunque haya miles de salidas. El índice se guarda
+en memoria por almacén y se reconstruye solo cuando cambian sus actividades o sus desacoplamientos.
+"""
+import json
+import threading
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import decoupling
+
+RIDE_TYPES = ('Ride', 'VirtualRide')
+N_ZONES = 7
+MIN_WORK_SECS = 120  # Misma definición de serie de trabajo que el análisis de intervalos
+FEATURES = (['duration_h', 'tss', 'if'] + [f'z{i}_share' for i in range(1, N_ZONES + 1)]
+            + ['work_intervals', 'work_share', 'work_interval_min', 'efficiency', 'decoupling'])
+# Peso de cada característica tras estandarizar; las zonas se reparten un peso conjunto
+WEIGHTS = np.array([1.0, 1.0, 1.5] + [1.5 / np.sqrt(N_ZONES)] * N_ZONES + [1.0, 1.0, 1.0, 0.5, 0.5])
+
+_indexes = {}  # ruta del almacén -> (firma, índice)
+_lock = threading.Lock()
+
+
+def _num(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan
+
+
+def feature_vector(activity, local_decoupling=None):
+    """Vector de características de una actividad de Intervals.icu (NaN donde falta el dato).
+
+    `local_decoupling` (Pa:HR calculado en local), si se indica, sustituye al campo `decoupling` de la API.
+    """
+    moving = _num(activity.get('moving_time'))
+    zones = np.zeros(N_ZONES)
+    for zone in activity.get('icu_zone_times') or []:
+        zone_id = zone.get('id') if isinstance(zone, dict) else None
+        if isinstance(zone_id, str) and zone_id.startswith('Z') and zone_id[1:].isdigit() and 1 <= int(zone_id[1:]) <= N_ZONES:
+            zones[int(zone_id[1:]) - 1] += zone.get('secs') or 0
+    shares = zones / zones.sum() if zones.sum() > 0 else np.full(N_ZONES, np.nan)
+
+    work = [_num(i.get('duration')) for i in activity.get('intervals') or []
+            if i.get('type') == 'WORK' and (i.get('duration') or 0) > MIN_WORK_SECS]
+    power, hr = _num(activity.get('icu_weighted_avg_watts')), _num(activity.get('average_heartrate'))
+    return np.array([
+        moving / 3600,
+        _num(activity.get('icu_training_load')),
+        _num(activity.get('icu_intensity')) / 100,
+        *shares,
+        len(work),
+        sum(work) / moving if work and moving > 0 else 0.0,
+        np.mean(work) / 60 if work else 0.0,
+        power / hr if hr > 0 and power > 0 else np.nan,
+        _num(local_decoupling if local_decoupling is not None else activity.get('decoupling')),
+    ])
+
+
+def build_index(activities, local_decoupling=None):
+    """Índice de vecinos sobre una lista de actividades (solo salidas en bici).
+
+    `local_decoupling` es {id de actividad: Pa:HR calculado en local} para las que lo tengan.
+    """
+    local_decoupling = local_decoupling or {}
+    rides = [a for a in activities if a.get('type') in RIDE_TYPES and a.get('id')]
+    matrix = np.array([feature_vector(a, local_decoupling.get(str(a['id']))) for a in rides]).reshape(-1, len(FEATURES))
+    center = np.nanmedian(matrix, axis=0) if len(rides) else np.zeros(len(FEATURES))
+    center = np.where(np.isnan(center), 0.0, center)
+    scale = np.nanstd(matrix, axis=0) if len(rides) else np.ones(len(FEATURES))
+    scale = np.where(np.isnan(scale) | (scale < 1e-9), 1.0, scale)
+    points = _scaled(matrix, center, scale)
+    return {
+        "ids": [str(a['id']) for a in rides],
+        "dates": np.array([(a.get('start_date_local') or '')[:10] for a in rides]),
+        "activities": {str(a['id']): a for a in rides},
+        "decoupling": local_decoupling,
+        "features": matrix,
+        "center": center,
+        "scale": scale,
+        "tree": cKDTree(points) if len(rides) else None,
+    }
+
+
+def _scaled(matrix, center, scale):
+    """Estandariza y pondera; los datos que faltan se colocan en la mediana (aportan distancia 0)."""
+    matrix = np.where(np.isnan(matrix), center, matrix)
+    return (matrix - center) / scale * WEIGHTS
+
+
+def index_for_store(conn):
+    """Índice de las salidas guardadas en el almacén, reconstruido solo si han cambiado."""
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    _, key = decoupling.params_key()
+    signature = conn.execute("SELECT COUNT(*), MAX(rowid) FROM activities").fetchone() + \
+        conn.execute("SELECT COUNT(*), MAX(rowid) FROM decoupling WHERE params = ?", (key,)).fetchone()
+    with _lock:
+        cached = _indexes.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+    rows = conn.execute(f"SELECT raw FROM activities WHERE type IN ({', '.join('?' * len(RIDE_TYPES))})", RIDE_TYPES).fetchall()
+    local = dict(conn.execute("SELECT activity_id, pa_hr FROM decoupling WHERE params = ? AND pa_hr IS NOT NULL", (key,)))
+    index = build_index([json.loads(r[0]) for r in rows], local)
+    with _lock:
+        _indexes[path] = (signature, index)
+    return index
+
+
+def most_similar(index, activity, k=5, before=None):
+    """Las `k` salidas más parecidas a `activity` (excluida ella misma), anteriores a `before` si se indica.
+
+    Devuelve [(actividad, distancia)] de la más a la menos parecida.
+    """
+    if index["tree"] is None:
+        return []
+    own_id, n = str(activity.get('id')), len(index["ids"])
+    point = _scaled(feature_vector(activity, index["decoupling"].get(own_id))[None, :], index["center"], index["scale"])[0]
+    wanted = min(k * 4 + 1, n)
+    while True:
+        distances, positions = index["tree"].query(point, k=wanted)
+        distances, positions = np.atleast_1d(distances), np.atleast_1d(positions)
+        keep = [(p, d) for p, d in zip(positions, distances)
+                if index["ids"][p] != own_id and (before is None or index["dates"][p] < str(before))]
+        # Si el filtro por fecha deja pocas, se amplía la búsqueda hasta recorrer todo el índice
+        if len(keep) >= k or wanted >= n:
+            return [(index["activities"][index["ids"][p]], float(d)) for p, d in keep[:k]]
+        wanted = min(wanted * 4, n)
@@ -0,0 +1,153 @@
+"""Formato de archivo compacto para los streams segundo a segundo de una actividad.
+
+Estructura del blob:
+    b"CSA1" | longitud de la cabecera (uint32) | cabecera JSON | bloques comprimidos
+
+Cada canal (watts, heartrate, ...) se divide en bloques de `chunk_size` muestras. En cada bloque
+los valores (escalados a enteros) se guardan como diferencias con la muestra anterior usando el
+entero más pequeño que las contiene, y el bloque se comprime con zlib. La cabecera guarda para cada
+bloque su posición, tamaño, primer valor y tipo, de modo que una ventana de tiempo se decodifica
+descomprimiendo solo los bloques que la cubren.
+"""
+import json
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b"CSA1"
+DEFAULT_CHUNK = 1024
+# Factor para convertir cada canal a enteros (velocidad con 2 decimales, distancia con 1)
+CHANNEL_SCALES = {'time': 1, 'watts': 1, 'heartrate': 1, 'cadence': 1, 'velocity_smooth': 100, 'distance': 10, 'altitude': 10}
+_DTYPES = (np.int8, np.int16, np.int32, np.int64)
+
+
+def _to_array(values):
+    """Lista JSON (con posibles None) -> float64 con NaN."""
+    return np.array([np.nan if v is None else v for v in values], dtype=float) if values else np.zeros(0)
+
+
+def _encode_chunk(ints, valid):
+    deltas = np.diff(ints)
+    dtype = next((d for d in _DTYPES if deltas.size == 0 or (deltas.min() >= np.iinfo(d).min and deltas.max() <= np.iinfo(d).max)), np.int64)
+    payload = deltas.astype(dtype).tobytes()
+    has_gaps = not valid.all()
+    if has_gaps:
+        payload += np.packbits(valid).tobytes()
+    return zlib.compress(payload, 6), np.dtype(dtype).str, has_gaps
+
+
+def encode_streams(streams, chunk_size=DEFAULT_CHUNK):
+    """Codifica {canal: lista de valores} en un blob compacto."""
+    header = {"chunk_size": chunk_size, "channels": {}}
+    payloads, offset = [], 0
+    for name, values in streams.items():
+        data = _to_array(values)
+        scale = CHANNEL_SCALES.get(name, 1 if np.all(np.isnan(data) | (data == np.round(data))) else 100)
+        valid = ~np.isnan(data)
+        # Los huecos se rellenan con el último valor válido para que no rompan las diferencias
+        filled = np.where(valid, data, np.nan)
+        if valid.any():
+            idx = np.where(valid, np.arange(data.size), 0)
+            np.maximum.accumulate(idx, out=idx)
+            filled = filled[idx]
+            filled[np.isnan(filled)] = filled[valid][0]
+        ints = np.round(np.nan_to_num(filled) * scale).astype(np.int64)
+
+        chunks = []
+        for start in range(0, data.size, chunk_size):
+            part, part_valid = ints[start:start + chunk_size], valid[start:start + chunk_size]
+            blob, dtype, has_gaps = _encode_chunk(part, part_valid)
+            chunks.append([offset, len(blob), int(part[0]), dtype, has_gaps])
+            payloads.append(blob)
+            offset += len(blob)
+        header["channels"][name] = {"scale": scale, "n": int(data.size), "chunks": chunks}
+
+    header_bytes = json.dumps(header, separators=(',', ':')).encode()
+    return MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes + b"".join(payloads)
+
+
+def read_header(blob):
+    """Cabecera (índice de bloques) del archivo, sin tocar los datos."""
+    view = memoryview(blob)
+    if bytes(view[:4]) != MAGIC:
+        raise ValueError("No es un archivo de streams válido.")
+    (length,) = struct.unpack("<I", view[4:8])
+    header = json.loads(bytes(view[8:8 + length]))
+    header["data_start"] = 8 + length
+    return header
+
+
+def _decode_chunk(view, header, channel, i):
+    meta = header["channels"][channel]
+    offset, length, first, dtype, has_gaps = meta["chunks"][i]
+    n = min(header["chunk_size"], meta["n"] - i * header["chunk_size"])
+    raw = zlib.decompress(view[header["data_start"] + offset:header["data_start"] + offset + length])
+    n_delta_bytes = (n - 1) * np.dtype(dtype).itemsize
+    deltas = np.frombuffer(raw, dtype=dtype, count=n - 1)
+    values = np.empty(n, dtype=np.int64)
+    values[0] = first
+    np.cumsum(deltas, out=values[1:])
+    values[1:] += first
+    out = values / meta["scale"]
+    if has_gaps:
+        valid = np.unpackbits(np.frombuffer(raw, dtype=np.uint8, offset=n_delta_bytes), count=n).astype(bool)
+        out[~valid] = np.nan
+    return out
+
+
+def decode_streams(blob, channels=None):
+    """Decodifica canales completos como {canal: np.ndarray}."""
+    header = read_header(blob)
+    view = memoryview(blob)
+    names = channels or list(header["channels"])
+    result = {}
+    for name in names:
+        if name not in header["channels"]:
+            continue
+        n_chunks = len(header["channels"][name]["chunks"])
+        parts = [_decode_chunk(view, header, name, i) for i in range(n_chunks)]
+        result[name] = np.concatenate(parts) if parts else np.zeros(0)
+    return result
+
+
+def decode_slice(blob, start_time, end_time, channels=None):
+    """Decodifica solo las muestras con `start_time <= time < end_time` (segundos).
+
+    El primer valor de cada bloque del canal `time` está en el índice, así que se localizan
+    los bloques necesarios sin descomprimir nada más.
+    """
+    header = read_header(blob)
+    view = memoryview(blob)
+    size = header["chunk_size"]
+    if "time" in header["channels"]:
+        firsts = np.array([c[2] for c in header["channels"]["time"]["chunks"]]) / header["channels"]["time"]["scale"]
+        first_chunk = max(int(np.searchsorted(firsts, start_time, side='right')) - 1, 0)
+        last_chunk = max(int(np.searchsorted(firsts, end_time, side='left')) - 1, first_chunk)
+        time = np.concatenate([_decode_chunk(view, header, "time", i) for i in range(first_chunk, last_chunk + 1)])
+        lo = int(np.searchsorted(time, start_time, side='left'))
+        hi = int(np.searchsorted(time, end_time, side='left'))
+    else:
+        # Sin canal de tiempo se asume una muestra por segundo
+        total = max(meta["n"] for meta in header["channels"].values())
+        first_chunk, last_chunk = int(start_time) // size, min(int(end_time), total - 1) // size
+        lo, hi = int(start_time) - first_chunk * size, int(end_time) - first_chunk * size
+
+    result = {}
+    for name in channels or list(header["channels"]):
+        meta = header["channels"].get(name)
+        if meta is None:
+            continue
+        chunk_ids = range(first_chunk, min(last_chunk + 1, len(meta["chunks"])))
+        parts = [_decode_chunk(view, header, name, i) for i in chunk_ids]
+        result[name] = np.concatenate(parts)[lo:hi] if parts else np.zeros(0)
+    return result
+
+
+def duration(blob):
+    """Último valor del canal `time` (o número de muestras) sin decodificar todo el archivo."""
+    header = read_header(blob)
+    if "time" not in header["channels"]:
+        return max((meta["n"] for meta in header["channels"].values()), default=0)
+    last = len(header["channels"]["time"]["chunks"]) - 1
+    return float(_decode_chunk(memoryview(blob), header, "time", last)[-1]) if last >= 0 else 0.0
@@ -0,0 +1,53 @@
+"""Exportación a Parquet: los años deben compartir esquema aunque un campo cambie de tipo entre ellos."""
+import pyarrow as pa
+import pytest
+
+import local_store
+import settings
+import warehouse
+
+ATHLETE_ID = "i0"
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path))
+    conn = local_store.connect(ATHLETE_ID)
+    yield conn
+    conn.close()
+
+
+def _wellness(day, **fields):
+    return {"id": day, "hrv": 60.0, **fields}
+
+
+def test_type_drift_across_years(conn):
+    # 2024: `comments` siempre vacío y `feel` numérico; 2025: los dos con texto
+    local_store.upsert_wellness(conn, [_wellness("2024-05-01", comments=None, feel=3),
+                                       _wellness("2024-05-02", comments=None, feel=4)])
+    local_store.upsert_wellness(conn, [_wellness("2025-05-01", comments="cansado", feel="bien")])
+    warehouse.export(ATHLETE_ID, ['wellness'], conn=conn, log=None)
+
+    schema = warehouse.dataset(ATHLETE_ID, 'wellness').schema
+    assert schema.field('comments').type == pa.string()
+    assert schema.field('feel').type == pa.string()
+    df = warehouse.scan(ATHLETE_ID, 'wellness', columns=['date', 'comments', 'feel'])
+    assert len(df) == 3
+    assert df.sort_values('date')['feel'].tolist() == ["3", "4", "bien"]
+
+
+def test_new_year_widening_a_column_rewrites_old_years(conn):
+    local_store.upsert_wellness(conn, [_wellness("2024-05-01", feel=3), _wellness("2024-05-02", comments=None)])
+    assert warehouse.export(ATHLETE_ID, ['wellness'], conn=conn, log=None) == {'wellness': ['2024']}
+    assert warehouse.dataset(ATHLETE_ID, 'wellness').schema.field('comments').type == pa.null()
+
+    # Un año nuevo con texto en una columna numérica obliga a reescribir también los anteriores
+    local_store.upsert_wellness(conn, [_wellness("2025-05-01", feel="bien", comments="ok")])
+    assert warehouse.export(ATHLETE_ID, ['wellness'], conn=conn, log=None) == {'wellness': ['2024', '2025']}
+    df = warehouse.scan(ATHLETE_ID, 'wellness', start='2024-01-01', filters=[('feel', '==', 'bien')])
+    assert df['comments'].tolist() == ["ok"]
+
+    # Otro año solo numérico no cambia los tipos: se escribe solo ese año
+    local_store.upsert_wellness(conn, [_wellness("2026-05-01", feel=5)])
+    assert warehouse.export(ATHLETE_ID, ['wellness'], conn=conn, log=None) == {'wellness': ['2026']}
+    assert len(warehouse.scan(ATHLETE_ID, 'wellness')) == 4
@@ -0,0 +1,42 @@
+"""Historial de zonas deducido de las actividades con varios deportes mezclados."""
+import pytest
+
+import local_store
+import settings
+import zone_times
+
+ATHLETE_ID = "i0"
+RIDE_HR = [120, 140, 150, 160, 170, 180]
+RUN_HR = [130, 150, 160, 170, 180, 190]
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path))
+    conn = local_store.connect(ATHLETE_ID)
+    yield conn
+    conn.close()
+
+
+def _activity(activity_id, start, kind, ftp=None, hr_zones=None):
+    return {"id": activity_id, "start_date_local": start, "type": kind, "icu_ftp": ftp,
+            "icu_power_zones": [55, 75, 90, 105, 120, 150, 999] if ftp else None, "icu_hr_zones": hr_zones}
+
+
+def test_infer_history_ignores_other_sports(conn):
+    local_store.upsert_activities(conn, [
+        _activity("a1", "2026-03-01T08:00:00", "Ride", 250, RIDE_HR),
+        _activity("a2", "2026-03-01T18:00:00", "Run", None, RUN_HR),  # Mismo día que una salida
+        _activity("a3", "2026-03-03T08:00:00", "Run", None, RUN_HR),
+        _activity("a4", "2026-03-04T08:00:00", "WeightTraining"),
+        _activity("a5", "2026-03-05T08:00:00", "Ride", 250, RIDE_HR),
+        _activity("a6", "2026-04-01T07:00:00", "VirtualRide", 260, RIDE_HR),
+        _activity("a7", "2026-04-01T19:00:00", "Ride", 265, RIDE_HR),  # Dos salidas el mismo día: vale la última
+    ])
+    history = zone_times.infer_history(conn)
+
+    assert [(s["from"], s["ftp"], s["hr_zones"]) for s in history] == [
+        ("2026-03-01", 250, RIDE_HR), ("2026-04-01", 265, RIDE_HR)]
+    # Las salidas posteriores a una carrera siguen usando el FTP vigente
+    current = zone_times.effective_sets(history, ["2026-03-05", "2026-04-02"])
+    assert [history[i]["ftp"] for i in current] == [250, 265]
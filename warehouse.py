@@ -0,0 +1,298 @@
+"""Copia columnar (Parquet) del almacén local para consultas ad hoc sobre todo el historial.
+
+Cada tabla (bienestar, actividades, eventos y resúmenes semanales) se guarda como un dataset
+Parquet particionado por año (`warehouse/<tabla>/year=AAAA/part.parquet` en el directorio del
+atleta), con una columna por campo escalar del JSON original: números como float64, textos como
+string, campos siempre vacíos como null y `date` como fecha. El tipo de cada columna es el mismo en
+todos los años (se guarda en `_manifest.json`). Exportar solo reescribe los años cuyo contenido ha
+cambiado en SQLite (número de filas y suma de rowid, que cambia con cada INSERT OR REPLACE).
+
+Las consultas usan `pyarrow.dataset`: el rango de fechas descarta años enteros sin abrirlos
+(poda de particiones) y los filtros se evalúan al leer, con las estadísticas de cada grupo de
+filas (predicate pushdown). Los filtros son tuplas (columna, operador, valor), como en
+`pandas.read_parquet`:
+
+    scan(athlete_id, 'weekly', start='2025-01-01', end='2025-12-31',
+         columns=['period', 'tss', 'hrv'], filters=[('tss', '>', 400)])
+
+Uso por línea de comandos:
+    python warehouse.py export [--tables wellness,activities]
+    python warehouse.py query weekly --start 2025-01-01 --where "tss > 400" --columns period,tss,hrv [--out f.csv|f.parquet]
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from datetime import date
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import local_store
+from settings import athlete_dir, load_credentials
+
+TABLES = {
+    'wellness': ("wellness", "date"),
+    'activities': ("activities", "date"),
+    'events': ("events", "date"),
+    'weekly': ("weekly_rollups", "period_start"),
+}
+OPERATORS = {'==': 'equal', '=': 'equal', '!=': 'not_equal', '<': 'less', '<=': 'less_equal',
+             '>': 'greater', '>=': 'greater_equal'}
+_WHERE_RE = re.compile(r'^\s*([\w.]+)\s*(==|!=|<=|>=|=|<|>|in)\s*(.+?)\s*$', re.IGNORECASE)
+
+
+def warehouse_dir(athlete_id, table=None):
+    path = os.path.join(athlete_dir(athlete_id), "warehouse")
+    return os.path.join(path, table) if table else path
+
+
+# --- EXPORTACIÓN ---
+def _fingerprints(conn, table):
+    """(filas, suma de rowid) por año de una tabla de SQLite: cambia con cualquier alta, baja o reescritura."""
+    source, date_column = TABLES[table]
+    rows = conn.execute(f"SELECT substr({date_column}, 1, 4), COUNT(*), TOTAL(rowid) FROM {source} "
+                        f"WHERE {date_column} != '' GROUP BY 1").fetchall()
+    return {year: [count, total] for year, count, total in rows}
+
+
+def _year_frame(conn, table, year):
+    """Filas de un año con una columna por campo escalar (los de `raw` en las tablas que lo tienen)."""
+    source, date_column = TABLES[table]
+    if table == 'weekly':
+        df = pd.read_sql_query(f"SELECT * FROM {source} WHERE substr(period_start, 1, 4) = ? ORDER BY period_start", conn, params=(year,))
+        for column in ('hr_zone_times', 'power_zone_times'):
+            zones = df.pop(column).map(lambda v: json.loads(v) if v else [None] * 7)
+            for i in range(7):
+                df[f"{column}_z{i + 1}"] = zones.map(lambda z: z[i] if i < len(z) else None)
+        df['date'] = df['period_start']
+    else:
+        rows = conn.execute(f"SELECT date, raw FROM {source} WHERE substr(date, 1, 4) = ? ORDER BY date", (year,)).fetchall()
+        df = pd.DataFrame([json.loads(raw) for _, raw in rows])
+        df = df[[c for c in df.columns if not df[c].map(lambda v: isinstance(v, (list, dict))).any()]]
+        df.insert(0, 'date', [day for day, _ in rows])
+    df['date'] = pd.to_datetime(df['date'].str[:10]).dt.date
+    return df
+
+
+def _column_types(frames, types=None):
+    """Tipo de cada columna en el conjunto de años: 'float64', 'string' o None (vacía en todos).
+
+    Una columna es numérica si todos sus valores lo son en todos los años; si en alguno aparece un
+    texto pasa a ser 'string' en todos, para que los años compartan esquema.
+    """
+    types = dict(types or {})
+    for df in frames:
+        for column in df.columns:
+            if column == 'date':
+                continue
+            values = df[column]
+            if values.isna().all():
+                types.setdefault(column, None)
+            elif types.get(column) != 'string':
+                numeric = pd.to_numeric(values, errors='coerce')
+                types[column] = 'float64' if numeric.notna().sum() == values.notna().sum() else 'string'
+    return types
+
+
+def _arrow_table(df, types):
+    """Tabla de Arrow de un año con los tipos comunes a toda la tabla (las columnas siempre vacías, como null)."""
+    arrays, fields = [pa.array(df['date'], pa.date32())], [pa.field('date', pa.date32())]
+    for column in df.columns:
+        if column == 'date':
+            continue
+        kind = types.get(column)
+        if kind == 'float64':
+            array = pa.array(pd.to_numeric(df[column], errors='coerce'), pa.float64(), from_pandas=True)
+        elif kind == 'string':
+            array = pa.array(df[column].astype('string'), pa.string(), from_pandas=True)
+        else:
+            array = pa.nulls(len(df))
+        arrays.append(array)
+        fields.append(pa.field(column, array.type))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def _load_manifest(path):
+    """Huellas por año y tipos de columna de la última exportación (vacío si no existe o es de una versión anterior)."""
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+    return manifest if "years" in manifest else {"years": {}, "types": {}}
+
+
+def export(athlete_id, tables=tuple(TABLES), conn=None, log=print):
+    """Actualiza el dataset Parquet de cada tabla reescribiendo solo los años que han cambiado.
+
+    Si un año nuevo convierte en texto una columna que era numérica se reescriben todos los años,
+    para que la tabla mantenga un único tipo por columna. Devuelve {tabla: [años reescritos]}.
+    """
+    own = conn is None
+    conn = conn or local_store.connect(athlete_id)
+    written = {}
+    try:
+        for table in tables:
+            base = warehouse_dir(athlete_id, table)
+            manifest_path = os.path.join(base, "_manifest.json")
+            manifest = _load_manifest(manifest_path)
+            stored, current = manifest["years"], _fingerprints(conn, table)
+            changed = [year for year in sorted(set(stored) | set(current)) if stored.get(year) != current.get(year)]
+            frames = {year: _year_frame(conn, table, year) for year in changed if year in current}
+            types = _column_types(frames.values(), manifest["types"])
+            if any(kind is not None and types[column] != kind for column, kind in manifest["types"].items()):
+                frames = {year: _year_frame(conn, table, year) for year in sorted(current)}
+                types = _column_types(frames.values())
+                changed = sorted(set(changed) | set(current))
+            written[table] = []
+            for year in changed:
+                partition = os.path.join(base, f"year={year}")
+                shutil.rmtree(partition, ignore_errors=True)
+                if year in frames:
+                    os.makedirs(partition)
+                    pq.write_table(_arrow_table(frames[year], types), os.path.join(partition, "part.parquet"), row_group_size=4096)
+                written[table].append(year)
+            os.makedirs(base, exist_ok=True)
+            with open(manifest_path, "w") as f:
+                json.dump({"years": current, "types": types}, f)
+            if written[table] and log:
+                log(f"{table}: {len(written[table])} años reescritos ({', '.join(written[table])}).")
+    finally:
+        if own:
+            conn.close()
+    return written
+
+
+# --- CONSULTAS ---
+def dataset(athlete_id, table):
+    """Dataset Parquet de una tabla con el esquema unificado de todos sus años."""
+    if table not in TABLES:
+        raise ValueError(f"Tabla desconocida: {table}. Disponibles: {', '.join(TABLES)}")
+    base = warehouse_dir(athlete_id, table)
+    files = sorted(os.path.join(root, name) for root, _, names in os.walk(base) for name in names if name.endswith(".parquet"))
+    if not files:
+        raise LookupError(f"No hay datos exportados de `{table}`. Ejecuta `python warehouse.py export`.")
+    # Un campo puede faltar en algún año: el esquema es la unión de todos (solo se leen los metadatos)
+    try:
+        schema = pa.unify_schemas([pq.read_schema(path) for path in files], promote_options='permissive')
+    except (pa.ArrowTypeError, pa.ArrowInvalid) as e:
+        raise ValueError(f"Los años exportados de `{table}` no comparten esquema ({e}). Ejecuta `python warehouse.py export`.") from e
+    partitioning = ds.partitioning(pa.schema([('year', pa.int32())]), flavor='hive')
+    return ds.dataset(files, schema=schema.append(pa.field('year', pa.int32())), partitioning=partitioning,
+                      partition_base_dir=base, format='parquet')
+
+
+def _expression(filters):
+    """Filtros [(columna, operador, valor), ...] unidos con AND como expresión de pyarrow."""
+    expression = None
+    for column, op, value in filters or []:
+        field = ds.field(column)
+        if op.lower() == 'in':
+            condition = field.isin(list(value))
+        elif op in OPERATORS:
+            condition = getattr(pc, OPERATORS[op])(field, value)
+        else:
+            raise ValueError(f"Operador no soportado: {op}")
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def _day(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def scan(athlete_id, table, start=None, end=None, columns=None, filters=None):
+    """Filas de una tabla exportada como DataFrame.
+
+    `start`/`end` podan los años fuera del rango y filtran por `date`; `filters` se aplican al leer.
+    """
+    data = dataset(athlete_id, table)
+    bounds = list(filters or [])
+    if start:
+        start = _day(start)
+        bounds += [('year', '>=', start.year), ('date', '>=', start)]
+    if end:
+        end = _day(end)
+        bounds += [('year', '<=', end.year), ('date', '<=', end)]
+    unknown = [c for c in columns or [] if c not in data.schema.names]
+    if unknown:
+        raise ValueError(f"Columnas desconocidas en `{table}`: {', '.join(unknown)}")
+    return data.to_table(columns=columns, filter=_expression(bounds)).to_pandas()
+
+
+def parse_where(text, schema=None):
+    """Convierte "tss > 400 and type in Ride,VirtualRide" en filtros (columna, operador, valor)."""
+    filters = []
+    for clause in re.split(r'\s+and\s+', text.strip(), flags=re.IGNORECASE) if text and text.strip() else []:
+        match = _WHERE_RE.match(clause)
+        if not match:
+            raise ValueError(f"Condición no válida: {clause!r} (se espera `columna operador valor`)")
+        column, op, raw = match.groups()
+        values = [v.strip().strip("'\"") for v in raw.split(',')] if op.lower() == 'in' else [raw.strip().strip("'\"")]
+        field_type = schema.field(column).type if schema is not None and column in schema.names else None
+        if field_type is not None and pa.types.is_floating(field_type):
+            values = [float(v) for v in values]
+        elif column == 'date' or (field_type is not None and pa.types.is_date(field_type)):
+            values = [date.fromisoformat(v) for v in values]
+        elif field_type is not None and pa.types.is_integer(field_type):
+            values = [int(v) for v in values]
+        filters.append((column, op, values if op.lower() == 'in' else values[0]))
+    return filters
+
+
+# --- LÍNEA DE COMANDOS ---
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Exportación a Parquet y consultas columnares sobre el historial local.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Actualizar los datasets Parquet desde el almacén")
+    export_parser.add_argument("--tables", default=",".join(TABLES), help="Tablas separadas por comas")
+    query_parser = commands.add_parser("query", help="Consultar una tabla exportada")
+    query_parser.add_argument("table", choices=list(TABLES))
+    query_parser.add_argument("--start", type=date.fromisoformat, help="Primer día (AAAA-MM-DD)")
+    query_parser.add_argument("--end", type=date.fromisoformat, help="Último día (AAAA-MM-DD)")
+    query_parser.add_argument("--columns", help="Columnas separadas por comas (por defecto, todas)")
+    query_parser.add_argument("--where", help='Condiciones unidas con "and", p. ej. "tss > 400 and hrv >= 50"')
+    query_parser.add_argument("--out", help="Guardar el resultado en .csv o .parquet en lugar de mostrarlo")
+    query_parser.add_argument("--no-export", action="store_true", help="No actualizar antes los datasets")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    athlete_id, _ = load_credentials()
+    if args.command == "export":
+        tables = [t.strip() for t in args.tables.split(",") if t.strip()]
+        unknown = set(tables) - set(TABLES)
+        if unknown:
+            sys.exit(f"Tablas desconocidas: {', '.join(sorted(unknown))}")
+        export(athlete_id, tables)
+        return
+
+    if not args.no_export:
+        export(athlete_id, [args.table], log=None)
+    started = time.perf_counter()
+    try:
+        filters = parse_where(args.where, dataset(athlete_id, args.table).schema)
+        columns = [c.strip() for c in args.columns.split(",")] if args.columns else None
+        df = scan(athlete_id, args.table, args.start, args.end, columns, filters)
+    except (ValueError, LookupError, pa.ArrowException) as e:
+        sys.exit(str(e))
+    elapsed = (time.perf_counter() - started) * 1000
+    if args.out:
+        df.to_parquet(args.out, index=False) if args.out.endswith(".parquet") else df.to_csv(args.out, index=False)
+        print(f"{len(df)} filas guardadas en {args.out} ({elapsed:.0f} ms).")
+    else:
+        with pd.option_context('display.max_rows', 200, 'display.width', 200):
+            print(df.to_string(index=False) if len(df) else "Sin resultados.")
+        print(f"\n{len(df)} filas en {elapsed:.0f} ms.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
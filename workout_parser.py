@@ -0,0 +1,173 @@
+"""Parser de la sintaxis de entrenamientos de Intervals.icu y estimación local de NP, IF, TSS y zonas."""
+import hashlib
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+# --- FORMATO COMPACTO DE PASOS ---
+# Cada paso: duración en segundos, objetivo inicial y final (fracción de FTP o vatios) y unidad del objetivo.
+UNIT_FTP, UNIT_WATTS, UNIT_NONE = 0, 1, 2
+STEP_DTYPE = np.dtype([('duration', 'u4'), ('start', 'f4'), ('end', 'f4'), ('unit', 'u1')])
+
+# Límites superiores (%FTP) de las zonas de potencia de Coggan Z1..Z6; Z7 es todo lo que queda por encima
+POWER_ZONE_BOUNDS = np.array([0.55, 0.75, 0.90, 1.05, 1.20, 1.50])
+ZONE_TARGETS = {1: 0.50, 2: 0.65, 3: 0.83, 4: 0.98, 5: 1.13, 6: 1.35, 7: 1.60}
+
+# --- EXPRESIONES REGULARES (compiladas una sola vez) ---
+_STEP_RE = re.compile(r'^\s*-\s*(?P<body>.*)$')
+_REPEAT_RE = re.compile(r'(?:^|\s)(?P<count>\d+)\s*x(?:\s|$)', re.IGNORECASE)
+_DURATION_RE = re.compile(
+    r"""^\s*(?:(?P<h>\d+)\s*h)?\s*
+        (?:(?P<m>\d+)\s*(?:m(?!i)|')(?P<ms>\d{2})?)?\s*
+        (?:(?P<s>\d+)\s*(?:s|"))?(?=\s|$)""",
+    re.VERBOSE | re.IGNORECASE,
+)
+_RAMP_RE = re.compile(r'\bramp\s+(?P<a>\d+(?:\.\d+)?)\s*-\s*(?P<b>\d+(?:\.\d+)?)\s*%', re.IGNORECASE)
+_PCT_RE = re.compile(r'(?P<a>\d+(?:\.\d+)?)(?:\s*-\s*(?P<b>\d+(?:\.\d+)?))?\s*%(?!\s*(?:lthr|hr|pace))', re.IGNORECASE)
+_WATTS_RE = re.compile(r'(?P<a>\d+)(?:\s*-\s*(?P<b>\d+))?\s*w\b', re.IGNORECASE)
+_ZONE_RE = re.compile(r'\bZ(?P<z>[1-7])\b(?!\s*(?:hr|pace))', re.IGNORECASE)
+
+_CACHE_SIZE = 4096
+_metrics_cache = OrderedDict()
+
+
+def _parse_duration(body):
+    match = _DURATION_RE.match(body)
+    if not match or not any(match.group(g) for g in ('h', 'm', 's')):
+        return None, body
+    h, m, ms, s = (int(match.group(g) or 0) for g in ('h', 'm', 'ms', 's'))
+    return h * 3600 + m * 60 + ms + s, body[match.end():]
+
+
+def _parse_target(text):
+    """Devuelve (inicio, fin, unidad) del objetivo de un paso."""
+    ramp = _RAMP_RE.search(text)
+    if ramp:
+        return float(ramp.group('a')) / 100, float(ramp.group('b')) / 100, UNIT_FTP
+    pct = _PCT_RE.search(text)
+    if pct:
+        a = float(pct.group('a'))
+        b = float(pct.group('b')) if pct.group('b') else a
+        return (a + b) / 200, (a + b) / 200, UNIT_FTP
+    watts = _WATTS_RE.search(text)
+    if watts:
+        a = float(watts.group('a'))
+        b = float(watts.group('b')) if watts.group('b') else a
+        return (a + b) / 2, (a + b) / 2, UNIT_WATTS
+    zone = _ZONE_RE.search(text)
+    if zone:
+        target = ZONE_TARGETS[int(zone.group('z'))]
+        return target, target, UNIT_FTP
+    return 0.0, 0.0, UNIT_NONE
+
+
+def parse_workout(description):
+    """Convierte la descripción de un entrenamiento en un array compacto de pasos (repeticiones expandidas).
+
+    Las cabeceras con "Nx" abren un bloque de repeticiones que termina en la siguiente línea vacía
+    o en la siguiente cabecera, igual que en el editor de Intervals.icu.
+    """
+    steps = []
+    block, repeat = [], 1
+
+    def close_block():
+        steps.extend(block * repeat)
+
+    for line in (description or '').splitlines():
+        step = _STEP_RE.match(line)
+        if step:
+            duration, rest = _parse_duration(step.group('body'))
+            if duration:
+                block.append((duration, *_parse_target(rest)))
+            continue
+
+        close_block()
+        block = []
+        header = _REPEAT_RE.search(line) if line.strip() else None
+        repeat = int(header.group('count')) if header else 1
+
+    close_block()
+    return np.array(steps, dtype=STEP_DTYPE)
+
+
+def _power_profile(steps, ftp):
+    """Expande los pasos a un perfil segundo a segundo en fracción de FTP.
+
+    Los pasos sin objetivo de potencia (o en vatios sin FTP conocida) no se incluyen.
+    """
+    durations = steps['duration'].astype(np.int64)
+    start = steps['start'].astype(float)
+    end = steps['end'].astype(float)
+    watts = steps['unit'] == UNIT_WATTS
+    if ftp:
+        start[watts] /= ftp
+        end[watts] /= ftp
+        keep = steps['unit'] != UNIT_NONE
+    else:
+        keep = steps['unit'] == UNIT_FTP
+    durations, start, end = durations[keep], start[keep], end[keep]
+    if durations.sum() == 0:
+        return np.zeros(0)
+
+    step_idx = np.repeat(np.arange(durations.size), durations)
+    offsets = np.arange(step_idx.size) - np.repeat(np.cumsum(durations) - durations, durations)
+    frac = offsets / np.maximum(durations[step_idx], 1)
+    return start[step_idx] + (end[step_idx] - start[step_idx]) * frac
+
+
+def description_key(description):
+    """Clave estable de caché para una descripción."""
+    return hashlib.blake2b((description or '').encode(), digest_size=16).hexdigest()
+
+
+def estimate_workout(description, ftp=None):
+    """Calcula localmente NP, IF, TSS y tiempo en zonas de un entrenamiento planificado.
+
+    Los resultados se guardan por hash de la descripción (y FTP), así que puntuar
+    toda una temporada de sesiones ya vistas es inmediato.
+    """
+    key = (description_key(description), ftp)
+    if key in _metrics_cache:
+        _metrics_cache.move_to_end(key)
+        return _metrics_cache[key]
+
+    steps = parse_workout(description)
+    steps.flags.writeable = False  # el resultado se comparte desde la caché
+    profile = _power_profile(steps, ftp)
+    duration = int(steps['duration'].sum()) if steps.size else 0
+    result = {"steps": steps, "duration": duration, "np": None, "if": None, "tss": None, "zone_times": np.zeros(7, dtype=int)}
+
+    if profile.size:
+        if profile.size >= 30:
+            csum = np.concatenate([[0.0], np.cumsum(profile)])
+            rolling = (csum[30:] - csum[:-30]) / 30
+        else:
+            rolling = profile
+        intensity = float(np.mean(rolling ** 4) ** 0.25)
+        result["if"] = intensity
+        result["np"] = intensity * ftp if ftp else None
+        result["tss"] = profile.size / 3600 * intensity ** 2 * 100
+        zones = np.searchsorted(POWER_ZONE_BOUNDS, profile, side='right')
+        result["zone_times"] = np.bincount(zones, minlength=7)
+
+    _metrics_cache[key] = result
+    if len(_metrics_cache) > _CACHE_SIZE:
+        _metrics_cache.popitem(last=False)
+    return result
+
+
+def steps_to_rows(steps, ftp=None):
+    """Filas legibles de los pasos para mostrarlos en una tabla."""
+    rows = []
+    for duration, start, end, unit in steps.tolist():
+        if unit == UNIT_FTP:
+            target = f"{start * 100:.0f}%" if start == end else f"{start * 100:.0f}% → {end * 100:.0f}%"
+            watts = f"{start * ftp:.0f}" if ftp and start == end else (f"{start * ftp:.0f} → {end * ftp:.0f}" if ftp else "")
+        elif unit == UNIT_WATTS:
+            target = f"{start / ftp * 100:.0f}%" if ftp else ""
+            watts = f"{start:.0f}"
+        else:
+            target, watts = "Libre", ""
+        rows.append({"Duración (s)": duration, "Objetivo (%FTP)": target, "Potencia (W)": watts})
+    return rows
@@ -0,0 +1,261 @@
+"""Tiempo en zonas recalculado desde los streams con las zonas vigentes el día de cada actividad.
+
+`icu_zone_times` e `icu_hr_zone_times` se quedan con las zonas que había al subir la actividad, así
+que tras un cambio de FTP o de LTHR las temporadas dejan de ser comparables. Aquí se guarda un
+historial de zonas con fecha de entrada en vigor (`zone_history.json` en el directorio del atleta):
+
+    [{"from": "2026-03-01", "ftp": 250, "power_zones": [55, 75, 90, 105, 120, 150],
+      "hr_zones": [130, 145, 155, 165, 172, 178]}, ...]
+
+`power_zones` son los límites superiores de Z1 a Z6 en % del FTP y `hr_zones`, los de FC en lpm
+(Z7 es todo lo que queda por encima). Si el atleta no ha guardado uno, el historial se deduce de
+los `icu_ftp`, `icu_power_zones` e `icu_hr_zones` de sus salidas en bici.
+
+Las muestras de varias actividades se clasifican a la vez: cada actividad se desplaza a su propio
+tramo del eje para que un único `np.searchsorted` use los límites de todas, y un `np.bincount`
+cuenta los segundos por (actividad, zona). El resultado se guarda en la tabla `zone_times` con la
+versión del juego de zonas que se usó, de modo que al cambiar un juego solo se recalculan las
+actividades de sus fechas.
+"""
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import local_store
+import rollups
+import stream_archive
+from settings import athlete_dir
+
+N_ZONES = 7
+RIDE_TYPES = ('Ride', 'VirtualRide')  # Las zonas de potencia son de ciclismo
+DEFAULT_POWER_ZONES = [55, 75, 90, 105, 120, 150]  # % FTP (Coggan)
+
+
+def set_version(zone_set):
+    """Identificador corto de los límites de un juego de zonas (sin la fecha de entrada en vigor)."""
+    content = {k: v for k, v in zone_set.items() if k != "from"}
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def _limits(values, name, start):
+    if values is None:
+        return None
+    if len(values) != N_ZONES - 1 or not all(isinstance(v, (int, float)) for v in values) or list(values) != sorted(values):
+        raise ValueError(f"{start}: `{name}` debe tener {N_ZONES - 1} límites numéricos en orden creciente.")
+    return [float(v) for v in values]
+
+
+def validate_history(history):
+    """Comprueba un historial de zonas y lo devuelve ordenado por fecha. Lanza ValueError si no es válido."""
+    if not isinstance(history, list):
+        raise ValueError("El historial de zonas debe ser una lista.")
+    checked = []
+    for zone_set in history:
+        try:
+            start = pd.Timestamp(zone_set["from"]).strftime('%Y-%m-%d')
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Fecha de entrada en vigor no válida: {zone_set.get('from') if isinstance(zone_set, dict) else zone_set!r}")
+        ftp = zone_set.get("ftp")
+        if ftp is not None and (not isinstance(ftp, (int, float)) or ftp <= 0):
+            raise ValueError(f"{start}: el FTP debe ser un número positivo.")
+        checked.append({
+            "from": start,
+            "ftp": ftp,
+            "power_zones": _limits(zone_set.get("power_zones") or DEFAULT_POWER_ZONES, "power_zones", start) if ftp else None,
+            "hr_zones": _limits(zone_set.get("hr_zones"), "hr_zones", start),
+        })
+    checked.sort(key=lambda s: s["from"])
+    if len({s["from"] for s in checked}) != len(checked):
+        raise ValueError("Hay dos juegos de zonas con la misma fecha.")
+    return checked
+
+
+def infer_history(conn):
+    """Historial deducido de las salidas en bici del almacén: un juego nuevo cada día en que cambian FTP o zonas.
+
+    Solo cuentan las salidas (las zonas de FC de carrera u otros deportes son otras); si en un día hay
+    varias, vale la última. Una salida sin FTP o sin zonas de FC conserva los valores anteriores.
+    """
+    by_day, last = {}, {"ftp": None, "power_zones": None, "hr_zones": None}
+    rides = [a for a in local_store.load_activities(conn, raw=True) if a.get('type') in RIDE_TYPES]
+    for activity in sorted(rides, key=lambda a: a.get('start_date_local') or ''):
+        day = (activity.get('start_date_local') or '')[:10]
+        ftp = activity.get('icu_ftp') or last["ftp"]
+        power = (activity.get('icu_power_zones') or [])[:N_ZONES - 1] or last["power_zones"] or DEFAULT_POWER_ZONES
+        hr = (activity.get('icu_hr_zones') or [])[:N_ZONES - 1] or last["hr_zones"]
+        if not day or (not ftp and not hr):
+            continue
+        last = {"ftp": ftp, "power_zones": power, "hr_zones": hr}
+        by_day[day] = {"from": day, "ftp": ftp, "power_zones": power if ftp else None, "hr_zones": hr}
+    history = []
+    for day in sorted(by_day):
+        if not history or set_version(history[-1]) != set_version(by_day[day]):
+            history.append(by_day[day])
+    try:
+        return validate_history(history)
+    except ValueError:
+        return []
+
+
+def _history_path(athlete_id):
+    return os.path.join(athlete_dir(athlete_id), "zone_history.json")
+
+
+def load_history(athlete_id, conn=None):
+    """Historial de zonas del atleta; si no ha guardado ninguno, el deducido de sus actividades (con `conn`)."""
+    try:
+        with open(_history_path(athlete_id)) as f:
+            return validate_history(json.load(f))
+    except (FileNotFoundError, json.JSONDecodeError, ValueError):
+        return infer_history(conn) if conn is not None else []
+
+
+def save_history(athlete_id, history):
+    """Valida y guarda el historial de zonas del atleta de forma atómica."""
+    history = validate_history(history)
+    path = _history_path(athlete_id)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(history, f, indent=2)
+    os.replace(tmp, path)
+    return history
+
+
+def reset_history(athlete_id):
+    """Vuelve al historial deducido de las actividades borrando el guardado."""
+    try:
+        os.remove(_history_path(athlete_id))
+    except FileNotFoundError:
+        pass
+
+
+def effective_sets(history, dates):
+    """Índice en `history` del juego vigente en cada fecha (-1 si no hay historial).
+
+    Las fechas anteriores al primer juego usan el primero.
+    """
+    if not history:
+        return np.full(len(dates), -1)
+    starts = np.array([s["from"] for s in history], dtype='datetime64[D]')
+    days = np.array([str(d)[:10] for d in dates], dtype='datetime64[D]')
+    return np.maximum(np.searchsorted(starts, days, side='right') - 1, 0)
+
+
+def _bucket(channels, limits):
+    """Segundos por zona de cada actividad. `channels` es una lista de arrays (o None) a 1 Hz y
+    `limits` una matriz (actividades, 6) de límites absolutos, con NaN donde no hay zonas."""
+    n = len(channels)
+    out = np.full((n, N_ZONES), np.nan)
+    ok = np.array([c is not None and len(c) > 0 for c in channels], dtype=bool) & ~np.isnan(limits).any(axis=1)
+    if not ok.any():
+        return out
+    lengths = np.array([len(c) if k else 0 for c, k in zip(channels, ok)])
+    activity = np.repeat(np.arange(n), lengths)
+    values = np.concatenate([np.asarray(c, dtype=float) for c, k in zip(channels, ok) if k])
+    valid = ~np.isnan(values)
+    activity, values = activity[valid], np.maximum(values[valid], 0)
+
+    # Cada actividad ocupa el tramo [i·span, (i+1)·span) del eje: una sola búsqueda sobre los límites de todas
+    bounds = np.where(ok[:, None], limits, 0.0)
+    span = max(values.max(initial=0), bounds.max(initial=0)) + 1
+    edges = (bounds + np.arange(n)[:, None] * span).ravel()
+    zone = np.searchsorted(edges, values + activity * span, side='left') - activity * (N_ZONES - 1)
+    counts = np.bincount(activity * N_ZONES + zone, minlength=n * N_ZONES).reshape(n, N_ZONES)
+    out[ok] = counts[ok]
+    return out
+
+
+def compute_batch(streams, zone_sets):
+    """Tiempo (s) en cada zona de potencia y de FC de varias actividades a la vez.
+
+    `streams` es una lista de dicts con 'watts' y 'heartrate' (muestras a 1 Hz) y `zone_sets`, el juego
+    de zonas de cada una. Devuelve dos arrays (actividades, 7) con NaN donde falta el canal o las zonas.
+    Las muestras de FC a 0 son lecturas perdidas y no cuentan.
+    """
+    power_limits = np.array([[s["ftp"] * p / 100 for p in s["power_zones"]] if s and s.get("ftp") and s.get("power_zones")
+                             else [np.nan] * (N_ZONES - 1) for s in zone_sets], dtype=float).reshape(-1, N_ZONES - 1)
+    hr_limits = np.array([s["hr_zones"] if s and s.get("hr_zones") else [np.nan] * (N_ZONES - 1) for s in zone_sets],
+                         dtype=float).reshape(-1, N_ZONES - 1)
+    heartrate = [None if s.get('heartrate') is None else np.where(np.asarray(s['heartrate'], dtype=float) > 0, s['heartrate'], np.nan)
+                 for s in streams]
+    return _bucket([s.get('watts') for s in streams], power_limits), _bucket(heartrate, hr_limits)
+
+
+def _stored(values):
+    return None if np.isnan(values).any() else json.dumps([int(v) for v in values])
+
+
+def update(conn, history, start=None, end=None, batch_size=200):
+    """Recalcula las actividades con streams cuyo resultado falta, es de otro juego de zonas o de otra
+    versión de los streams. Devuelve cuántas se recalcularon."""
+    with conn:
+        # Resultados de streams que ya no existen
+        conn.execute("DELETE FROM zone_times WHERE activity_id NOT IN (SELECT activity_id FROM streams)")
+    if not history:
+        return 0
+    rows = conn.execute(
+        "SELECT s.activity_id, s.rowid, a.date, a.type, z.zones_version, z.stream_rowid FROM streams s "
+        "JOIN activities a ON a.id = s.activity_id LEFT JOIN zone_times z ON z.activity_id = s.activity_id "
+        "WHERE a.date BETWEEN ? AND ? AND a.date != ''",
+        (str(start or '0000-00-00'), str(end or '9999-99-99'))).fetchall()
+    versions = [set_version(s) for s in history]
+    current = effective_sets(history, [r[2] for r in rows])
+    pending = [(r[0], r[2], r[3], i) for r, i in zip(rows, current) if r[4] != versions[i] or r[5] != r[1]]
+
+    for i in range(0, len(pending), batch_size):
+        batch = pending[i:i + batch_size]
+        streams = []
+        for activity_id, _, kind, _ in batch:
+            blob = local_store.get_stream_blob(conn, activity_id)
+            channels = ['watts', 'heartrate'] if kind in RIDE_TYPES else ['heartrate']
+            streams.append(stream_archive.decode_streams(blob, channels) if blob else {})
+        # Los rowid se leen después de get_stream_blob, que puede reescribir los streams antiguos en JSON
+        rowids = dict(conn.execute(f"SELECT activity_id, rowid FROM streams WHERE activity_id IN ({', '.join('?' * len(batch))})",
+                                   [a for a, *_ in batch]))
+        power, hr = compute_batch(streams, [history[j] for *_, j in batch])
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO zone_times (activity_id, date, stream_rowid, zones_version, power_secs, hr_secs) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             [(activity_id, day, rowids[activity_id], versions[j], _stored(p), _stored(h))
+                              for (activity_id, day, _, j), p, h in zip(batch, power, hr)])
+    return len(pending)
+
+
+def period_totals(conn, history, kind, start, end):
+    """Tiempo en zonas por periodo (semana ISO o mes) que se solapa con [start, end].
+
+    Cada actividad usa su tiempo recalculado si lo hay con el juego vigente y, si no (sin streams o sin
+    zonas para ese canal), el de Intervals.icu. Devuelve un DataFrame indexado por clave de periodo con
+    `power_zone_times` y `hr_zone_times` (listas de 7 valores en segundos) y `recomputed` (actividades recalculadas).
+    """
+    span = rollups.periods(kind, start, end)
+    first, last = span[0][1], span[-1][2]
+    update(conn, history, first, last)
+    activities = local_store.load_activities(conn, first, last, raw=True)
+    versions = [set_version(s) for s in history]
+    current = effective_sets(history, [(a.get('start_date_local') or '')[:10] for a in activities])
+    stored = {a: (v, p, h) for a, v, p, h in conn.execute(
+        "SELECT activity_id, zones_version, power_secs, hr_secs FROM zone_times WHERE date BETWEEN ? AND ?", (str(first), str(last)))}
+
+    power, hr, recomputed = np.zeros((len(activities), N_ZONES)), np.zeros((len(activities), N_ZONES)), np.zeros(len(activities))
+    for i, (activity, j) in enumerate(zip(activities, current)):
+        version, power_secs, hr_secs = stored.get(activity.get('id'), (None, None, None))
+        fresh = j >= 0 and version == versions[j]
+        power[i] = json.loads(power_secs) if fresh and power_secs else rollups._zone_row(activity.get('icu_zone_times'), True)
+        hr[i] = json.loads(hr_secs) if fresh and hr_secs else rollups._zone_row(activity.get('icu_hr_zone_times'), False)
+        recomputed[i] = fresh and bool(power_secs or hr_secs)
+
+    keys = [key for key, _, _ in span]
+    a_keys = rollups._keys(kind, [(a.get('start_date_local') or '')[:10] or None for a in activities])
+    power = pd.DataFrame(power).groupby(a_keys).sum().reindex(keys, fill_value=0)
+    hr = pd.DataFrame(hr).groupby(a_keys).sum().reindex(keys, fill_value=0)
+    counts = pd.Series(recomputed).groupby(a_keys).sum().reindex(keys, fill_value=0)
+    return pd.DataFrame({
+        'power_zone_times': [row.tolist() for row in power.to_numpy()],
+        'hr_zone_times': [row.tolist() for row in hr.to_numpy()],
+        'recomputed': counts.astype(int).to_numpy(),
+    }, index=keys)